@@ -16,6 +16,80 @@ def _pbc_dist(a, b):
     return np.linalg.norm(d)
 
 
+def symmetry_operation_arrays(Operations_symmetry):
+    """
+    Операции симметрии в виде массивов (тождественная операция — первой).
+
+    Параметры
+    ----------
+    Operations_symmetry : list
+        Список операций [трансляция, матрица поворота].
+
+    Возвращает
+    -------
+    R : np.ndarray, shape (n_ops+1, 3, 3)
+    t : np.ndarray, shape (n_ops+1, 3)
+    """
+    R = np.stack([np.eye(3)] + [np.asarray(op[1], dtype=float) for op in Operations_symmetry])
+    t = np.stack([np.zeros(3)] + [np.asarray(op[0], dtype=float).reshape(3) for op in Operations_symmetry])
+    return R, t
+
+
+def orbit_operation_indices(xyz, R, t, tolerance=0.005):
+    """
+    Индексы операций (R, t), порождающих уникальные позиции атома.
+
+    Все операции применяются одним einsum, позиции приводятся к [0, 1),
+    дубликаты отбрасываются по ключу округления до сетки с шагом tolerance
+    (np.unique). Округление может разделить совпадающие позиции, лежащие
+    на границе ячейки сетки, поэтому оставшиеся позиции дополнительно
+    сравниваются попарно по PBC-расстоянию (их не больше порядка группы).
+
+    Возвращает
+    -------
+    idx : np.ndarray of int
+        Индексы операций в порядке их следования (первое вхождение позиции).
+    """
+    pos = (np.einsum('oij,j->oi', R, np.asarray(xyz, dtype=float)) + t) % 1.0     # (n_ops, 3)
+
+    # --- 1. ключ округления (с учётом периодичности: 0.9999 ≡ 0.0) ---
+    n_grid = int(round(1.0 / tolerance))
+    key    = np.round(pos / tolerance).astype(np.int64) % n_grid
+    _, first = np.unique(key, axis=0, return_index=True)
+    idx = np.sort(first)
+
+    # --- 2. попарная проверка PBC-расстояний среди оставшихся ---
+    d = pos[idx][:, None, :] - pos[idx][None, :, :]
+    d = d - np.round(d)
+    close = np.linalg.norm(d, axis=-1) < tolerance
+    keep  = ~np.any(np.tril(close, -1), axis=1)
+    return idx[keep]
+
+
+def site_free_dims(xyz, R, t, tolerance=0.005):
+    """
+    Число свободных координат позиции (размерность позиции Уайкова).
+
+    Стабилизатор позиции — операции с R·r + t ≡ r (mod 1); свободные
+    смещения лежат в пересечении ядер (R − I) по стабилизатору.
+    0 — позиция полностью задана симметрией (например, 4a и 8c в Fm-3m).
+    """
+    xyz = np.asarray(xyz, dtype=float)
+    d = np.einsum('oij,j->oi', R, xyz) + t - xyz
+    d = d - np.round(d)
+    stab = np.linalg.norm(d, axis=1) < tolerance
+    M = (R[stab] - np.eye(3)).reshape(-1, 3)
+    return 3 - np.linalg.matrix_rank(M, tol=1e-8)
+
+
+def is_centrosymmetric(Operations_symmetry, tolerance=1e-6):
+    """ Есть ли среди операций инверсия в начале координат (−I, t ≡ 0) """
+    R, t = symmetry_operation_arrays(Operations_symmetry)
+    inv = np.all(np.abs(R + np.eye(3)) < tolerance, axis=(1, 2))
+    t0  = np.all(np.abs(t - np.round(t)) < tolerance, axis=1)
+    return bool(np.any(inv & t0))
+
+
 def get_all_positions_in_cell_for_atom(x,y,z, Operations_symmetry, tolerance=0.005):         # На вход: координаты атома, матрицы операций симметрии
     """
     Генерация всех симметричных положений одного атома в элементарной ячейке.
@@ -45,23 +119,99 @@ def get_all_positions_in_cell_for_atom(x,y,z, Operations_symmetry, tolerance=0.0
     ops_sym = get_symmetry_matrix_of_crystal_lattice(cif_data)
     xyz_for_atom = get_all_positions_in_cell_for_atom(0.5, 0.5, 0.5, ops_sym)
     """
-    x,y,z,Operations_symmetry=x,y,z,Operations_symmetry
-    position      = np.array([x,y,z])                                                # Позиция атома, которую будем размножать операциями симметрии
-    all_positions = [position]
-    # --- 1. Размножение атомной позиции операциями симметрии ---
-    for i in range(len(Operations_symmetry)):                                   # Размножаем атомы всеми операциями симметрии
-      new_xyz = Operations_symmetry[i][1].dot(position[..., None])              # Умножение столбца (атомную позицию) на оператор поворота G
-      new_xyz = new_xyz.transpose()[0]                                          # Превращаем столбец в строку
-      new_xyz = new_xyz+Operations_symmetry[i][0]                               # Прибавляем вектор трансляции
-      all_positions.append(new_xyz)
-    # --- 2. Приведение всех координат в диапазон [0, 1) ---
-    all_positions = [pos % 1.0 for pos in all_positions]
-    # --- 3. Исключение дубликатов ---
-    result = []
-    for pos in all_positions:
-        if not any(_pbc_dist(pos, r) < tolerance for r in result):
-            result.append(pos)
-    return result
+    R, t = symmetry_operation_arrays(Operations_symmetry)
+    position = np.array([x, y, z], dtype=float)
+    idx = orbit_operation_indices(position, R, t, tolerance)
+    positions = (np.einsum('oij,j->oi', R[idx], position) + t[idx]) % 1.0
+    return list(positions)
+
+
+# ---- Таблица позиций (структура орбит) для фазы ----
+_SITE_TABLE_CACHE = {}
+
+
+def build_site_table(xyz_list, Operations_symmetry, tolerance=0.005):
+    """
+    Структура орбит всех атомов фазы: какие операции дают уникальные позиции.
+
+    Параметры
+    ----------
+    xyz_list : list of (x, y, z)
+        Координаты неэквивалентных атомов.
+    Operations_symmetry : list
+        Операции симметрии [трансляция, матрица поворота].
+
+    Возвращает
+    -------
+    dict
+        R        : (N_sites, 3, 3) — повороты для каждой позиции;
+        t        : (N_sites, 3)    — трансляции;
+        atom_map : (N_sites,)      — индекс неэквивалентного атома позиции;
+        fixed    : (N_atoms,)      — позиция атома полностью задана симметрией.
+
+    Позиции для новых x, y, z получаются одной матричной операцией:
+        sites = einsum('sij,sj->si', R, xyz[atom_map]) + t
+    """
+    R_all, t_all = symmetry_operation_arrays(Operations_symmetry)
+    R, t, atom_map, fixed = [], [], [], []
+    for atom_idx, xyz in enumerate(xyz_list):
+        idx = orbit_operation_indices(xyz, R_all, t_all, tolerance)
+        R.append(R_all[idx])
+        t.append(t_all[idx])
+        atom_map.append(np.full(len(idx), atom_idx))
+        fixed.append(site_free_dims(xyz, R_all, t_all, tolerance) == 0)
+    return {"R": np.concatenate(R), "t": np.concatenate(t), "atom_map": np.concatenate(atom_map),
+            "fixed": np.array(fixed, dtype=bool)}
+
+
+def wyckoff_signature(xyz_list, R, t, tolerance=0.005):
+    """
+    Сигнатура позиций Уайкова атомов (от неё зависит build_site_table).
+
+    По атому: операции орбиты (orbit_operation_indices — кратность и
+    выбор порождающих операций), site_free_dims и, для атомов на частных
+    позициях (0 свободных координат), сами координаты — от них зависит
+    постоянный геометрический фактор Gₐ (4a и 4b: одна кратность, разные Gₐ).
+
+    Считается на хосте по конкретным x, y, z: один einsum по операциям на атом.
+    """
+    signature = []
+    for xyz in np.asarray(xyz_list, dtype=float).reshape(-1, 3):
+        idx  = orbit_operation_indices(xyz, R, t, tolerance)
+        dims = int(site_free_dims(xyz, R, t, tolerance))
+        signature.append((tuple(idx.tolist()), dims, tuple(xyz.tolist()) if dims == 0 else None))
+    return tuple(signature)
+
+
+def get_site_table(key, xyz_list, Operations_symmetry, tolerance=0.005):
+    """
+    Кэшированная build_site_table.
+
+    Структура орбит (кратность позиции Уайкова и порождающие её операции)
+    не меняется, пока атомы остаются на своих позициях Уайкова, поэтому
+    таблица хранится по ключу (обычно — фаза и список атомов) вместе с
+    wyckoff_signature атомов и пересобирается, когда сигнатура для
+    текущих x, y, z отличается (атом ушёл с частной позиции или на неё).
+
+    Возвращает
+    -------
+    dict : build_site_table + wyckoff (сигнатура, по которой построена таблица)
+    """
+    entry = _SITE_TABLE_CACHE.get(key)
+    if entry is None or entry["ops"] is not Operations_symmetry:
+        R_all, t_all = symmetry_operation_arrays(Operations_symmetry)
+    else:
+        R_all, t_all = entry["R_all"], entry["t_all"]
+    signature = wyckoff_signature(xyz_list, R_all, t_all, tolerance)
+    if entry is None or entry["ops"] is not Operations_symmetry or entry["wyckoff"] != signature:
+        entry = build_site_table(xyz_list, Operations_symmetry, tolerance)
+        entry.update(ops=Operations_symmetry, R_all=R_all, t_all=t_all, wyckoff=signature)
+        _SITE_TABLE_CACHE[key] = entry
+    return entry
+
+
+def clear_site_table_cache():
+    _SITE_TABLE_CACHE.clear()
 
 
 
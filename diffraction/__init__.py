@@ -6,6 +6,34 @@ from .geometry import (
     build_delta_array,
     build_delta_array_snap,
 )
+from .registry import (
+    ParameterRegistry,
+    get_registry,
+    clear_registry_cache,
+)
+from .stage_cache import (
+    StageCache,
+    stage_cache_stats,
+    reset_stage_cache_stats,
+)
+from .structure_factor import (
+    F2_orbits_jax,
+    build_orbit_tables,
+    choose_F2_path,
+    clear_orbit_table_cache,
+)
+from .compiled import (
+    CompiledProject,
+    compile_project,
+    clear_compiled_cache,
+)
+from .joint import (
+    CompiledJoint,
+    compile_joint,
+    joint_parameters,
+    joint_snapshots,
+    clear_joint_cache,
+)
 
 
 """
@@ -26,4 +54,13 @@ phase_profile_jax
   ├── intensity_array_jax   ← сразу все I_hkl
   ├── two_theta_hkl_jax     ← сразу все μ
   └── sum_peak_profiles_jax ← сразу сумма по всем пикам
+
+
+COMPILED (jax.jit):
+------
+compile_project(snapshot, params)
+  └── CompiledProject.y_calc(θ) ← фон + все фазы, один вызов XLA
+
+compile_joint({префикс: snapshot}, params)
+  └── CompiledJoint.y_calc(θ)   ← [y₁ | y₂ | ...], общие F², один вызов XLA
 """
\ No newline at end of file
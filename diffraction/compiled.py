@@ -0,0 +1,599 @@
+import hashlib
+import numpy as np
+import jax
+import jax.numpy as jnp
+from lmfit import Model
+from functools import partial
+from phases.models import models_dict_jax, fwhm_dict_jax
+from profiles.models import background_operator, apply_background_operator
+from atoms.generate import build_site_table, is_centrosymmetric, symmetry_operation_arrays, wyckoff_signature
+from diffraction.geometry import stl_hkl_jax, two_theta_hkl_jax
+from diffraction.intensity import blackman_correction_jax
+from diffraction.structure_factor import F2_hkl_jax, F2_orbits_jax, build_orbit_tables, choose_F2_path
+from diffraction.scattering_factor import f_el_matrix_jax, f_el_kmodel_jax, kmodel_tables
+from diffraction.registry import ParameterRegistry
+from diffraction.profile import sum_peak_profiles_jax, sum_peak_profiles_windowed_jax, window_size, window_error
+from utils.format import get_value
+from phases.bragg_pos.io import as_bragg_table, bragg_hkl
+
+
+"""
+Скомпилированная (кэшируемая) прямая модель проекта.
+
+Обычный путь lmfit на каждом вызове невязки заново проходит
+build_total_model_from_snapshot → phase_profile_jax_snap: собирает hkl из
+списков, форматирует имена параметров, ищет [h,k,l] в списке calibrate и
+размножает атомы операциями симметрии. Всё это не зависит от значений
+параметров и может быть сделано один раз.
+
+CompiledProject делает это один раз при сборке:
+    snapshot + Parameters
+          │
+          ├── registry (ParameterRegistry)  # плоская раскладка θ, индексы параметров
+          ├── статические массивы по фазам  # hkl, p, режимы, индексы I/Δ/ячейки/формы
+          ├── таблица позиций атомов        # build_site_table: операции орбиты каждого атома
+          ├── таблицы орбит для F²          # build_orbit_tables: Gₐ(hkl), cos-путь для центросимметричных
+          └── оператор фона                 # Лежандр (N, n) + ленточный B-сплайн (N, 4) на оси профиля
+          │
+          ▼
+    y_calc(θ)  ← один jax.jit на весь профиль (фон + все фазы)
+    y_calc_batch(Θ) ← то же, jax.vmap по пачке θ (мульти-старт)
+"""
+
+
+# ---- Скомпилированный проект ----
+class CompiledProject:
+    """
+    Скомпилированная прямая модель: y_calc(θ) для всего профиля.
+
+    При сборке вся работа со строками (имена параметров, hkl_to_str,
+    поиск в списках calibrate/corrections) и размножение атомов
+    выполняются один раз. Остаётся одна функция под jax.jit от плоского
+    вектора θ, порядок которого задаёт param_names.
+
+    Parameters
+    ----------
+    project_snapshot : dict
+        Снимок проекта (project_to_snapshot).
+    params : lmfit.Parameters или dict
+        Параметры модели. Определяют раскладку θ; значения используются
+        только для построения орбит атомов.
+    axes : array-like, optional
+        Ось 2θ. По умолчанию — ось профиля из снимка.
+    peak_window : float, optional
+        Если задано — пики суммируются только в окне ±peak_window·FWHM
+        (sum_peak_profiles_windowed_jax). None — плотная матрица (M, N).
+    window_growth : float
+        Запас ширины окна (в точках) на уширение пиков в ходе уточнения:
+        число точек окна фиксируется при сборке по текущей FWHM × window_growth.
+    F2_max_bytes : int, optional
+        Предел объёма таблиц редуцированного пути F² (choose_F2_path);
+        0 — всегда плотный путь по всем позициям. None — F2_REDUCED_MAX_BYTES.
+    local_prefix : str
+        Префикс профиля в совместной модели (diffraction.joint): параметры
+        local_prefix + name заменяют общие (ParameterRegistry).
+
+    Примечания
+    ---------
+    - Параметры, которых нет в params, но для которых исходная модель
+      подставляет значение по умолчанию (scale, phvol, A, I_hkl, delta_hkl),
+      становятся константами и в θ не входят.
+    - Раскладка θ фиксирована: при изменении набора параметров
+      (например, добавлении I_hkl через corrections) модель нужно собрать
+      заново — это делает compile_project.
+    - Для атомов на позициях, полностью заданных симметрией, геометрический
+      структурный фактор считается при сборке (координаты не уточняются).
+    """
+
+    def __init__(self, project_snapshot, params, axes=None, peak_window=None, window_growth=2.0,
+                 F2_max_bytes=None, local_prefix=""):
+        self.snapshot    = project_snapshot
+        self.registry    = ParameterRegistry(params.keys(), local_prefix)
+        self.param_names = self.registry.names
+        self.param_index = self.registry.index
+
+        if axes is None:
+            axes = project_snapshot["profile"]["data"]["two_theta"]
+        self.axes = np.asarray(axes, dtype=float)
+        self.peak_window   = peak_window
+        self.window_growth = window_growth
+        self.F2_max_bytes  = F2_max_bytes
+
+        values = {name: get_value(params[name]) for name in self.param_names}
+        self._varied = varied_names(params)
+
+        # --- 1. Фон ---
+        self._background = self._compile_background(project_snapshot["profile"])
+
+        # --- 2. Фазы ---
+        self._phases = [self._compile_phase(phase_snap, values)
+                        for phase_snap in project_snapshot["phases"].values()]
+
+        self._consts = jnp.array(self.registry.consts, dtype=float)
+        self.y_calc  = jax.jit(self._forward)
+        self.y_calc_batch = jax.jit(jax.vmap(self._forward))     # (K, n_params) → (K, N)
+        self._y_calc_dense = jax.jit(partial(self._forward, dense=True))
+        self._jvp_batch = jax.jit(self._jvp_columns)
+        self._le_bail_phases = [prog for prog in self._phases if prog["mask_le"].any()]
+        self._le_bail_cols   = jax.jit(self._le_bail_columns)
+
+
+    # ---- Раскладка θ ----
+    @property
+    def n_params(self):
+        return self.registry.n_params
+
+    def theta_from_params(self, params):
+        """ Плоский вектор θ (float64) из lmfit.Parameters или dict """
+        return self.registry.theta_from_params(params)
+
+    def params_from_theta(self, theta, params):
+        """ Записывает θ в копию Parameters (значения, без изменения vary/границ) """
+        return self.registry.params_from_theta(theta, params)
+
+
+    # ---- Сборка фона ----
+    def _compile_background(self, profile_snap):
+        bg_type = profile_snap["background_type"]
+        if bg_type not in ("Legendre", "Spline", "Legendre + Spline"):
+            raise ValueError(f"Unknown background type: {bg_type}")
+
+        slots = self.registry.background_slots(profile_snap)
+
+        # --- Лежандр (рекуррентность) + сплайн (ленточный B-базис): один оператор на оси компиляции ---
+        degrees, legendre_idx = slots["legendre"] if slots["legendre"] is not None else (None, None)
+        xknots, spline_idx    = ((profile_snap["knots"]["x"], slots["spline"][1])
+                                 if slots["spline"] is not None else (None, None))
+        return {"operator":     background_operator(self.axes, degrees, xknots),
+                "legendre_idx": legendre_idx,
+                "spline_idx":   spline_idx}
+
+
+    # ---- Сборка фазы ----
+    def _compile_phase(self, phase_snap, values):
+        prefix   = phase_snap["prefix"]
+        settings = phase_snap["settings"]
+        bragg    = as_bragg_table(phase_snap["bragg_positions"])
+        mode_ids = np.asarray(bragg["mode"])
+
+        # --- 1. Индексы параметров: ячейка, scale/phvol/A, I_hkl (le Bail), Δ(2θ), форма ---
+        prog = {
+            "prefix":         prefix,
+            "wavelength":     phase_snap["wavelength"],
+            "hkl":            bragg_hkl(bragg).astype(float).reshape(-1, 3),
+            "mult":           np.asarray(bragg["mult"], dtype=float),
+            "mask_le":        mode_ids == 1,
+            "mask_blackman":  mode_ids == 2,
+            "has_riet":       bool((mode_ids == 0).any()),
+            "internal_scale": float(settings["internal_scale"]),
+            **self.registry.phase_slots(phase_snap),
+        }
+
+        # --- 2. Форма пика ---
+        model_name = settings["form"]
+        prog["peak_model"] = models_dict_jax[model_name]
+        shape_names = prog["shape_names"]
+
+        prog["window"] = None
+        if self.peak_window is not None:
+            if model_name not in fwhm_dict_jax:
+                raise ValueError(f"Для формы {model_name} нет оценки FWHM — усечённое суммирование невозможно")
+            fwhm_fn = fwhm_dict_jax[model_name]
+            shape0  = {n: values[self.param_names[i]] for n, i in zip(shape_names, prog["shape_idx"])}
+            fwhm0   = float(fwhm_fn(**shape0))
+            n_window = window_size(self.axes, self.peak_window * fwhm0 * self.window_growth)
+            prog["window"] = (fwhm_fn, n_window)
+
+        # --- 3. Атомы и позиции (только если есть рефлексы Ритвельда) ---
+        if prog["has_riet"]:
+            prog.update(self.registry.atom_slots(phase_snap))                 # Biso_overall, xyz, occ, Biso
+            prog["atoms"] = [{"fe": self._compile_fe(atom_snap, prefix)} for atom_snap in phase_snap["atoms"]]
+            xyz0  = [[values[self.param_names[i]] for i in row] for row in prog["xyz_idx"]]
+            table = build_site_table(xyz0, phase_snap["symmetry_operations"])
+            prog["R_sites"]  = jnp.array(table["R"])                          # (N_sites, 3, 3)
+            prog["t_sites"]  = jnp.array(table["t"])                          # (N_sites, 3)
+            prog["atom_map"] = table["atom_map"]                               # (N_sites,)
+            prog["orbits"]   = None
+            varied = _varied_atoms(phase_snap, self._varied)                   # их Gₐ не замораживается
+            if choose_F2_path(len(prog["hkl"]), table, self.F2_max_bytes, varied) == "reduced":
+                orbits = build_orbit_tables(prog["hkl"], table, xyz0,
+                                            is_centrosymmetric(phase_snap["symmetry_operations"]), varied)
+                prog["orbits"] = {k: (jnp.array(v) if isinstance(v, np.ndarray) and k != "site_atom" else v)
+                                  for k, v in orbits.items()}
+
+        # --- 4. Нормировка на длину кольца L(2θ) ---
+        L_of_ring = np.sin(np.deg2rad(self.axes) / 2.0) / phase_snap["wavelength"] * (2.0 * np.pi)
+        prog["L_safe"] = np.where(L_of_ring > 0.0, L_of_ring, 1.0)
+        return prog
+
+
+    def _compile_fe(self, atom_snap, prefix):
+        """ Функция fₑₗ(stl, θ) для атома """
+        model = atom_snap["fe_from"]
+        if model == 'it4322':
+            A = jnp.array(atom_snap['it4322']['A'])
+            B = jnp.array(atom_snap['it4322']['B'])
+            return lambda stl, th: f_el_matrix_jax(stl, A, B)
+
+        elif model == 'Mott-Bethe':
+            name, Z = atom_snap["name"], atom_snap["Z"]
+            tables    = kmodel_tables(atom_snap["curves"])
+            kappa_idx, P_idx = self.registry.kmodel_slots(prefix, name, tables["names"])
+            return lambda stl, th: f_el_kmodel_jax(stl, tables, th[kappa_idx], th[P_idx], Z)
+
+        raise ValueError(f"Unknown model for atom {atom_snap['name']}: {model}")
+
+
+    # ---- Прямая модель ----
+    def _phase_F2(self, prog, th, hkl, stl):
+        stl_sq    = stl**2
+        t_overall = jnp.exp(-th[prog["Biso_overall_idx"]] * stl_sq)
+
+        fe_el = jnp.stack([atom["fe"](stl, th) for atom in prog["atoms"]], axis=1)       # (M, N_atoms)
+        t_at  = jnp.exp(-th[prog["Biso_idx"]][None, :] * stl_sq[:, None])                # (M, N_atoms)
+
+        xyz   = th[prog["xyz_idx"]]                                                       # (N_atoms, 3)
+        if prog["orbits"] is not None:
+            return F2_orbits_jax(prog["orbits"], xyz, th[prog["occ_idx"]], fe_el, t_at, t_overall)
+
+        sites = jnp.einsum('sij,sj->si', prog["R_sites"], xyz[prog["atom_map"]]) + prog["t_sites"]
+        occ   = th[prog["occ_idx"]][prog["atom_map"]]                                     # (N_sites,)
+
+        return F2_hkl_jax(hkl, sites[:, 0], sites[:, 1], sites[:, 2],
+                          occ, fe_el, t_at, t_overall, prog["atom_map"])
+
+    def _phase_structure_F2(self, prog, th):
+        """ F²(hkl) фазы: зависит только от ячейки, атомов, Biso и κ """
+        hkl = jnp.array(prog["hkl"])
+        return self._phase_F2(prog, th, hkl, stl_hkl_jax(hkl, *th[prog["cell_idx"]]))
+
+    def _phase_profile(self, prog, th, axes, dense=False, F2=None):
+        hkl  = jnp.array(prog["hkl"])
+        cell = th[prog["cell_idx"]]
+        M    = hkl.shape[0]
+
+        # --- 1. Амплитуды (F2 — уже посчитанный F², общий для профилей совместной модели) ---
+        if prog["has_riet"]:
+            if F2 is None:
+                F2 = self._phase_structure_F2(prog, th)
+        else:
+            F2  = jnp.ones(M)
+
+        if prog["mask_blackman"].any():
+            blackman_corr = jnp.where(prog["mask_blackman"],
+                                      blackman_correction_jax(jnp.sqrt(F2), th[prog["A_idx"]]), 1.0)
+        else:
+            blackman_corr = 1.0
+
+        base_riet = th[prog["scale_idx"]] * th[prog["phvol_idx"]] * prog["mult"] * F2 * blackman_corr
+        amps = jnp.where(prog["mask_le"], prog["internal_scale"] * th[prog["I_idx"]], base_riet)
+        amps = jnp.nan_to_num(amps, nan=0)
+
+        # --- 2. Позиции пиков ---
+        mus = two_theta_hkl_jax(hkl, *cell, prog["wavelength"], th[prog["delta_idx"]])
+
+        # --- 3. Сумма профилей ---
+        shape_params = {n: th[i] for n, i in zip(prog["shape_names"], prog["shape_idx"])}
+        if prog["window"] is not None and not dense:
+            fwhm_fn, n_window = prog["window"]
+            half_width = self.peak_window * fwhm_fn(**shape_params)
+            profile = sum_peak_profiles_windowed_jax(axes, amps, mus, shape_params, prog["peak_model"],
+                                                     half_width, n_window)
+        else:
+            profile = sum_peak_profiles_jax(axes, amps, mus, shape_params, prog["peak_model"])
+        return profile / prog["L_safe"]
+
+    def _phase_le_bail_columns(self, prog, th, axes):
+        """ (N, M_le): профили рефлексов le Bail фазы при I_hkl = 1 """
+        hkl  = jnp.array(prog["hkl"][prog["mask_le"]])
+        cell = th[prog["cell_idx"]]
+        mus  = two_theta_hkl_jax(hkl, *cell, prog["wavelength"], th[prog["delta_idx"][prog["mask_le"]]])
+        shape_params = {n: th[i] for n, i in zip(prog["shape_names"], prog["shape_idx"])}
+        amps  = jnp.full(hkl.shape[0], prog["internal_scale"])
+        peaks = jax.vmap(lambda A, mu: prog["peak_model"](axes, A, mu, **shape_params))(amps, mus)   # (M_le, N)
+        if prog["window"] is not None:
+            fwhm_fn, _ = prog["window"]
+            half_width = self.peak_window * fwhm_fn(**shape_params)
+            peaks = jnp.where(jnp.abs(axes[None, :] - mus[:, None]) <= half_width, peaks, 0.0)
+        return (peaks / prog["L_safe"]).T
+
+    def le_bail_columns(self, theta):
+        """
+        Производные y_calc по интенсивностям рефлексов le Bail: A = ∂y/∂I_hkl.
+
+        y_calc линейна по I_hkl, поэтому столбцы — профили пиков с единичной
+        интенсивностью; считаются одним прямым проходом, без jvp по каждому
+        столбцу.
+
+        Parameters
+        ----------
+        theta : ndarray, shape (n_params,)
+
+        Returns
+        -------
+        idx : ndarray (K,)
+            Слоты I_hkl в θ (константы, не являющиеся параметрами, пропущены).
+        A : ndarray, shape (N, K)
+
+        Примечания
+        ---------
+        При усечённом суммировании (peak_window) пик обрезается по
+        |x − μ| ≤ half_width, но не по числу точек окна n_window.
+        """
+        idx, cols = [], []
+        for prog, A in zip(self._le_bail_phases, self._le_bail_cols(theta)):
+            slots = np.asarray(prog["I_idx"])[prog["mask_le"]]
+            keep  = slots < self.n_params
+            idx.append(slots[keep])
+            cols.append(np.asarray(A)[:, keep])
+        if not idx:
+            return np.zeros(0, dtype=int), np.zeros((len(self.axes), 0))
+        return np.concatenate(idx), np.concatenate(cols, axis=1)
+
+    def _le_bail_columns(self, theta):
+        th   = jnp.concatenate([jnp.asarray(theta, dtype=self._consts.dtype), self._consts])
+        axes = jnp.array(self.axes)
+        return [self._phase_le_bail_columns(prog, th, axes) for prog in self._le_bail_phases]
+
+    def _background_profile(self, th, axes):
+        bg = self._background
+        bckg = th[bg["legendre_idx"]] if bg["legendre_idx"] is not None else None
+        s    = th[bg["spline_idx"]] if bg["spline_idx"] is not None else None
+        return jnp.zeros_like(axes) + apply_background_operator(bg["operator"], bckg, s)
+
+    def linear_params(self):
+        """
+        Параметры, от которых y_calc зависит линейно (fit_mode='varpro').
+
+        Returns
+        -------
+        dict
+            {имя параметра: группа}; группы — "background" (bckg_n, s_i),
+            "scale", "phvol" (Ритвельд) и "intensities" (I_hkl рефлексов le Bail).
+
+        Примечания
+        ---------
+        scale и phvol одной фазы входят произведением: линейна каждая из них
+        по отдельности, но не обе сразу.
+        """
+        groups = {}
+        bg = self._background
+        for idx in (bg["legendre_idx"], bg["spline_idx"]):
+            for i in ([] if idx is None else idx):
+                groups[int(i)] = "background"
+        for prog in self._phases:
+            if prog["has_riet"]:
+                groups[int(prog["scale_idx"])] = "scale"
+                groups[int(prog["phvol_idx"])] = "phvol"
+            for i in np.asarray(prog["I_idx"])[prog["mask_le"]]:
+                groups[int(i)] = "intensities"
+        return {self.param_names[i]: g for i, g in groups.items() if i < self.n_params}
+
+    def _forward(self, theta, dense=False):
+        th   = jnp.concatenate([jnp.asarray(theta, dtype=self._consts.dtype), self._consts])
+        axes = jnp.array(self.axes)
+        y    = self._background_profile(th, axes)
+        for prog in self._phases:
+            y = y + self._phase_profile(prog, th, axes, dense=dense)
+        return y
+
+
+    # ---- Якобиан ----
+    def _jvp_columns(self, theta, C):
+        """ (N, k): производные y_calc по k направлениям θ (столбцы C) """
+        jvp = lambda v: jax.jvp(self._forward, (theta,), (v,))[1]
+        return jax.vmap(jvp, in_axes=1, out_axes=1)(C)
+
+    def jacobian(self, theta, C, chunk=8):
+        """
+        Якобиан y_calc по уточняемым параметрам: J = ∂y/∂θ · C.
+
+        Parameters
+        ----------
+        theta : ndarray, shape (n_params,)
+        C : ndarray, shape (n_params, n_var)
+            Матрица ∂θ/∂p_var: единицы для самих уточняемых параметров и
+            производные выражений (expr) для связанных.
+        chunk : int
+            Сколько направлений считается за один вызов (ограничивает память:
+            каждое направление — ещё один профиль (M, N)).
+
+        Returns
+        -------
+        J : ndarray, shape (N, n_var)
+
+        Примечания
+        ---------
+        Прямой режим (jvp) пачками по chunk столбцов. Если уточняемых
+        параметров больше, чем точек профиля, используется jax.jacrev.
+        """
+        theta = jnp.asarray(theta, dtype=self._consts.dtype)
+        C     = np.asarray(C, dtype=float)
+        n_var = C.shape[1]
+
+        if n_var > len(self.axes):
+            f = lambda u: self._forward(theta + jnp.asarray(C) @ u)
+            return np.asarray(jax.jit(jax.jacrev(f))(jnp.zeros(n_var)))
+
+        J = np.empty((len(self.axes), n_var))
+        for j0 in range(0, n_var, chunk):
+            block = C[:, j0:j0 + chunk]
+            k = block.shape[1]
+            if k < chunk:                                          # фиксированная ширина — без перекомпиляции
+                block = np.pad(block, ((0, 0), (0, chunk - k)))
+            J[:, j0:j0 + k] = np.asarray(self._jvp_batch(theta, jnp.asarray(block)))[:, :k]
+        return J
+
+
+    # ---- Удобные обёртки ----
+    def axes_slice(self, axes):
+        """ Срез оси компиляции, совпадающий с axes (сегмент подгонки) """
+        axes = np.asarray(axes, dtype=float)
+        s = int(np.searchsorted(self.axes, axes[0]))
+        e = s + len(axes)
+        if e > len(self.axes) or not np.allclose(self.axes[s:e], axes):
+            raise ValueError("Ось не совпадает с отрезком оси скомпилированной модели")
+        return slice(s, e)
+
+    def eval(self, params, axes=None):
+        """ y_calc для Parameters/dict; axes — отрезок оси компиляции """
+        y = np.asarray(self.y_calc(self.theta_from_params(params)))
+        return y if axes is None else y[self.axes_slice(axes)]
+
+    def eval_batch(self, thetas, axes=None):
+        """
+        y_calc для пачки векторов θ одним вызовом (jax.vmap).
+
+        Parameters
+        ----------
+        thetas : ndarray, shape (K, n_params)
+        axes : array-like, optional — отрезок оси компиляции
+
+        Returns
+        -------
+        Y : ndarray, shape (K, N)
+        """
+        Y = np.asarray(self.y_calc_batch(jnp.asarray(thetas, dtype=self._consts.dtype)))
+        return Y if axes is None else Y[:, self.axes_slice(axes)]
+
+    def window_error(self, params):
+        """
+        Ошибка усечённого суммирования относительно плотного для текущих параметров.
+
+        Returns
+        -------
+        dict : max_abs, max_rel (см. diffraction.profile.window_error)
+        """
+        theta = self.theta_from_params(params)
+        return window_error(self._y_calc_dense(theta), self.y_calc(theta))
+
+    def to_lmfit_model(self):
+        """ lmfit.Model поверх скомпилированной модели (замена build_total_model_from_snapshot) """
+        return Model(compiled_profile, compiled=self)
+
+
+def compiled_profile(axes, compiled=None, **params):
+    """ Функция для lmfit.Model: профиль скомпилированного проекта на оси axes """
+    return compiled.eval(params, axes=axes)
+
+
+
+# ---- Кэш скомпилированных моделей ----
+_COMPILED_CACHE = {}
+_COMPILED_CACHE_SIZE = 8
+
+
+def bragg_digest(bragg_positions):
+    """ Хэш содержимого таблицы рефлексов (смена режима рефлекса тоже меняет ключ) """
+    table = np.ascontiguousarray(as_bragg_table(bragg_positions))
+    return hashlib.sha1(table.tobytes()).hexdigest()
+
+
+def symmetry_digest(symmetry_operations, R=None, t=None):
+    """ Хэш операций симметрии: массивы R | t (не id списка — он переиспользуется после сборки мусора) """
+    if R is None:
+        R, t = symmetry_operation_arrays(symmetry_operations)
+    table = np.concatenate([np.asarray(R, dtype=float).reshape(len(R), 9), np.asarray(t, dtype=float)], axis=1)
+    return hashlib.sha1(np.ascontiguousarray(table).tobytes()).hexdigest()
+
+
+def _update_digest(h, obj):
+    """ Содержимое obj (dict / list / массивы / числа / строки) в хэш h """
+    if isinstance(obj, dict):
+        h.update(b"{%d" % len(obj))
+        for k in sorted(obj, key=str):
+            h.update(repr(k).encode())
+            _update_digest(h, obj[k])
+    elif isinstance(obj, (list, tuple)) or (isinstance(obj, np.ndarray) and obj.dtype == object):
+        h.update(b"[%d" % len(obj))
+        for item in obj:
+            _update_digest(h, item)
+    elif isinstance(obj, (np.ndarray, np.generic, int, float)) and not isinstance(obj, bool):
+        arr = np.ascontiguousarray(obj, dtype=float)
+        h.update(repr(arr.shape).encode())
+        h.update(arr.tobytes())
+    else:
+        h.update(repr(obj).encode())
+
+
+def atom_fe_digest(atom_snap):
+    """ Хэш данных fₑₗ атома: модель, коэффициенты it4322 и кривые оболочек (curves) """
+    h = hashlib.sha1(atom_snap["fe_from"].encode())
+    _update_digest(h, atom_snap.get("it4322"))
+    _update_digest(h, atom_snap.get("curves"))
+    return h.hexdigest()
+
+
+def varied_names(params):
+    """ Параметры, значение которых может меняться в подгонке: vary или expr (для dict значений — все) """
+    return frozenset(name for name, par in params.items()
+                     if not hasattr(par, "vary") or par.vary or par.expr)
+
+
+def _varied_atoms(phase_snap, varied):
+    """ По атомам фазы: уточняется ли хотя бы одна из координат x, y, z """
+    prefix = phase_snap["prefix"]
+    return np.array([any(prefix + atom_snap["name"] + c in varied for c in ('_x', '_y', '_z'))
+                     for atom_snap in phase_snap["atoms"]], dtype=bool)
+
+
+def _phase_wyckoff(phase_snap, params, R, t):
+    """ wyckoff_signature атомов фазы для значений x, y, z из params (None — у фазы нет координат) """
+    prefix = phase_snap["prefix"]
+    names  = [prefix + atom_snap["name"] + c for atom_snap in phase_snap["atoms"] for c in ('_x', '_y', '_z')]
+    if not names or any(name not in params for name in names):
+        return None
+    xyz = np.array([get_value(params[name]) for name in names], dtype=float).reshape(-1, 3)
+    return wyckoff_signature(xyz, R, t)
+
+
+def _snapshot_signature(project_snapshot, params, axes):
+    """
+    Ключ кэша: всё, от чего зависит раскладка и статические массивы модели.
+
+    Таблица позиций и постоянные Gₐ строятся по x, y, z на момент сборки,
+    поэтому в ключ входит wyckoff_signature атомов (кратности орбит,
+    свободные координаты, координаты атомов на частных позициях) и то,
+    какие атомы уточняют координаты (для них Gₐ не постоянен).
+    """
+    varied = varied_names(params)
+    phases = []
+    for name, ph in project_snapshot["phases"].items():
+        s = ph["settings"]
+        R, t = symmetry_operation_arrays(ph["symmetry_operations"])
+        phases.append((name, bragg_digest(ph["bragg_positions"]),
+                       symmetry_digest(ph["symmetry_operations"], R, t), ph["wavelength"],
+                       s["typeref"], s["form"], s["internal_scale"], s["calibration_mode"],
+                       repr(s["calibrate"]), repr(s["corrections"]),
+                       tuple((a["name"], a["fe_from"], atom_fe_digest(a)) for a in ph["atoms"]),
+                       _phase_wyckoff(ph, params, R, t), tuple(_varied_atoms(ph, varied).tolist())))
+    prof = project_snapshot["profile"]
+    return (tuple(params.keys()), tuple(phases),
+            prof["background_type"], tuple(prof["knots"]["x"]),
+            len(axes), float(axes[0]), float(axes[-1]))
+
+
+def compile_project(project_snapshot, params, axes=None, **options):
+    """
+    Возвращает CompiledProject из кэша или собирает новый.
+
+    Повторная сборка происходит только при изменении набора параметров,
+    настроек фаз, фона, оси или позиций Уайкова атомов — остальные
+    значения параметров на ключ не влияют.
+    """
+    if axes is None:
+        axes = project_snapshot["profile"]["data"]["two_theta"]
+    axes = np.asarray(axes, dtype=float)
+
+    key = _snapshot_signature(project_snapshot, params, axes) + tuple(sorted(options.items()))
+    compiled = _COMPILED_CACHE.get(key)
+    if compiled is None:
+        compiled = CompiledProject(project_snapshot, params, axes=axes, **options)
+        if len(_COMPILED_CACHE) >= _COMPILED_CACHE_SIZE:
+            _COMPILED_CACHE.pop(next(iter(_COMPILED_CACHE)))
+        _COMPILED_CACHE[key] = compiled
+    return compiled
+
+
+def clear_compiled_cache():
+    _COMPILED_CACHE.clear()
@@ -1,5 +1,6 @@
 import jax.numpy as jnp
 from phases.params import hkl_to_str
+from phases.bragg_pos.io import as_bragg_table, bragg_hkl
 
 
 """
@@ -103,10 +104,12 @@ def build_delta_array(bragg_positions, prefix, settings, numeric_params):
     use_calib = bool(settings.calibration_mode)
     calibrate_list = settings.calibrate  # может быть 'all' или список
 
+    calib_set = None if calibrate_list == 'all' else {tuple(int(v) for v in c) for c in (calibrate_list or [])}
+
     deltas = []
     for (h, k, l) in hkls:
-        if use_calib and (calibrate_list == 'all' or [h, k, l] in calibrate_list):
-            key = f"{prefix}delta_{hkl_to_str(h,k,l)}"
+        if use_calib and (calib_set is None or (h, k, l) in calib_set):
+            key = f"{prefix}delta_{hkl_to_str((h, k, l))}"
             val = numeric_params.get(key, 0.0)
             deltas.append(float(val))
         else:
@@ -121,20 +124,23 @@ def build_delta_array_snap(bragg_positions, prefix, settings, numeric_params):
     setting: my_phase.setting (python dict)
     numeric_params: dict с числовыми значениями параметров
     Возвращает jnp.array shape (M,) с delta для каждого рефлекса.
+
+    В phase_profile_jax_snap не используется: там Δ берутся gather-ом
+    по delta_idx реестра параметров (diffraction.registry).
     """
-    # преобразуем bragg_positions в numpy-подобный массив на python-уровне
-    # предполагаем, что bragg_positions — list/np.array; получаем список кортежей (h,k,l)
-    hkls = [(int(line[0]), int(line[1]), int(line[2])) for line in bragg_positions]
+    # bragg_positions снимка — структурированный массив (см. phases.bragg_pos.io)
+    hkls = [tuple(hkl) for hkl in bragg_hkl(as_bragg_table(bragg_positions)).tolist()]
 
     #use_calib = bool(setting.get('calibration mode', False))
     #calibrate_list = setting.get('calibrate', None)  # может быть 'all' или список
     use_calib = bool(settings["calibration_mode"])
     calibrate_list = settings["calibrate"]  # может быть 'all' или список
+    calib_set = None if calibrate_list == 'all' else {tuple(int(v) for v in c) for c in (calibrate_list or [])}
 
     deltas = []
     for (h, k, l) in hkls:
-        if use_calib and (calibrate_list == 'all' or [h, k, l] in calibrate_list):
-            key = f"{prefix}delta_{hkl_to_str(h,k,l)}"
+        if use_calib and (calib_set is None or (h, k, l) in calib_set):
+            key = f"{prefix}delta_{hkl_to_str((h, k, l))}"
             val = numeric_params.get(key, 0.0)
             deltas.append(float(val))
         else:
@@ -1,6 +1,9 @@
+import numpy as np
 import jax.numpy as jnp
+from phases.bragg_pos.io import as_bragg_table
 from phases.params import hkl_to_str
 from diffraction.structure_factor import F2_array_jax, F2_array_jax_snap
+from diffraction.registry import get_registry
 
 # ---- Поправка по Блэкману ----
 def blackman_correction_jax(F_mod, A, eps=1e-6):
@@ -87,19 +90,21 @@ def intensity_array_jax_snap(phase_snap, **pars):
     Snapshot-версия сборки амплитуд.
 
     Векторная версия сборки амплитуд (jax-friendly).
+    Параметры берутся gather-ом из плоского θ по индексам реестра
+    (diffraction.registry) — без форматирования имён на каждом вызове.
     Возвращает jnp.array shape (N,)
     """
-    prefix = phase_snap["prefix"]
-    bragg = phase_snap["bragg_positions"]
+    bragg = as_bragg_table(phase_snap["bragg_positions"])
     N = len(bragg)
 
-    # --- HKL как Python-список для удобства работы со строками параметров ---
-    py_hkls = [ (int(line[0]), int(line[1]), int(line[2])) for line in bragg ]
+    # --- индексы параметров фазы и плоский θ ---
+    registry = get_registry(pars)
+    slots    = registry.phase_slots(phase_snap)
+    theta    = registry.theta_ext(pars)
 
-    # --- jnp-массивы для вычислений ---
-    # hkl_array   = jnp.array(py_hkls)                        # (N,3)
-    mult_array  = jnp.array([float(line[3]) for line in bragg])  # multiplicity p (N,)
-    mode_ids    = jnp.array([int(line[9]) for line in bragg])    # 0,1,2 (N,)
+    # --- jnp-массивы для вычислений (колонки снимка) ---
+    mult_array  = jnp.asarray(np.asarray(bragg["mult"], dtype=float))   # multiplicity p (N,)
+    mode_ids    = jnp.asarray(np.asarray(bragg["mode"]))                # 0,1,2 (N,)
 
     # --- маски для разных режимов расчёта ---
     mask_riet      = (mode_ids == 0)
@@ -107,16 +112,17 @@ def intensity_array_jax_snap(phase_snap, **pars):
     mask_blackman  = (mode_ids == 2)
 
     # --- коэффициенты масштабирования и объёма фаз ---
-    scale = float(pars.get(prefix + "scale", 1.0))
-    phvol = float(pars.get(prefix + "phvol", 1.0))
+    scale = float(theta[slots["scale_idx"]])
+    phvol = float(theta[slots["phvol_idx"]])
 
     # --- F^2 для всех рефлексов ---
     compute_riet = mask_riet.any()  # True, если есть рефлексы Ритвелда
-    F2_all = jnp.where(compute_riet, F2_array_jax_snap(phase_snap, **pars), jnp.ones(N)) # заглушка, чтобы не ломался код
+    F2_snap = registry.stage_cache(phase_snap).lookup("F2", theta, lambda: F2_array_jax_snap(phase_snap, **pars))
+    F2_all = jnp.where(compute_riet, F2_snap, jnp.ones(N)) # заглушка, чтобы не ломался код
 
     # --- Blackman: коэффициент коррекции ---
     compute_blackman = mask_blackman.any()  # True, если хотя бы один рефлекс с Blackman
-    A_val = float(pars.get(prefix + "A", 0.0001))                       #          извлекаем A, если отсутствует — 1
+    A_val = float(theta[slots["A_idx"]])                                #          A, если отсутствует — 0.0001
     blackman_all = jnp.where(compute_blackman,blackman_correction_jax(jnp.sqrt(F2_all), A_val),jnp.ones(N))
     blackman_corr = jnp.where(mask_blackman, blackman_all, 1.0)      # (N,)     применяем только для соответствующих рефлексов
 
@@ -124,7 +130,7 @@ def intensity_array_jax_snap(phase_snap, **pars):
     base_riet = scale * phvol * mult_array * F2_all * blackman_corr  # (N,)
 
     # --- подготовка массива I_hkl для Le-Beil ---
-    I_all = jnp.array([ float(pars.get(f"{prefix}I_{hkl_to_str((h, k, l))}", 0.0)) for (h,k,l) in py_hkls ])   # если соответствующего ключа нет в pars — используем 0.0
+    I_all = jnp.asarray(theta[slots["I_idx"]])   # если соответствующего ключа нет в pars — слот константы 0.0
     internal_scale = phase_snap["settings"]["internal_scale"]
 
     # --- итоговая амплитуда: заменяем для Le-Beil ---
@@ -0,0 +1,287 @@
+import re
+import numpy as np
+import jax
+import jax.numpy as jnp
+from functools import partial
+from lmfit import Parameters
+from diffraction.compiled import CompiledProject, bragg_digest, _snapshot_signature
+from diffraction.registry import ParameterRegistry
+
+
+"""
+Совместная модель нескольких профилей одного образца (разные длины
+камеры / экспозиции) с общими структурными параметрами.
+
+    {префикс профиля: snapshot}  +  Parameters
+          │
+          ├── CompiledProject(snapshot, local_prefix=префикс)   # часть на оси своего профиля
+          │         параметр префикс + name (p1_bckg0, p1_Phase1_scale, ...)
+          │         заменяет общий name; остальные (ячейка, атомы, Biso, κ) — общие
+          │
+          ├── F²(hkl) фазы — один раз на все профили с одинаковыми hkl и
+          │   слотами ячейки / атомов / Biso / κ
+          ▼
+    y_calc(θ) = [y₁(θ) | y₂(θ) | ...]   ← один jax.jit, невязка — конкатенация профилей
+
+CompiledJoint — подкласс CompiledProject: ось компиляции — конкатенация
+осей профилей, поэтому make_jacobian_dfun, LinearProjector, le_bail_partition
+и fused_metrics работают с ней без изменений (сегменты — только вся ось).
+"""
+
+
+# ---- Параметры совместной модели ----
+JOINT_LOCAL_GROUPS = ("background", "scale", "shape")
+
+
+def _local_names(registry, project_snapshot, local):
+    """ Имена параметров групп local (background + группы stage_groups) """
+    idx = []
+    if "background" in local:
+        slots = registry.background_slots(project_snapshot["profile"])
+        idx += [i for kind in ("legendre", "spline") if slots[kind] is not None for i in slots[kind][1]]
+    for phase_snap in project_snapshot["phases"].values():
+        groups = registry.stage_groups(phase_snap)
+        idx += [i for group in local if group in groups for i in groups[group]]
+    return {registry.names[i] for i in idx if i < registry.n_params}
+
+
+def joint_parameters(params, project_snapshot, prefixes, local=JOINT_LOCAL_GROUPS):
+    """
+    Parameters совместной модели из параметров одного профиля.
+
+    Parameters
+    ----------
+    params : lmfit.Parameters
+        Параметры модели одного профиля.
+    project_snapshot : dict
+        Снимок проекта, которому соответствуют params.
+    prefixes : list of str
+        Префиксы профилей (ключи словаря patterns CompiledJoint).
+    local : tuple of str
+        Группы, параметры которых у каждого профиля свои: "background"
+        (bckg_n, s_i) и группы ParameterRegistry.stage_groups
+        ("scale", "shape", "delta", "intensities", ...).
+
+    Returns
+    -------
+    lmfit.Parameters
+        Общие параметры без изменений, параметры групп local — копиями
+        префикс + name для каждого профиля. В expr имена локальных
+        параметров заменяются именами того же профиля.
+
+    Примечания
+    ---------
+    Любой общий параметр можно сделать локальным и позже — достаточно
+    добавить префикс + name в Parameters (модель собирается заново).
+    """
+    names = _local_names(ParameterRegistry(params.keys()), project_snapshot, local)
+    pattern = re.compile(r"\b(" + "|".join(map(re.escape, sorted(names, key=len, reverse=True))) + r")\b") \
+        if names else None
+
+    # --- 1. значения (expr — вторым проходом: выражения ссылаются на любые параметры) ---
+    out, exprs = Parameters(), {}
+    for name, par in params.items():
+        copies = [(prefix + name, prefix) for prefix in prefixes] if name in names else [(name, None)]
+        for new_name, prefix in copies:
+            out.add(new_name, value=par.value, vary=par.vary, min=par.min, max=par.max)
+            if par.expr:
+                exprs[new_name] = par.expr if prefix is None or pattern is None else \
+                    pattern.sub(lambda m: prefix + m.group(1), par.expr)
+
+    # --- 2. связи ---
+    for name, expr in exprs.items():
+        out[name].expr = expr
+    return out
+
+
+def joint_snapshots(project_snapshot, profiles):
+    """
+    Снимки профилей совместной модели с общими фазами.
+
+    Parameters
+    ----------
+    project_snapshot : dict
+        Снимок проекта (фазы берутся из него).
+    profiles : dict
+        {префикс: снимок профиля (profilepoints_to_snapshot)}.
+
+    Returns
+    -------
+    dict : {префикс: snapshot} — словарь фаз один и тот же объект
+    """
+    return {prefix: {**project_snapshot, "profile": profile} for prefix, profile in profiles.items()}
+
+
+def joint_observed(patterns):
+    """ Конкатенация наблюдаемых профилей (I_obs_calibr) в порядке patterns """
+    return np.concatenate([np.asarray(snapshot["profile"]["data"]["I_obs_calibr"], dtype=float)
+                           for snapshot in patterns.values()])
+
+
+# ---- Совместная модель ----
+class CompiledJoint(CompiledProject):
+    """
+    Скомпилированная модель нескольких профилей: y_calc(θ) — конкатенация
+    профилей на их осях.
+
+    Parameters
+    ----------
+    patterns : dict
+        {префикс профиля: snapshot}; порядок задаёт порядок профилей в y_calc.
+    params : lmfit.Parameters или dict
+        Общая раскладка θ (например, joint_parameters).
+    peak_window, window_growth, F2_max_bytes
+        См. CompiledProject.
+
+    Атрибуты
+    --------
+    prefixes : list of str
+    parts : list of CompiledProject
+        Модели профилей (local_prefix = префикс).
+    segments : list of slice
+        Отрезки профилей в конкатенированной оси.
+
+    Примечания
+    ---------
+    - F² фазы считается один раз для всех профилей, у которых совпадают
+      таблица hkl и слоты ячейки, атомов, Biso и κ (обычно — для всех:
+      структурные параметры общие).
+    - axes_slice принимает только всю ось: отрезки 2θ разных профилей
+      перекрываются, и сегмент шага в конкатенации неоднозначен.
+    """
+
+    def __init__(self, patterns, params, peak_window=None, window_growth=2.0, F2_max_bytes=None):
+        if not patterns:
+            raise ValueError("Совместная модель: нет профилей")
+        self.snapshot    = patterns
+        self.prefixes    = list(patterns)
+        self.registry    = ParameterRegistry(params.keys())
+        self.param_names = self.registry.names
+        self.param_index = self.registry.index
+        self.peak_window   = peak_window
+        self.window_growth = window_growth
+        self.F2_max_bytes  = F2_max_bytes
+
+        # --- 1. Модели профилей ---
+        self.parts = [CompiledProject(snapshot, params, peak_window=peak_window, window_growth=window_growth,
+                                      F2_max_bytes=F2_max_bytes, local_prefix=prefix)
+                      for prefix, snapshot in patterns.items()]
+        ends = np.cumsum([len(part.axes) for part in self.parts])
+        self.segments = [slice(int(e - len(part.axes)), int(e)) for part, e in zip(self.parts, ends)]
+        self.axes = np.concatenate([part.axes for part in self.parts])
+
+        # --- 2. Общие F²: ключ — hkl и слоты стадий, от которых зависит F² ---
+        self._F2_keys = [[self._F2_key(part, phase_snap, prog)
+                          for phase_snap, prog in zip(part.snapshot["phases"].values(), part._phases)]
+                         for part in self.parts]
+
+        self._consts = jnp.zeros(0, dtype=float)
+        self.y_calc  = jax.jit(self._forward)
+        self.y_calc_batch = jax.jit(jax.vmap(self._forward))
+        self._y_calc_dense = jax.jit(partial(self._forward, dense=True))
+        self._jvp_batch = jax.jit(self._jvp_columns)
+
+    @staticmethod
+    def _F2_key(part, phase_snap, prog):
+        if not prog["has_riet"]:
+            return None
+        groups = part.registry.stage_groups(phase_snap)
+        return (prog["prefix"], bragg_digest(phase_snap["bragg_positions"]),
+                tuple((a["name"], a["fe_from"]) for a in phase_snap["atoms"]),
+                *(tuple(groups[g].tolist()) for g in ("cell", "atoms", "Biso", "kmodel")))
+
+    @property
+    def n_shared_F2(self):
+        """ Сколько вычислений F² на вызов модели экономит совместная сборка """
+        keys = [key for part_keys in self._F2_keys for key in part_keys if key is not None]
+        return len(keys) - len(set(keys))
+
+
+    # ---- Прямая модель ----
+    def _forward(self, theta, dense=False):
+        theta = jnp.asarray(theta, dtype=float)
+        F2_shared, ys = {}, []
+        for part, keys in zip(self.parts, self._F2_keys):
+            th   = jnp.concatenate([theta, part._consts])
+            axes = jnp.array(part.axes)
+            y    = part._background_profile(th, axes)
+            for prog, key in zip(part._phases, keys):
+                if key is not None and key not in F2_shared:
+                    F2_shared[key] = part._phase_structure_F2(prog, th)
+                y = y + part._phase_profile(prog, th, axes, dense=dense, F2=F2_shared.get(key))
+            ys.append(y)
+        return jnp.concatenate(ys)
+
+    def linear_params(self):
+        """ Объединение CompiledProject.linear_params профилей """
+        groups = {}
+        for part in self.parts:
+            groups.update(part.linear_params())
+        return groups
+
+    def le_bail_columns(self, theta):
+        """ CompiledProject.le_bail_columns по профилям; общие I_hkl — один столбец """
+        parts = [part.le_bail_columns(theta) for part in self.parts]
+        idx   = np.unique(np.concatenate([slots for slots, _ in parts]))
+        A     = np.zeros((len(self.axes), len(idx)))
+        for (slots, cols), seg in zip(parts, self.segments):
+            for j, k in enumerate(np.searchsorted(idx, slots)):
+                A[seg, k] += cols[:, j]
+        return idx, A
+
+
+    # ---- Ось и профили ----
+    def axes_slice(self, axes):
+        """ Вся конкатенированная ось (сегменты профилей не поддерживаются) """
+        axes = np.asarray(axes, dtype=float)
+        if len(axes) != len(self.axes) or not np.allclose(axes, self.axes):
+            raise ValueError("Совместная модель: ось должна совпадать с конкатенацией осей профилей")
+        return slice(0, len(self.axes))
+
+    def split(self, y):
+        """ Конкатенированный вектор (y_calc, невязка, веса) → {префикс: часть профиля} """
+        y = np.asarray(y)
+        return {prefix: y[seg] for prefix, seg in zip(self.prefixes, self.segments)}
+
+    def pattern_weights(self, weights):
+        """
+        Веса невязки по точкам из весов профилей.
+
+        Parameters
+        ----------
+        weights : dict
+            {префикс: число или массив на оси профиля}; отсутствующие — 1.
+        """
+        return np.concatenate([np.broadcast_to(np.asarray(weights.get(prefix, 1.0), dtype=float),
+                                               (seg.stop - seg.start,))
+                               for prefix, seg in zip(self.prefixes, self.segments)])
+
+
+
+# ---- Кэш совместных моделей ----
+_JOINT_CACHE = {}
+_JOINT_CACHE_SIZE = 4
+
+
+def compile_joint(patterns, params, **options):
+    """
+    Возвращает CompiledJoint из кэша или собирает новый.
+
+    Ключ — префиксы и сигнатуры снимков профилей (как у compile_project):
+    значения параметров и наблюдаемые профили на него не влияют.
+    """
+    key = (tuple((prefix, _snapshot_signature(snapshot, params,
+                                              np.asarray(snapshot["profile"]["data"]["two_theta"], dtype=float)))
+                 for prefix, snapshot in patterns.items())
+           + tuple(sorted(options.items())))
+    joint = _JOINT_CACHE.get(key)
+    if joint is None:
+        joint = CompiledJoint(patterns, params, **options)
+        if len(_JOINT_CACHE) >= _JOINT_CACHE_SIZE:
+            _JOINT_CACHE.pop(next(iter(_JOINT_CACHE)))
+        _JOINT_CACHE[key] = joint
+    return joint
+
+
+def clear_joint_cache():
+    _JOINT_CACHE.clear()
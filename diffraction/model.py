@@ -1,6 +1,23 @@
+import numpy as np
 from lmfit import Model
-from profiles.models import Background, Spline
+from profiles.models import Background, Spline, LegendreSpline
 from diffraction.profile import phase_profile_jax_snap
+from diffraction.registry import get_registry
+from phases.bragg_pos.io import as_bragg_table
+
+
+"""
+Модель профиля по снимку проекта и «замороженная» модель шага.
+
+    build_total_model_from_snapshot(snapshot)   ← фон + Σ фаз (phase_profile_jax_snap)
+
+    build_frozen_model(snapshot, model, params, axes)
+          │
+          ├── active_reflections   # рефлексы, зависящие от уточняемых параметров шага
+          ├── y_frozen = model(θ₀) − active(θ₀)     ← один раз в начале шага
+          ▼
+    y(θ) = y_frozen + active(θ)    ← на каждом вызове невязки только активные рефлексы (и фон)
+"""
 
 
 def build_background_model_from_snapshot(profile_snap):
@@ -12,8 +29,7 @@ def build_background_model_from_snapshot(profile_snap):
     elif bg_type == "Spline":
         return Model(Spline, xknots_str="_".join(str(x) for x in knots))
     elif bg_type == "Legendre + Spline":
-        return (Model(Background) +
-                Model(Spline, xknots_str="_".join(str(x) for x in knots)))
+        return Model(LegendreSpline, xknots_str="_".join(str(x) for x in knots))
     else:
         raise ValueError(f"Unknown background type: {bg_type}")
 
@@ -34,6 +50,131 @@ def build_total_model_from_snapshot(project_snapshot):
     return total_model
 
 
+# ---- Замороженные вклады шага ----
+# группы stage_groups, от которых зависят все рефлексы фазы
+_PHASE_WIDE_GROUPS = ("cell", "atoms", "Biso", "kmodel", "scale", "shape")
+# минимальный размер активной части фазы (см. _pad_active)
+_FROZEN_MIN_ACTIVE = 8
+
+
+def _varying_names(params):
+    """ Уточняемые параметры и параметры с expr, зависящие от них (транзитивно) """
+    varying = {n for n, p in params.items() if p.vary and not p.expr}
+    changed = True
+    while changed:
+        changed = False
+        for name, par in params.items():
+            if par.expr and name not in varying and set(getattr(par, "_expr_deps", [])) & varying:
+                varying.add(name)
+                changed = True
+    return varying
+
+
+def active_reflections(project_snapshot, params):
+    """
+    Рефлексы, профиль которых зависит от уточняемых в шаге параметров.
+
+    Parameters
+    ----------
+    project_snapshot : dict
+    params : lmfit.Parameters
+        Параметры шага (флаги vary — из params_for_next).
+
+    Returns
+    -------
+    dict : {имя фазы: ndarray (M,) bool}
+
+    Примечания
+    ---------
+    - Уточнение ячейки, scale/phvol/A, атомов, Biso, κ или формы пика
+      затрагивает все рефлексы фазы.
+    - Иначе активны только рефлексы, чьи I_hkl или delta_hkl уточняются
+      (например, шаги _I_inside / _delta_inside одного сегмента).
+    """
+    registry = get_registry(params)
+    vary_idx = np.array(sorted(registry.index[n] for n in _varying_names(params)), dtype=int)
+
+    masks = {}
+    for name, phase_snap in project_snapshot["phases"].items():
+        groups = registry.stage_groups(phase_snap)
+        slots  = registry.phase_slots(phase_snap)
+        if np.isin(np.concatenate([groups[g] for g in _PHASE_WIDE_GROUPS]), vary_idx).any():
+            masks[name] = np.ones(len(slots["I_idx"]), dtype=bool)
+        else:
+            masks[name] = np.isin(slots["I_idx"], vary_idx) | np.isin(slots["delta_idx"], vary_idx)
+    return masks
+
+
+def _pad_active(mask):
+    """
+    Дополняет активные рефлексы соседними (по номеру строки) до степени двойки.
+
+    Каждый новый размер таблицы рефлексов — новая компиляция всех
+    eager-операций JAX snapshot-пути (секунды); с округлением размеров
+    разных шагов получается не больше log₂(M) вариантов.
+    """
+    M, n = len(mask), int(mask.sum())
+    size = max(_FROZEN_MIN_ACTIVE, 1 << max(n - 1, 0).bit_length())
+    if n == 0 or size >= M:
+        return mask if n == 0 else np.ones(M, dtype=bool)
+    rows = np.arange(M)
+    active = rows[mask]
+    dist = np.min(np.abs(rows[:, None] - active[None, :]), axis=1)
+    padded = np.zeros(M, dtype=bool)
+    padded[np.argsort(dist, kind="stable")[:size]] = True
+    return padded
+
+
+def frozen_profile(axes, active=None, frozen=None, **params):
+    """ Функция для lmfit.Model: замороженный вклад + профиль активной части """
+    return frozen + active.eval(axes=axes, **params)
+
+
+def build_frozen_model(project_snapshot, model, params, axes):
+    """
+    Модель шага, в которой вклад неуточняемых рефлексов посчитан один раз.
+
+    Parameters
+    ----------
+    project_snapshot : dict
+    model : lmfit.Model
+        Полная модель проекта (pr.model).
+    params : lmfit.Parameters
+        Параметры шага; значения — начальная точка θ₀.
+    axes : ndarray
+        Ось 2θ шага (сегмент); модель годится только для неё.
+
+    Returns
+    -------
+    lmfit.Model или None
+        None — если активны все рефлексы всех фаз (выигрыша нет).
+
+    Примечания
+    ---------
+    y_frozen = model(θ₀) − active(θ₀): в θ₀ модель шага совпадает с полной
+    моделью точно, а изменение профиля даёт только активная часть (фон
+    и активные рефлексы), построенная по снимку с подмножеством рефлексов.
+    Активная часть фазы дополняется соседними рефлексами до степени двойки
+    (_pad_active), чтобы шаги с разным числом I_hkl / Δ_hkl не вызывали
+    новую компиляцию JAX.
+    """
+    masks = {name: _pad_active(mask) for name, mask in active_reflections(project_snapshot, params).items()}
+    if all(mask.all() for mask in masks.values()):
+        return None
+
+    phases = {}
+    for name, phase_snap in project_snapshot["phases"].items():
+        mask = masks[name]
+        if mask.all():
+            phases[name] = phase_snap
+        elif mask.any():
+            phases[name] = {**phase_snap, "bragg_positions": as_bragg_table(phase_snap["bragg_positions"])[mask]}
+    active = build_total_model_from_snapshot({**project_snapshot, "phases": phases})
+
+    frozen = np.asarray(model.eval(params, axes=axes)) - np.asarray(active.eval(params, axes=axes))
+    return Model(frozen_profile, active=active, frozen=frozen)
+
+
 # === Пример использования ===
 # --- Сделать snapshot ---
 # project_snapshot = project_to_snapshot(pr)
@@ -1,11 +1,15 @@
+import numpy as np
 import jax
 import jax.numpy as jnp
 # from functools import partial
-from phases.models import models_dict_jax, par_form_dict
+from phases.models import models_dict_jax, par_form_dict, fwhm_dict_jax
 from diffraction.intensity import intensity_array_jax, intensity_array_jax_snap
-from diffraction.geometry import build_delta_array, build_delta_array_snap
+from diffraction.geometry import build_delta_array
+from diffraction.registry import get_registry
+from diffraction.stage_cache import axes_digest
 from diffraction.geometry import two_theta_hkl_jax
 from utils.format import get_value
+from phases.bragg_pos.io import as_bragg_table, bragg_hkl
 
 
 """
@@ -27,8 +31,23 @@ phase_profile_jax
       │
       ├── sum_peak_profiles_jax               # (M,N) → (N,)
       │       └── Σₕₖₗ + peak model (vmapped)
+      │   или sum_peak_profiles_windowed_jax  # (M,w) → scatter-add → (N,), окно ±n·FWHM
       │
       └── L_of_ring correction                # (N,)
+
+phase_profile_jax_snap: стадии F2 / amplitudes / positions / profile берутся
+из кэша (diffraction.stage_cache), если их параметры не изменились.
+
+На отрезке оси (сегмент шага) phase_profile_jax_snap считает только
+рефлексы, дающие в него вклад (segment_phase_snapshot):
+
+    полная фаза ──► μ, амплитуды, FWHM (один раз на шаг)
+          │
+          ├── μ ∈ [2θ₀ − m, 2θ₁ + m],  m = CULL_MARGIN·FWHM       ← пики сегмента
+          └── |A·f(край − μ)| > CULL_TOLERANCE·max|A·f(0)|       ← хвосты соседей
+          │
+          ▼
+    снимок фазы с подмножеством рефлексов (F², амплитуды, профиль — только для них)
 """    
 
 
@@ -58,6 +77,79 @@ def sum_peak_profiles_jax(axes, amps, mus, shape_params_dict, peak_model):
 
 
 
+# ---- Стеккер профиля с усечённым носителем пиков ----
+def sum_peak_profiles_windowed_jax(axes, amps, mus, shape_params_dict, peak_model, half_width, n_window):
+    """
+    Суммарный профиль, в котором каждый пик считается только в окне |x − μ| ≤ half_width.
+
+    Вместо матрицы (M, N) строится (M, w): для каждого пика берутся w = n_window
+    соседних точек оси вокруг μ (searchsorted), вклад вне |x − μ| ≤ half_width
+    отбрасывается, результат раскладывается в (N,) через scatter-add.
+    Память и время ~ N + M·w вместо N·M.
+
+    Parameters
+    ----------
+    axes : jnp.array (N,)         ← ось 2θ, по возрастанию
+    amps, mus : jnp.array (M,)
+    shape_params_dict : dict      ← {'σ': scalar or array(M,), ...}
+    peak_model : callable
+    half_width : float или jnp.array (M,)
+        Полуширина окна в единицах оси (обычно n_fwhm · FWHM).
+    n_window : int
+        Число точек окна (статическое, для jit). Если окно шире, чем
+        n_window точек, пик дополнительно обрезается по краям окна.
+
+    Returns
+    -------
+    profile : jnp.array (N,)
+    """
+    N = axes.shape[0]
+    w = min(int(n_window), N)
+
+    keys = list(shape_params_dict.keys())
+    values = [shape_params_dict[k] for k in keys]
+
+    # --- 1. индексы окон: центр — ближайшая к μ точка оси ---
+    center = jnp.searchsorted(axes, mus)                                   # (M,)
+    start  = jnp.clip(center - w // 2, 0, N - w)
+    idx    = start[:, None] + jnp.arange(w)[None, :]                       # (M, w)
+    x_win  = axes[idx]                                                     # (M, w)
+
+    # --- 2. пики на своих окнах ---
+    def one_peak(x, A, mu, *shape_values):
+        kwargs = {k: v for k, v in zip(keys, shape_values)}
+        return peak_model(x, A, mu, **kwargs)                              # (w,)
+
+    in_axes = (0, 0, 0) + tuple(0 if jnp.ndim(v) > 0 else None for v in values)
+    peaks   = jax.vmap(one_peak, in_axes=in_axes)(x_win, amps, mus, *values)     # (M, w)
+
+    hw    = jnp.broadcast_to(half_width, mus.shape)[:, None]
+    peaks = jnp.where(jnp.abs(x_win - mus[:, None]) <= hw, peaks, 0.0)
+
+    # --- 3. раскладка в профиль ---
+    return jnp.zeros(N, dtype=peaks.dtype).at[idx.ravel()].add(peaks.ravel())  # (N,)
+
+
+def window_size(axes, half_width):
+    """ Число точек окна, покрывающего ±half_width на (возможно неравномерной) оси """
+    dx = float(np.min(np.diff(np.asarray(axes, dtype=float))))
+    return int(np.ceil(2.0 * float(half_width) / dx)) + 1
+
+
+def window_error(dense, windowed):
+    """
+    Оценка ошибки усечения относительно плотного суммирования.
+
+    Returns
+    -------
+    dict : max_abs — max|dense − windowed|, max_rel — max_abs / max|dense|
+    """
+    diff    = float(jnp.max(jnp.abs(dense - windowed)))
+    scale   = float(jnp.max(jnp.abs(dense)))
+    return {"max_abs": diff, "max_rel": diff / scale if scale > 0 else 0.0}
+
+
+
 # ---- Суммарный профиль ----
 def phase_profile_jax(axes, project_object=None, prefix_KPhase=None, **params):
     """
@@ -112,6 +204,142 @@ def phase_profile_jax(axes, project_object=None, prefix_KPhase=None, **params):
     return profile_normed
 
 
+# ---- Отсечение рефлексов вне сегмента ----
+CULL_ENABLED   = True
+CULL_TOLERANCE = 1e-6        # доля высоты самого сильного пика сегмента, ниже которой хвост не учитывается
+CULL_MARGIN    = 2.0         # запас (в FWHM) на сдвиг и уширение пиков в ходе шага
+_CULL_CACHE = {}
+_CULL_CACHE_SIZE = 16
+
+
+def _phase_positions(phase_snap, registry, theta):
+    """ μ (M,) всех рефлексов фазы (стадия positions) """
+    slots = registry.phase_slots(phase_snap)
+    def positions():
+        cell_array  = list(theta[slots["cell_idx"]])
+        hkl_array   = jnp.array(bragg_hkl(as_bragg_table(phase_snap["bragg_positions"])))
+        delta_array = jnp.asarray(theta[slots["delta_idx"]])
+        return two_theta_hkl_jax(hkl_array, *cell_array, phase_snap["wavelength"], delta_array)
+    return registry.stage_cache(phase_snap).lookup("positions", theta, positions)
+
+
+def _cull(axes, mus, amps, shape_params, peak_model, fwhm, tol, margin):
+    """ keep (M,), ref и хвосты пиков единичной амплитуды на краях (M,) — см. cull_reflections """
+    mus, amps = np.asarray(mus, dtype=float), np.asarray(amps, dtype=float)
+    lo, hi = float(np.min(axes)), float(np.max(axes))
+    m      = margin * fwhm
+    near   = (mus >= lo - m) & (mus <= hi + m)
+    edge   = np.where(mus < lo, lo - m, hi + m)
+    ones   = jnp.ones(len(mus))
+    unit_tail   = np.abs(np.asarray(peak_model(jnp.asarray(edge), ones, jnp.asarray(mus), **shape_params)))
+    unit_height = np.abs(np.asarray(peak_model(jnp.asarray(mus), ones, jnp.asarray(mus), **shape_params)))
+    tail   = np.abs(amps) * unit_tail                      # профили линейны по амплитуде
+    height = np.abs(amps) * unit_height
+    ref    = np.max(height[near] if near.any() else height, initial=0.0)
+    return near | (tail > tol * ref), ref, unit_tail
+
+
+def cull_reflections(axes, mus, amps, shape_params, peak_model, fwhm, tol=None, margin=None):
+    """
+    Маска рефлексов, дающих вклад в отрезок оси [axes[0], axes[-1]].
+
+    Parameters
+    ----------
+    axes : array (N,)
+    mus, amps : array (M,)
+        Позиции и амплитуды всех рефлексов фазы.
+    shape_params : dict
+        Параметры формы пика (скаляры).
+    peak_model : callable
+    fwhm : float
+        Оценка FWHM (fwhm_dict_jax).
+    tol : float, optional
+        Порог хвоста: значение пика на ближайшем крае отрезка относительно
+        высоты самого сильного пика внутри отрезка (если их нет — фазы).
+    margin : float, optional
+        Запас в FWHM: рефлексы с μ ближе margin·FWHM к отрезку берутся всегда,
+        а хвосты остальных оцениваются на краю, сдвинутом на margin·FWHM к пику.
+
+    Returns
+    -------
+    keep : ndarray (M,) bool
+
+    Примечания
+    ---------
+    tol и margin по умолчанию — CULL_TOLERANCE и CULL_MARGIN (на момент вызова).
+    """
+    tol    = CULL_TOLERANCE if tol is None else tol
+    margin = CULL_MARGIN if margin is None else margin
+    keep, _, _ = _cull(axes, mus, amps, shape_params, peak_model, fwhm, tol, margin)
+    return keep
+
+
+def _le_bail_tails_grew(entry, theta):
+    """ Хвост отсечённого рефлекса Ле Бейля с текущим I_hkl превысил порог маски """
+    if not len(entry["le_idx"]):
+        return False
+    amps = entry["internal_scale"] * np.abs(np.asarray(theta, dtype=float)[entry["le_idx"]])
+    return bool(np.any(amps * entry["le_tail"] > CULL_TOLERANCE * entry["ref"]))
+
+
+def segment_phase_snapshot(axes, phase_snap, **params):
+    """
+    Снимок фазы только с рефлексами, дающими вклад в отрезок axes.
+
+    Маска (cull_reflections) строится по текущим параметрам при первом
+    вызове для отрезка — обычно в начале шага — и используется, пока пики
+    не сдвинулись больше чем на CULL_MARGIN/2 · FWHM, FWHM не выросла
+    больше чем в CULL_MARGIN раз и хвост ни одного отсечённого рефлекса
+    Ле Бейля (mode 1: амплитуда — свободный I_hkl, обычно с начальным 0)
+    с текущим I_hkl не превысил CULL_TOLERANCE · ref; иначе строится заново.
+
+    Returns
+    -------
+    dict
+        Тот же phase_snap, если отсекать нечего (или форма без оценки FWHM);
+        иначе копия с подмножеством bragg_positions. Копия кэшируется, поэтому
+        таблицы реестра и кэш стадий для неё строятся один раз на шаг.
+    """
+    model_name = phase_snap["settings"]["form"]
+    if not CULL_ENABLED or model_name not in fwhm_dict_jax:
+        return phase_snap
+
+    registry = get_registry(params)
+    slots    = registry.phase_slots(phase_snap)
+    theta    = registry.theta_ext(params)
+    shape_params = {name: float(theta[i]) for name, i in zip(slots["shape_names"], slots["shape_idx"])}
+    fwhm = abs(float(fwhm_dict_jax[model_name](**shape_params)))
+    mus  = np.asarray(_phase_positions(phase_snap, registry, theta))
+
+    # --- 1. маска из кэша, если пики не ушли за запас и хвосты Ле Бейля не выросли ---
+    key   = (id(phase_snap), float(axes[0]), float(axes[-1]), len(axes), tuple(params.keys()))
+    entry = _CULL_CACHE.get(key)
+    if (entry is not None and entry["phase"] is phase_snap
+            and fwhm <= CULL_MARGIN * entry["fwhm"]
+            and np.max(np.abs(mus - entry["mus"]), initial=0.0) <= 0.5 * CULL_MARGIN * entry["fwhm"]
+            and not _le_bail_tails_grew(entry, theta)):
+        return entry["snap"]
+
+    # --- 2. новая маска по амплитудам и позициям всех рефлексов ---
+    amps = jnp.nan_to_num(intensity_array_jax_snap(phase_snap, **params), nan=0)
+    keep, ref, unit_tail = _cull(axes, mus, amps, shape_params, models_dict_jax[model_name], fwhm,
+                                 CULL_TOLERANCE, CULL_MARGIN)
+    bragg = as_bragg_table(phase_snap["bragg_positions"])
+    snap  = phase_snap if keep.all() else {**phase_snap, "bragg_positions": bragg[keep]}
+    le_culled = ~keep & (np.asarray(bragg["mode"]) == 1)
+
+    if len(_CULL_CACHE) >= _CULL_CACHE_SIZE:
+        _CULL_CACHE.pop(next(iter(_CULL_CACHE)))
+    _CULL_CACHE[key] = {"phase": phase_snap, "snap": snap, "mus": mus, "fwhm": fwhm, "ref": ref,
+                        "le_idx": np.asarray(slots["I_idx"])[le_culled], "le_tail": unit_tail[le_culled],
+                        "internal_scale": float(phase_snap["settings"]["internal_scale"])}
+    return snap
+
+
+def clear_cull_cache():
+    _CULL_CACHE.clear()
+
+
 # ---- Суммарный профиль (по снимку) ----
 def phase_profile_jax_snap(axes, project_snap=None, phase_name=None, **params):
     """
@@ -128,43 +356,42 @@ def phase_profile_jax_snap(axes, project_snap=None, phase_name=None, **params):
     Returns:
         profile : jnp.array (N,) – суммарный профиль
     """
-    phase_snap = project_snap["phases"][phase_name]
+    phase_snap = segment_phase_snapshot(axes, project_snap["phases"][phase_name], **params)   # только рефлексы сегмента
+    if len(as_bragg_table(phase_snap["bragg_positions"])) == 0:
+        return jnp.zeros(len(axes))
+    registry   = get_registry(params)                 # индексы параметров (строятся один раз на снимок)
+    slots      = registry.phase_slots(phase_snap)
+    theta      = registry.theta_ext(params)
+    stages     = registry.stage_cache(phase_snap)     # кэш стадий по значениям их групп параметров
 
     # --- 1. Массив амплитуд ---
-    amps    = intensity_array_jax_snap(phase_snap, **params)  # (M,)
-    amps    = jnp.nan_to_num(amps, nan=0)   # тоже заменяет NaN на I_0_0_0
+    def amplitudes():
+        amps = intensity_array_jax_snap(phase_snap, **params)  # (M,)
+        return jnp.nan_to_num(amps, nan=0)                     # тоже заменяет NaN на I_0_0_0
+    amps = stages.lookup("amplitudes", theta, amplitudes)
 
 
     # --- 2. Позиции пиков (центры, 2θ) ---
-    cell_array  = [get_value(params[phase_snap["prefix"] + par]) for par in ['a','b','c','alpha','beta','gamma']]
-    hkl_array   = jnp.array([line[:3] for line in phase_snap["bragg_positions"]])
-    #delta_array = build_delta_array(my_phase.bragg_positions, my_phase.prefix, my_phase.setting, params)
-    delta_array = build_delta_array_snap(phase_snap["bragg_positions"], phase_snap["prefix"], phase_snap["settings"], params)
-    mus         = two_theta_hkl_jax(hkl_array, *cell_array, phase_snap["wavelength"], delta_array)
+    mus = _phase_positions(phase_snap, registry, theta)
 
     # --- 3. Определение модели профиля ---
     model_name = phase_snap["settings"]["form"]
     peak_model = models_dict_jax[model_name]
 
     # --- 4. Сбор shape-параметров для модели ---
-    shape_params_dict = {}
-    for par_def in par_form_dict[model_name]:
-        name = par_def['name']
-        if name in ['A', 'μ']:
-            continue                                                            # амплитуда и центр обрабатываются отдельно
-        full_name = phase_snap["prefix"] + model_name + '_' + name
-        shape_params_dict[name] = get_value(params[full_name])
+    shape_params_dict = {name: theta[i] for name, i in zip(slots["shape_names"], slots["shape_idx"])}
 
     # --- 5. Суммирование профилей всех рефлексов ---
-    profile = sum_peak_profiles_jax(jnp.array(axes), amps, mus, shape_params_dict, peak_model)
+    def profile():
+        profile = sum_peak_profiles_jax(jnp.array(axes), amps, mus, shape_params_dict, peak_model)
 
-    L_of_ring = jnp.sin(jnp.deg2rad(axes) / 2.0) / phase_snap["wavelength"] * (2.0 * jnp.pi)
-    # защитим от деления на ноль — если L_of_ring == 0 (в начале оси),
-    # заменим на 1.0 чтобы не получить inf; это аналогично исключению нулевого рефлекса
-    L_safe = jnp.where(L_of_ring > 0.0, L_of_ring, 1.0)
+        L_of_ring = jnp.sin(jnp.deg2rad(axes) / 2.0) / phase_snap["wavelength"] * (2.0 * jnp.pi)
+        # защитим от деления на ноль — если L_of_ring == 0 (в начале оси),
+        # заменим на 1.0 чтобы не получить inf; это аналогично исключению нулевого рефлекса
+        L_safe = jnp.where(L_of_ring > 0.0, L_of_ring, 1.0)
+        return profile / L_safe
 
-    profile_normed = profile / L_safe
-    return profile_normed
+    return stages.lookup("profile", theta, profile, extra=(axes_digest(axes),))
 
 
 
@@ -0,0 +1,282 @@
+import re
+import numpy as np
+from lmfit.models import SplineModel
+from phases.models import par_form_dict
+from phases.params import hkl_to_str
+from phases.bragg_pos.io import as_bragg_table, bragg_hkl
+from utils.format import get_value
+from diffraction.scattering_factor import kmodel_tables
+from diffraction.stage_cache import StageCache
+
+
+"""
+Реестр параметров: имя lmfit-параметра → целочисленный слот плоского вектора θ.
+
+Вся работа со строками (f"{prefix}I_{hkl_to_str(hkl)}", поиск [h,k,l] в
+calibrate, имена атомов и формы пика) выполняется один раз при построении
+таблиц индексов. На горячем пути модель получает один вектор float64 и
+делает gather: θ[I_idx], θ[delta_idx], θ[xyz_idx], ...
+
+    names (порядок Parameters)
+          │
+          ├── slot(name, default)        # индекс в расширенном θ
+          ├── const_slot(value)          # значения по умолчанию → хвост θ
+          │
+          ├── phase_slots(phase_snap)    # ячейка, scale/phvol/A, I_hkl, Δ_hkl, форма
+          ├── atom_slots(phase_snap)     # Biso_overall, xyz, occ, Biso
+          ├── kmodel_slots(...)          # κ и P оболочек (Mott-Bethe)
+          ├── background_slots(profile)  # bckg_n, s_i
+          │
+          ├── stage_groups(phase_snap)   # индексы по группам: cell, atoms, Biso, kmodel, ...
+          └── stage_cache(phase_snap)    # кэш стадий F2 / amplitudes / positions / profile
+          │
+          ▼
+    theta_ext(values) = [θ | константы]
+"""
+
+
+_PHASE_CACHE_SIZE = 32
+
+
+# ---- Реестр ----
+class ParameterRegistry:
+    """
+    Стабильная раскладка параметров в плоский вектор θ.
+
+    Parameters
+    ----------
+    names : iterable of str
+        Имена параметров в порядке θ (обычно params.keys()).
+    local_prefix : str
+        Префикс профиля в совместной модели (diffraction.joint): параметр
+        local_prefix + name, если он есть в names, заменяет общий name.
+
+    Примечания
+    ---------
+    - Параметр, отсутствующий в names, но имеющий значение по умолчанию
+      (scale, phvol, A, I_hkl, delta_hkl), получает слот константы в конце
+      расширенного θ; без значения по умолчанию — KeyError.
+    - Таблицы индексов фаз кэшируются по объекту снимка фазы: новый снимок —
+      новые таблицы.
+    """
+
+    def __init__(self, names, local_prefix=""):
+        self.names = list(names)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.local_prefix = local_prefix
+        self._const_values = []
+        self._const_slots  = {}
+        self._phase_cache  = {}
+
+    @property
+    def n_params(self):
+        return len(self.names)
+
+    @property
+    def consts(self):
+        """ Значения констант (хвост расширенного θ) """
+        return np.array(self._const_values, dtype=float)
+
+
+    # ---- Слоты ----
+    def slot(self, name, default=None):
+        """ Индекс параметра в расширенном θ (θ + константы) """
+        if self.local_prefix and self.local_prefix + name in self.index:
+            return self.index[self.local_prefix + name]
+        if name in self.index:
+            return self.index[name]
+        if default is None:
+            raise KeyError(f"Параметр {name} отсутствует в params")
+        return self.const_slot(default)
+
+    def const_slot(self, value):
+        """ Индекс константы в расширенном θ """
+        value = float(value)
+        if value not in self._const_slots:
+            self._const_slots[value] = self.n_params + len(self._const_values)
+            self._const_values.append(value)
+        return self._const_slots[value]
+
+
+    # ---- θ ⇄ Parameters ----
+    def theta_from_params(self, params):
+        """ Плоский вектор θ (float64) из lmfit.Parameters или dict """
+        return np.array([get_value(params[name]) for name in self.names], dtype=float)
+
+    def theta_ext(self, params):
+        """ Расширенный θ: значения параметров + константы """
+        return np.concatenate([self.theta_from_params(params), self.consts])
+
+    def params_from_theta(self, theta, params):
+        """ Записывает θ в копию Parameters (значения, без изменения vary/границ) """
+        new_params = params.copy()
+        for name, val in zip(self.names, np.asarray(theta)):
+            if name in new_params and not new_params[name].expr:
+                new_params[name].value = float(val)
+        new_params.update_constraints()
+        return new_params
+
+
+    # ---- Таблицы индексов ----
+    def _cached(self, kind, phase_snap, build):
+        key = (kind, id(phase_snap))
+        entry = self._phase_cache.get(key)
+        if entry is None or entry[0] is not phase_snap:
+            if len(self._phase_cache) >= _PHASE_CACHE_SIZE:
+                self._phase_cache.pop(next(iter(self._phase_cache)))
+            entry = (phase_snap, build(phase_snap))
+            self._phase_cache[key] = entry
+        return entry[1]
+
+    def phase_slots(self, phase_snap):
+        """
+        Индексы параметров фазы.
+
+        Returns
+        -------
+        dict
+            cell_idx (6,), scale_idx, phvol_idx, A_idx,
+            I_idx (M,), delta_idx (M,)    ← по строкам таблицы рефлексов,
+            shape_names, shape_idx        ← параметры формы пика (без A, μ).
+        """
+        return self._cached("phase", phase_snap, self._build_phase_slots)
+
+    def _build_phase_slots(self, phase_snap):
+        prefix   = phase_snap["prefix"]
+        settings = phase_snap["settings"]
+        hkls     = [tuple(hkl) for hkl in bragg_hkl(as_bragg_table(phase_snap["bragg_positions"])).tolist()]
+
+        # --- Δ(2θ): только для калибруемых рефлексов, иначе 0 ---
+        calibrate = settings["calibrate"]
+        calib_set = None if calibrate == 'all' else {tuple(int(v) for v in c) for c in (calibrate or [])}
+        delta_idx = []
+        for hkl in hkls:
+            if settings["calibration_mode"] and (calib_set is None or hkl in calib_set):
+                delta_idx.append(self.slot(f"{prefix}delta_{hkl_to_str(hkl)}", 0.0))
+            else:
+                delta_idx.append(self.const_slot(0.0))
+
+        model_name  = settings["form"]
+        shape_names = [p['name'] for p in par_form_dict[model_name] if p['name'] not in ['A', 'μ']]
+        return {
+            "cell_idx":    np.array([self.slot(prefix + p) for p in ['a', 'b', 'c', 'alpha', 'beta', 'gamma']]),
+            "scale_idx":   self.slot(prefix + "scale", 1.0),
+            "phvol_idx":   self.slot(prefix + "phvol", 1.0),
+            "A_idx":       self.slot(prefix + "A", 0.0001),
+            "I_idx":       np.array([self.slot(f"{prefix}I_{hkl_to_str(hkl)}", 0.0) for hkl in hkls], dtype=int),
+            "delta_idx":   np.array(delta_idx, dtype=int),
+            "shape_names": shape_names,
+            "shape_idx":   np.array([self.slot(f"{prefix}{model_name}_{n}") for n in shape_names], dtype=int),
+        }
+
+    def atom_slots(self, phase_snap):
+        """
+        Индексы атомных параметров фазы.
+
+        Returns
+        -------
+        dict : Biso_overall_idx, xyz_idx (N_atoms, 3), occ_idx (N_atoms,), Biso_idx (N_atoms,)
+        """
+        return self._cached("atoms", phase_snap, self._build_atom_slots)
+
+    def _build_atom_slots(self, phase_snap):
+        prefix = phase_snap["prefix"]
+        names  = [atom_snap["name"] for atom_snap in phase_snap["atoms"]]
+        return {
+            "Biso_overall_idx": self.slot(prefix + "Biso_overall"),
+            "xyz_idx":  np.array([[self.slot(prefix + n + c) for c in ('_x', '_y', '_z')] for n in names],
+                                 dtype=int).reshape(-1, 3),
+            "occ_idx":  np.array([self.slot(prefix + n + '_occ') for n in names], dtype=int),
+            "Biso_idx": np.array([self.slot(prefix + n + '_Biso') for n in names], dtype=int),
+        }
+
+    def kmodel_slots(self, prefix, atom_name, shells):
+        """ Индексы κ и P валентных оболочек атома (каппа-модель) """
+        kappa_idx = np.array([self.slot(prefix + atom_name + '_' + shell + '_kappa') for shell in shells], dtype=int)
+        P_idx     = np.array([self.slot(prefix + atom_name + '_' + shell + '_P') for shell in shells], dtype=int)
+        return kappa_idx, P_idx
+
+    def stage_groups(self, phase_snap):
+        """
+        Индексы параметров фазы по группам, от которых зависят стадии
+        конвейера (diffraction.stage_cache.STAGE_DEPENDENCIES).
+
+        Returns
+        -------
+        dict : cell, atoms (xyz, occ), Biso (Biso_overall, Biso), kmodel (κ, P),
+               scale (scale, phvol, A), intensities (I_hkl), delta, shape
+        """
+        return self._cached("groups", phase_snap, self._build_stage_groups)
+
+    def _build_stage_groups(self, phase_snap):
+        prefix   = phase_snap["prefix"]
+        slots    = self.phase_slots(phase_snap)
+        at_slots = self.atom_slots(phase_snap)
+        kmodel   = [np.concatenate(self.kmodel_slots(prefix, a["name"], kmodel_tables(a["curves"])["names"]))
+                    for a in phase_snap["atoms"] if a["fe_from"] == 'Mott-Bethe']
+        as_idx = lambda *arrays: np.concatenate([np.asarray(a, dtype=int).ravel() for a in arrays])
+        return {
+            "cell":        as_idx(slots["cell_idx"]),
+            "atoms":       as_idx(at_slots["xyz_idx"], at_slots["occ_idx"]),
+            "Biso":        as_idx([at_slots["Biso_overall_idx"]], at_slots["Biso_idx"]),
+            "kmodel":      as_idx(*kmodel) if kmodel else np.zeros(0, dtype=int),
+            "scale":       as_idx([slots["scale_idx"], slots["phvol_idx"], slots["A_idx"]]),
+            "intensities": as_idx(slots["I_idx"]),
+            "delta":       as_idx(slots["delta_idx"]),
+            "shape":       as_idx(slots["shape_idx"]),
+        }
+
+    def stage_cache(self, phase_snap):
+        """ Кэш стадий фазы (StageCache); новый снимок фазы — пустой кэш """
+        return self._cached("stages", phase_snap, lambda ps: StageCache(self.stage_groups(ps)))
+
+    def background_slots(self, profile_snap):
+        """
+        Индексы параметров фона.
+
+        Returns
+        -------
+        dict
+            legendre : (degrees, idx) или None   ← bckg_n, по возрастанию n;
+            spline   : (names, idx) или None     ← s_i узлов сплайна.
+        """
+        bg_type = profile_snap["background_type"]
+        slots = {"legendre": None, "spline": None}
+        if "Legendre" in bg_type:
+            items = []
+            for prefix in dict.fromkeys((self.local_prefix, "")):     # свои bckg_n профиля, иначе общие
+                items = items or sorted((int(m.group(1)), name) for name in self.names
+                                        for m in [re.fullmatch(re.escape(prefix) + r"bckg(\d+)", name)] if m)
+            if items:
+                slots["legendre"] = (tuple(n for n, _ in items),
+                                     np.array([self.index[name] for _, name in items], dtype=int))
+        if "Spline" in bg_type:
+            knots = [float(x) for x in profile_snap["knots"]["x"]]
+            names = list(SplineModel(xknots=knots).make_params().keys())
+            slots["spline"] = (names, np.array([self.slot(name) for name in names], dtype=int))
+        return slots
+
+
+
+# ---- Кэш реестров для snapshot-пути ----
+_REGISTRY_CACHE = {}
+_REGISTRY_CACHE_SIZE = 8
+
+
+def get_registry(names):
+    """
+    Реестр для набора имён параметров (порядок важен).
+    Используется функциями *_snap, которые получают параметры как **kwargs.
+    """
+    key = tuple(names)
+    registry = _REGISTRY_CACHE.get(key)
+    if registry is None:
+        registry = ParameterRegistry(key)
+        if len(_REGISTRY_CACHE) >= _REGISTRY_CACHE_SIZE:
+            _REGISTRY_CACHE.pop(next(iter(_REGISTRY_CACHE)))
+        _REGISTRY_CACHE[key] = registry
+    return registry
+
+
+def clear_registry_cache():
+    _REGISTRY_CACHE.clear()
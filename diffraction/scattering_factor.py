@@ -1,7 +1,7 @@
 import numpy as np
 import jax
 import jax.numpy as jnp
-from scipy.interpolate import interp1d
+from scipy.interpolate import make_interp_spline, PPoly
 from utils.format import get_value
 
 # ---- IT4322 fₑₗ ----
@@ -20,42 +20,98 @@ f_el_matrix_jax_jit = jax.jit(f_el_matrix_jax)
 
 
 
+# ---- Кусочно-полиномиальная интерполяция кривых Коппенса (JAX) ----
+def spline_table(x, y, order=2):
+    """
+    Коэффициенты интерполяционного сплайна для вычисления в JAX.
+
+    Строится тот же сплайн, что и interp1d(kind='quadratic') (order=2)
+    или кубический (order=3), и переводится в кусочные полиномы.
+
+    Returns
+    -------
+    breaks : ndarray, shape (n+1,)     ← границы интервалов (без вырожденных)
+    coefs  : ndarray, shape (k+1, n)   ← коэффициенты по степеням (x − breaks[i]), старшая первой
+    """
+    pp = PPoly.from_spline(make_interp_spline(np.asarray(x, dtype=float), np.asarray(y, dtype=float), k=order))
+    keep = np.diff(pp.x) > 0                                   # вырожденные интервалы на кратных узлах
+    breaks = np.append(pp.x[:-1][keep], pp.x[1:][keep][-1])
+    return breaks, pp.c[:, keep]
+
+
+def spline_eval_jax(x, breaks, coefs):
+    """
+    Значения сплайна в точках x (экстраполяция крайними полиномами,
+    как fill_value='extrapolate' у interp1d).
+    """
+    i  = jnp.clip(jnp.searchsorted(breaks, x, side='right') - 1, 0, coefs.shape[1] - 1)
+    dx = x - breaks[i]
+    y  = coefs[0, i]
+    for c in coefs[1:]:                                          # схема Горнера
+        y = y * dx + c[i]
+    return y
+
+
+
 # ---- Каппа-модель fₑₗ ----
-def f_el_kmodel_jax_preinterp(stl_arr, phase_prefix, atom_name, atom_Z, curves, **pars):
-    full_prefix = phase_prefix+atom_name+'_'
-
-    # --- 1. precompute arrays (numpy) on stl_arr ---
-    interp_core = interp1d(curves['core']['x'], curves['core']['y'], kind='quadratic', fill_value='extrapolate')
-    fe_core_np  = interp_core(stl_arr)
-    names_curves_valence = [k for k,v in curves.items() if k not in ['neutral atom', 'core']]
-    valence_np_list = []
-    P_list = []
-    for shell in names_curves_valence:
-        interp_v = interp1d(curves[shell]['x'], curves[shell]['y'], kind='quadratic', fill_value='extrapolate')
-        kappa_v  = float(get_value(pars[full_prefix + shell + '_kappa']))
-        P_v      = float(get_value(pars[full_prefix + shell + '_P']))
-        valence_np_list.append(interp_v(stl_arr / kappa_v))
-        P_list.append(P_v)
-
-    valence_stack_np = np.stack(valence_np_list, axis=0)   # (N_valence, K)
-    P_np = np.array(P_list)                                # (N_valence,)
-
-    # --- 2. call JAX formula but with precomputed arrays cast to jnp.float64 ---
-    fe_core_j  = jnp.array(fe_core_np, dtype=jnp.float64)
-    valence_j  = jnp.array(valence_stack_np, dtype=jnp.float64)
-    P_j        = jnp.array(P_np, dtype=jnp.float64)
-    stl_j      = jnp.array(stl_arr, dtype=jnp.float64)
-
-    # JAX formula that takes precomputed arrays:
-    def fe_el_from_precomputed(stl, fe_core, valence_stack, P_v, Z):
-        factor       = 1.0 / (8 * jnp.pi**2 * 0.529177210544)
-        P_fe_valence = jnp.dot(P_v, valence_stack)  # (K,)
-        fe_el        = jnp.where(stl == 0, 0.0, factor / (stl**2) * (Z - fe_core - P_fe_valence))
-        #fe_el        = factor / (stl**2) * (Z - fe_core - P_fe_valence)
-        return fe_el
-
-    fe_jax_res2 = fe_el_from_precomputed(stl_j, fe_core_j, valence_j, P_j, atom_Z)
-    return fe_jax_res2
+_KMODEL_TABLE_CACHE = {}
+
+
+def kmodel_tables(curves, order=2):
+    """
+    Таблицы сплайнов для кривых атома (кэш по объекту curves).
+
+    Returns
+    -------
+    dict
+        core   : (breaks, coefs) — остов;
+        shells : list of (breaks, coefs) — валентные оболочки;
+        names  : list of str — имена оболочек (порядок shells).
+    """
+    key = (id(curves), order)
+    table = _KMODEL_TABLE_CACHE.get(key)
+    if table is None or table["curves"] is not curves:
+        names = [k for k in curves.keys() if k not in ['neutral atom', 'core']]
+        to_jnp = lambda bc: (jnp.array(bc[0]), jnp.array(bc[1]))
+        table = {
+            "curves": curves,
+            "core":   to_jnp(spline_table(curves['core']['x'], curves['core']['y'], order)),
+            "shells": [to_jnp(spline_table(curves[n]['x'], curves[n]['y'], order)) for n in names],
+            "names":  names,
+        }
+        _KMODEL_TABLE_CACHE[key] = table
+    return table
+
+
+def f_el_kmodel_jax(stl, tables, kappa, P, Z):
+    """
+    Каппа-модель fₑₗ (Mott–Bethe) полностью в JAX.
+
+    fₑₗ(s) = 1/(8π²a₀) · (Z − f_core(s) − Σ P_v · f_v(s/κ_v)) / s²
+
+    stl    : jnp.ndarray, shape (M,)
+    tables : kmodel_tables(curves)
+    kappa  : jnp.ndarray, shape (N_valence,)
+    P      : jnp.ndarray, shape (N_valence,)
+
+    Дифференцируема по κ и P, не вызывает SciPy на каждом вычислении.
+    """
+    stl_safe = jnp.where(stl == 0, 1.0, stl)                      # без inf/NaN в градиенте при s = 0
+    fe_core  = spline_eval_jax(stl_safe, *tables["core"])
+    valence  = jnp.stack([spline_eval_jax(stl_safe / kappa[i], *tab)
+                          for i, tab in enumerate(tables["shells"])], axis=0)   # (N_valence, M)
+    factor   = 1.0 / (8 * jnp.pi**2 * 0.529177210544)
+    fe_el    = factor / stl_safe**2 * (Z - fe_core - jnp.dot(P, valence))
+    return jnp.where(stl == 0, 0.0, fe_el)
+
+
+def f_el_kmodel_jax_pars(stl, phase_prefix, atom_name, atom_Z, curves, **pars):
+    """ f_el_kmodel_jax с κ и P из словаря параметров """
+    tables = kmodel_tables(curves)
+    full_prefix = phase_prefix + atom_name + '_'
+    kappa = jnp.array([get_value(pars[full_prefix + shell + '_kappa']) for shell in tables["names"]])
+    P     = jnp.array([get_value(pars[full_prefix + shell + '_P']) for shell in tables["names"]])
+    return f_el_kmodel_jax(jnp.asarray(stl), tables, kappa, P, atom_Z)
 
 
 
@@ -76,10 +132,10 @@ def f_el_jax_wrapper(stl, atom, phase_prefix, **pars):
                                 atom.info['it4322']['A'], 
                                 atom.info['it4322']['B'])
     elif model == 'Mott-Bethe':
-      return f_el_kmodel_jax_preinterp(stl, phase_prefix,
-                                         atom.name, 
-                                         atom.Z, 
-                                         atom.info['curves'],**pars)
+      return f_el_kmodel_jax_pars(stl, phase_prefix,
+                                  atom.name,
+                                  atom.Z,
+                                  atom.info['curves'],**pars)
     else:
       raise ValueError(f"Unknown model for atom {atom.name}: {model}")
 
@@ -103,9 +159,9 @@ def f_el_jax_wrapper_snap(stl, atom_snap, phase_prefix, **pars):
                                 atom_snap['it4322']['A'],
                                 atom_snap['it4322']['B'])
     elif model == 'Mott-Bethe':
-      return f_el_kmodel_jax_preinterp(stl, phase_prefix,
-                                         atom_snap["name"],
-                                         atom_snap["Z"],
-                                         atom_snap["curves"],**pars)
+      return f_el_kmodel_jax_pars(stl, phase_prefix,
+                                  atom_snap["name"],
+                                  atom_snap["Z"],
+                                  atom_snap["curves"],**pars)
     else:
       raise ValueError(f"Unknown model for atom {atom_snap['name']}: {model}")
@@ -1,5 +1,6 @@
 
 import numpy as np
+from phases.bragg_pos.io import as_bragg_table
 
 def profilepoints_to_snapshot(pp):
     return {
@@ -27,7 +28,7 @@ def atom_to_snapshot(atom):
 def phase_to_snapshot(phase):
     return {
         "prefix": phase.prefix,
-        "bragg_positions": phase.bragg_positions,
+        "bragg_positions": as_bragg_table(phase.bragg_positions),   # структурированный массив BRAGG_DTYPE
         "atoms": [atom_to_snapshot(a) for a in phase.atoms],
         "symmetry_operations": phase.symmetry_operations,
         "wavelength": phase.wavelength,
@@ -0,0 +1,125 @@
+import hashlib
+import numpy as np
+
+
+"""
+Кэш стадий snapshot-пути (phase_profile_jax_snap).
+
+На каждом вызове невязки lmfit весь конвейер фазы считается заново, хотя
+в большинстве шагов уточняется только фон или форма пика, а F², d и μ не
+меняются. Каждая стадия зависит от своих групп параметров фазы
+(ParameterRegistry.stage_groups) и кэширует результат по их значениям:
+
+    cell ──┬──────────────────────── positions (μ)  ← delta
+           │
+           └── F2  ← atoms, Biso, kmodel
+                │
+                └── amplitudes  ← scale, intensities
+                          │
+                          └──────── profile  ← amplitudes, positions, shape, ось 2θ
+
+    bckg*, s* не входят ни в одну стадию: при уточнении только фона все
+    стадии фазы берутся из кэша.
+
+Ключ стадии — байты значений θ по объединению её групп (точное совпадение
+float64). Для каждой стадии хранятся несколько последних ключей: при
+конечных разностях MINPACK чередуются базовая точка и сдвиги по одному
+параметру.
+"""
+
+
+STAGE_DEPENDENCIES = {
+    "F2":         ("cell", "atoms", "Biso", "kmodel"),
+    "amplitudes": ("F2", "scale", "intensities"),
+    "positions":  ("cell", "delta"),
+    "profile":    ("amplitudes", "positions", "shape"),
+}
+
+STAGE_CACHE_ENABLED = True
+_STAGE_CACHE_SIZE = 4
+_STAGE_COUNTERS = {stage: {"hits": 0, "misses": 0} for stage in STAGE_DEPENDENCIES}
+
+
+def stage_param_groups(stage):
+    """ Группы параметров, от которых стадия зависит (с учётом предыдущих стадий) """
+    groups = []
+    for dep in STAGE_DEPENDENCIES[stage]:
+        for g in (stage_param_groups(dep) if dep in STAGE_DEPENDENCIES else (dep,)):
+            if g not in groups:
+                groups.append(g)
+    return tuple(groups)
+
+
+def axes_digest(axes):
+    """ Ключ оси 2θ для стадии profile """
+    return hashlib.sha1(np.ascontiguousarray(axes, dtype=float)).digest()
+
+
+# ---- Кэш стадий одной фазы ----
+class StageCache:
+    """
+    Кэш результатов стадий одной фазы.
+
+    Parameters
+    ----------
+    groups : dict
+        Группа параметров → индексы в расширенном θ (ParameterRegistry.stage_groups).
+    size : int
+        Сколько последних ключей хранить на стадию.
+    """
+
+    def __init__(self, groups, size=_STAGE_CACHE_SIZE):
+        self.size = size
+        self.index = {stage: np.unique(np.concatenate([np.asarray(groups[g], dtype=int).ravel()
+                                                        for g in stage_param_groups(stage)]))
+                      for stage in STAGE_DEPENDENCIES}
+        self._entries = {stage: {} for stage in STAGE_DEPENDENCIES}
+        self.counters = {stage: {"hits": 0, "misses": 0} for stage in STAGE_DEPENDENCIES}
+
+    def lookup(self, stage, theta, compute, extra=()):
+        """
+        Результат стадии из кэша или compute() при промахе.
+
+        Parameters
+        ----------
+        stage : str
+            Имя стадии (ключ STAGE_DEPENDENCIES).
+        theta : ndarray
+            Расширенный θ (ParameterRegistry.theta_ext).
+        compute : callable
+            Вычисление стадии без аргументов.
+        extra : tuple
+            Дополнительная часть ключа (например, axes_digest для profile).
+        """
+        if not STAGE_CACHE_ENABLED:
+            return compute()
+        key = (np.asarray(theta, dtype=float)[self.index[stage]].tobytes(),) + tuple(extra)
+        entries = self._entries[stage]
+        if key in entries:
+            self._count(stage, "hits")
+            return entries[key]
+        self._count(stage, "misses")
+        value = compute()
+        if len(entries) >= self.size:
+            entries.pop(next(iter(entries)))
+        entries[key] = value
+        return value
+
+    def _count(self, stage, kind):
+        self.counters[stage][kind] += 1
+        _STAGE_COUNTERS[stage][kind] += 1
+
+    def clear(self):
+        for entries in self._entries.values():
+            entries.clear()
+
+
+# ---- Счётчики ----
+def stage_cache_stats():
+    """ Попадания / промахи по стадиям (суммарно по всем фазам) """
+    return {stage: dict(c) for stage, c in _STAGE_COUNTERS.items()}
+
+
+def reset_stage_cache_stats():
+    for c in _STAGE_COUNTERS.values():
+        c["hits"] = c["misses"] = 0
@@ -3,7 +3,9 @@ import jax.numpy as jnp
 from utils.format import get_value
 from diffraction.geometry import stl_hkl_jax
 from diffraction.scattering_factor import f_el_jax_wrapper, f_el_jax_wrapper_snap
-from atoms.generate import get_all_positions_in_cell_for_atom
+from atoms.generate import get_site_table, is_centrosymmetric
+from phases.bragg_pos.io import as_bragg_table, bragg_hkl
+from diffraction.registry import get_registry
 
 
 # ---- F² (с atom_map) ----
@@ -47,6 +49,151 @@ def F2_hkl_jax(hkl_array, x, y, z, occ, fe_el, t_at, t_overall, atom_map):
 
 
 
+# ---- F² по орбитам (симметрийно-редуцированный путь) ----
+"""
+Вместо матрицы фаз по всем позициям (M, N_sites) и выборок fe_el[:, atom_map],
+t_at[:, atom_map] F считается суммой по неэквивалентным атомам:
+
+    F(hkl) = T_overall · Σ_a fₐ Tₐ occₐ Gₐ(hkl),
+    Gₐ(hkl) = Σ_{s ∈ орбита a} exp(2πi h·(R_s rₐ + t_s))     ← геометрический структурный фактор
+
+    ├── позиция полностью задана симметрией и x, y, z не уточняются → Gₐ — константа,
+    │   считается при сборке (кэш — по wyckoff_signature, т.е. и по координатам);
+    ├── остальные атомы: h·(R_s r) = (R_sᵀh)·r и h·t_s заранее → одна свёртка по xyz;
+    └── центросимметричная группа (−I, 0) → Gₐ вещественный: только cos, F² = F².
+
+Выбор пути (choose_F2_path): редуцированный, пока таблица (R_sᵀh) помещается
+в F2_REDUCED_MAX_BYTES; иначе — плотный F2_hkl_jax.
+"""
+
+F2_REDUCED_MAX_BYTES = 256 * 2**20
+
+
+def constant_atoms(table, varied=None):
+    """ Атомы с постоянным Gₐ: позиция задана симметрией (fixed) и координаты не уточняются """
+    fixed = np.asarray(table["fixed"], dtype=bool)
+    return fixed if varied is None else fixed & ~np.asarray(varied, dtype=bool)
+
+
+def choose_F2_path(n_hkl, table, max_bytes=None, varied=None):
+    """ 'reduced' или 'dense' по объёму таблицы (M, N_sites_var, 3) float64 """
+    max_bytes = F2_REDUCED_MAX_BYTES if max_bytes is None else max_bytes
+    n_var_sites = int(np.sum(~constant_atoms(table, varied)[table["atom_map"]]))
+    return "reduced" if 0 < max_bytes and n_hkl * n_var_sites * 3 * 8 <= max_bytes else "dense"
+
+
+def build_orbit_tables(hkl_array, table, xyz_list, centrosymmetric, varied=None):
+    """
+    Статические таблицы редуцированного пути (numpy, один раз на фазу).
+
+    Parameters
+    ----------
+    hkl_array : ndarray, shape (M, 3)
+    table : dict
+        Таблица позиций build_site_table (R, t, atom_map, fixed).
+    xyz_list : array-like, shape (N_atoms, 3)
+        Координаты неэквивалентных атомов (для атомов на частных позициях
+        определяют постоянный Gₐ).
+    centrosymmetric : bool
+        Группа содержит инверсию в начале координат.
+    varied : array-like of bool, shape (N_atoms,), optional
+        Координаты атома уточняются: его Gₐ считается по текущим x, y, z,
+        даже если позиция задана симметрией (иначе производная по x, y, z
+        была бы нулевой).
+
+    Returns
+    -------
+    dict
+        centro ; G_fixed (M, N_atoms) ; hR (M, S, 3), ht (M, S), site_atom (S,),
+        onehot (S, N_atoms) — по позициям S атомов со свободными координатами.
+    """
+    hkl = np.asarray(hkl_array, dtype=float).reshape(-1, 3)
+    xyz = np.asarray(xyz_list, dtype=float).reshape(-1, 3)
+    R, t, atom_map = table["R"], table["t"], table["atom_map"]
+    fixed = constant_atoms(table, varied)
+    n_atoms = len(xyz)
+
+    # --- 1. атомы на частных позициях: Gₐ(hkl) — константа ---
+    G_fixed = np.zeros((len(hkl), n_atoms), dtype=float if centrosymmetric else complex)
+    for a in np.flatnonzero(fixed):
+        sites = np.einsum('sij,j->si', R[atom_map == a], xyz[a]) + t[atom_map == a]
+        arg   = 2 * np.pi * hkl @ sites.T                                         # (M, N_orbit)
+        G_fixed[:, a] = np.cos(arg).sum(axis=1) if centrosymmetric else np.exp(1j * arg).sum(axis=1)
+
+    # --- 2. остальные: R_sᵀh и h·t_s по позициям ---
+    var_sites = ~fixed[atom_map]
+    site_atom = atom_map[var_sites]
+    return {"centro":    bool(centrosymmetric),
+            "G_fixed":   G_fixed,
+            "hR":        np.einsum('mi,sij->msj', hkl, R[var_sites]),             # (M, S, 3)
+            "ht":        hkl @ t[var_sites].T,                                     # (M, S)
+            "site_atom": site_atom,
+            "onehot":    (site_atom[:, None] == np.arange(n_atoms)[None, :]).astype(float)}
+
+
+def geometric_factors_jax(orbits, xyz):
+    """ Gₐ(hkl), shape (M, N_atoms): вещественный для центросимметричной группы """
+    G = jnp.asarray(orbits["G_fixed"])
+    if len(orbits["site_atom"]):
+        arg  = 2 * jnp.pi * (jnp.einsum('msj,sj->ms', orbits["hR"], xyz[orbits["site_atom"]]) + orbits["ht"])
+        trig = jnp.cos(arg) if orbits["centro"] else jnp.exp(1j * arg)
+        G    = G + trig @ orbits["onehot"]
+    return G
+
+
+def F2_orbits_jax(orbits, xyz, occ, fe_el, t_at, t_overall):
+    """
+    |F|² по орбитам (то же, что F2_hkl_jax, без матриц по всем позициям).
+
+    Parameters
+    ----------
+    orbits :    dict                        ← build_orbit_tables.
+    xyz :       ndarray, shape (N_atoms, 3) ← Координаты неэквивалентных атомов.
+    occ :       ndarray, shape (N_atoms,)   ← Заселённости.
+    fe_el :     ndarray, shape (M, N_atoms) ← Атомные факторы рассеяния.
+    t_at :      ndarray, shape (M, N_atoms) ← Температурные поправки атомов.
+    t_overall : ndarray, shape (M,)         ← Общая температурная поправка.
+
+    Returns
+    -------
+    F2 :        ndarray, shape (M,)
+    """
+    G = geometric_factors_jax(orbits, xyz)
+    F = jnp.sum(fe_el * t_at * occ[None, :] * G, axis=1) * t_overall
+    return F**2 if orbits["centro"] else jnp.abs(F)**2
+
+
+# ---- Кэш таблиц орбит для snapshot-пути ----
+_ORBIT_TABLE_CACHE = {}
+_ORBIT_TABLE_CACHE_SIZE = 16
+
+
+def get_orbit_tables(key, hkl_array, table, xyz_list, Operations_symmetry):
+    """
+    Кэшированная build_orbit_tables (или None, если выбран плотный путь).
+
+    Пересобирается при смене списка рефлексов, операций симметрии или
+    wyckoff_signature таблицы позиций (get_site_table): постоянные Gₐ
+    атомов на частных позициях посчитаны по их координатам.
+    """
+    entry = _ORBIT_TABLE_CACHE.get(key)
+    if (entry is None or entry["ops"] is not Operations_symmetry or entry["wyckoff"] != table["wyckoff"]
+            or not np.array_equal(entry["hkl"], hkl_array)):
+        orbits = None
+        if choose_F2_path(len(hkl_array), table) == "reduced":
+            orbits = build_orbit_tables(hkl_array, table, xyz_list, is_centrosymmetric(Operations_symmetry))
+        if len(_ORBIT_TABLE_CACHE) >= _ORBIT_TABLE_CACHE_SIZE:
+            _ORBIT_TABLE_CACHE.pop(next(iter(_ORBIT_TABLE_CACHE)))
+        entry = {"ops": Operations_symmetry, "wyckoff": table["wyckoff"], "hkl": np.array(hkl_array), "orbits": orbits}
+        _ORBIT_TABLE_CACHE[key] = entry
+    return entry["orbits"]
+
+
+def clear_orbit_table_cache():
+    _ORBIT_TABLE_CACHE.clear()
+
+
+
 # ---- Посчитать F² на jax для фазы (с atom_map) ----
 def F2_array_jax(phase_object,**params):
     """
@@ -72,40 +219,21 @@ def F2_array_jax(phase_object,**params):
     Biso_overall = get_value(params[prefix + 'Biso_overall'])
     t_overall    = jnp.exp(-Biso_overall * stl_sq)
 
-    # --- 4. Сбор данных по атомам ---
-    all_sites, all_occ, atom_map = [], [], []
-    fe_el_list, t_at_list        = [], []
-
-    for atom_idx, atom in enumerate(phase_object.atoms):
-        # координаты, заселённость, Biso
-        xa      = get_value(params[prefix + atom.name + '_x'])
-        ya      = get_value(params[prefix + atom.name + '_y'])
-        za      = get_value(params[prefix + atom.name + '_z'])
-        occ     = get_value(params[prefix + atom.name + '_occ'])
-        Biso_at = get_value(params[prefix + atom.name + '_Biso'])
-        sites   = get_all_positions_in_cell_for_atom(xa, ya, za, phase_object.symmetry_operations)
-
-        # атомный фактор рассеяния (универсальная обёртка)
-        fe_el = f_el_jax_wrapper(stl_array, atom, prefix, **params)
-
-        # атомная температурная поправка
-        t_at  = jnp.exp(-Biso_at * stl_sq)
-
-        fe_el_list.append(fe_el)   # (M,)
-        t_at_list.append(t_at)     # (M,)
-
-        # позиции и отображение site → atom
-        for pos in sites:
-            all_sites.append(pos)
-            all_occ.append(occ)
-            atom_map.append(atom_idx)
-
-    # --- 5. Приведение к массивам ---
-    all_sites = jnp.array(all_sites)                  # (N_sites, 3)
-    all_occ   = jnp.array(all_occ)                    # (N_sites,)
-    atom_map  = jnp.array(atom_map)                   # (N_sites,)
-    fe_el_all = jnp.stack(fe_el_list, axis=1)         # (M_stl, N_atoms)
-    t_at_all  = jnp.stack(t_at_list, axis=1)          # (M_stl, N_atoms)
+    # --- 4. Позиции атомов: таблица орбит (кэш) + одна матричная операция ---
+    atoms = phase_object.atoms
+    names = [atom.name for atom in atoms]
+    xyz   = np.array([[get_value(params[prefix + n + c]) for c in ('_x', '_y', '_z')] for n in names])   # (N_atoms, 3)
+    table = get_site_table((prefix, tuple(names)), xyz, phase_object.symmetry_operations)
+    atom_map  = table["atom_map"]                                                        # (N_sites,)
+    all_sites = jnp.einsum('sij,sj->si', table["R"], xyz[atom_map]) + table["t"]         # (N_sites, 3)
+
+    occ  = jnp.array([get_value(params[prefix + n + '_occ']) for n in names])
+    Biso = jnp.array([get_value(params[prefix + n + '_Biso']) for n in names])
+
+    # --- 5. fₑₗ и температурные поправки по атомам ---
+    all_occ   = occ[atom_map]                                                                       # (N_sites,)
+    fe_el_all = jnp.stack([f_el_jax_wrapper(stl_array, atom, prefix, **params) for atom in atoms], axis=1)   # (M_stl, N_atoms)
+    t_at_all  = jnp.exp(-Biso[None, :] * stl_sq[:, None])                                          # (M_stl, N_atoms)
 
     # --- 6. Структурные факторы ---
     F2 = F2_hkl_jax(hkl_array,
@@ -120,54 +248,46 @@ def F2_array_jax(phase_object,**params):
 def F2_array_jax_snap(phase_snap,**params):
     prefix = phase_snap["prefix"]
 
+    # --- 0. Плоский θ и индексы реестра ---
+    registry = get_registry(params)
+    slots    = registry.phase_slots(phase_snap)
+    at_slots = registry.atom_slots(phase_snap)
+    theta    = registry.theta_ext(params)
+
     # --- 1. Параметры ячейки ---
-    cell_array = [get_value(params[prefix + par]) for par in ['a','b','c','alpha','beta','gamma']]
+    cell_array = list(theta[slots["cell_idx"]])
 
     # --- 2. HKL и stl ---
-    hkl_array = np.array([line[:3] for line in phase_snap["bragg_positions"]])
+    hkl_array = bragg_hkl(as_bragg_table(phase_snap["bragg_positions"]))
     stl_array = stl_hkl_jax(hkl_array, *cell_array)
     stl_sq    = stl_array**2
 
     # --- 3. Общая температурная поправка ---
-    Biso_overall = get_value(params[prefix + 'Biso_overall'])
+    Biso_overall = theta[at_slots["Biso_overall_idx"]]
     t_overall    = jnp.exp(-Biso_overall * stl_sq)
 
-    # --- 4. Сбор данных по атомам ---
-    all_sites, all_occ, atom_map = [], [], []
-    fe_el_list, t_at_list        = [], []
-
-    for atom_idx, atom_snap in enumerate(phase_snap["atoms"]):
-        # координаты, заселённость, Biso
-        xa      = get_value(params[prefix + atom_snap["name"] + '_x'])
-        ya      = get_value(params[prefix + atom_snap["name"] + '_y'])
-        za      = get_value(params[prefix + atom_snap["name"] + '_z'])
-        occ     = get_value(params[prefix + atom_snap["name"] + '_occ'])
-        Biso_at = get_value(params[prefix + atom_snap["name"] + '_Biso'])
-        sites   = get_all_positions_in_cell_for_atom(xa, ya, za, phase_snap["symmetry_operations"])
-
-        # атомный фактор рассеяния (универсальная обёртка)
-        fe_el = f_el_jax_wrapper_snap(stl_array, atom_snap, prefix, **params)
-
-        # атомная температурная поправка
-        t_at  = jnp.exp(-Biso_at * stl_sq)
-
-        fe_el_list.append(fe_el)   # (M,)
-        t_at_list.append(t_at)     # (M,)
-
-        # позиции и отображение site → atom
-        for pos in sites:
-            all_sites.append(pos)
-            all_occ.append(occ)
-            atom_map.append(atom_idx)
-
-    # --- 5. Приведение к массивам ---
-    all_sites = jnp.array(all_sites)                  # (N_sites, 3)
-    all_occ   = jnp.array(all_occ)                    # (N_sites,)
-    atom_map  = jnp.array(atom_map)                   # (N_sites,)
-    fe_el_all = jnp.stack(fe_el_list, axis=1)         # (M_stl, N_atoms)
-    t_at_all  = jnp.stack(t_at_list, axis=1)          # (M_stl, N_atoms)
+    # --- 4. Позиции атомов: таблица орбит (кэш) + одна матричная операция ---
+    atoms = phase_snap["atoms"]
+    names = [atom_snap["name"] for atom_snap in atoms]
+    xyz   = theta[at_slots["xyz_idx"]]                                                                   # (N_atoms, 3)
+    table = get_site_table((prefix, tuple(names)), xyz, phase_snap["symmetry_operations"])
+    orbits = get_orbit_tables((prefix, tuple(names), len(hkl_array)),                                   # полный список и сегмент — разные ключи
+                              hkl_array, table, xyz, phase_snap["symmetry_operations"])
 
-    # --- 6. Структурные факторы ---
+    occ  = jnp.asarray(theta[at_slots["occ_idx"]])
+    Biso = jnp.asarray(theta[at_slots["Biso_idx"]])
+
+    # --- 5. fₑₗ и температурные поправки по атомам ---
+    fe_el_all = jnp.stack([f_el_jax_wrapper_snap(stl_array, a, prefix, **params) for a in atoms], axis=1)   # (M_stl, N_atoms)
+    t_at_all  = jnp.exp(-Biso[None, :] * stl_sq[:, None])                                               # (M_stl, N_atoms)
+
+    # --- 6. Структурные факторы: по орбитам или по всем позициям ---
+    if orbits is not None:
+        return F2_orbits_jax(orbits, jnp.asarray(xyz), occ, fe_el_all, t_at_all, t_overall)
+
+    atom_map  = table["atom_map"]                                                        # (N_sites,)
+    all_sites = jnp.einsum('sij,sj->si', table["R"], xyz[atom_map]) + table["t"]         # (N_sites, 3)
+    all_occ   = occ[atom_map]                                                            # (N_sites,)
     F2 = F2_hkl_jax(hkl_array,
                 all_sites[:,0], all_sites[:,1], all_sites[:,2],
                 all_occ, fe_el_all, t_at_all, t_overall, atom_map)
@@ -1,6 +1,40 @@
+import numpy as np
+
 ## Условия разрешённости (систематического погасания) по номеру пространственной группы
 extinction_rules_by_number = {
     225: lambda h, k, l: (h % 2 == k % 2 == l % 2),           # Fm-3m: CaF2   
     165: lambda h, k, l: not ((h + k) == 0 and (l % 2 != 0)), # CeF3
     # ...можно добавить другие
 }
+
+## Те же условия в виде масок для целочисленных массивов h, k, l (shape (n,))
+extinction_masks_by_number = {
+    225: lambda h, k, l: (h % 2 == k % 2) & (k % 2 == l % 2),     # Fm-3m: CaF2
+    165: lambda h, k, l: ~(((h + k) == 0) & (l % 2 != 0)),        # CeF3
+}
+
+
+def extinction_mask(hkl, spacegroup_number):
+    """
+    Маска разрешённых отражений для массива hkl.
+
+    Параметры
+    ----------
+    hkl : array-like, shape (n, 3)     Целочисленные индексы.
+    spacegroup_number : int or None    Номер пространственной группы; None — все разрешены.
+
+    Возвращает
+    -------
+    np.ndarray bool, shape (n,)
+        Если для группы нет векторной маски, скалярное правило из
+        extinction_rules_by_number применяется поэлементно.
+    """
+    hkl = np.asarray(hkl, dtype=int).reshape(-1, 3)
+    h, k, l = hkl[:, 0], hkl[:, 1], hkl[:, 2]
+    mask_fn = extinction_masks_by_number.get(spacegroup_number)
+    if mask_fn is not None:
+        return np.asarray(mask_fn(h, k, l), dtype=bool)
+    rule = extinction_rules_by_number.get(spacegroup_number)
+    if rule is None:
+        return np.ones(len(hkl), dtype=bool)
+    return np.fromiter((bool(rule(*row)) for row in hkl.tolist()), dtype=bool, count=len(hkl))
@@ -1,3 +1,12 @@
+import re
+import math
+import numpy as np
+from phases.utils_cryst.lattice import d_hkl, d_hkl_array
+from atoms.generate import get_all_positions_in_cell_for_atom
+from atoms.scattering_factors.it4322_params import PARAM
+from diffraction.legacy import f_el, F2_hkl
+
+
 #@title ✪ (iv) Расчет $F^2$ для набора (h,k,l)
 
 ####   Извлечь параметры из фазы для calc_structural_factors
@@ -58,9 +67,42 @@ def calc_structural_factors(hkl_list, XYZ, a, b, c, alpha, beta, gamma, waveleng
     return F2_list
 
 
+def calc_structural_factors_array(hkl_array, XYZ, a, b, c, alpha, beta, gamma, wavelength,
+                                  Operations_symmetry, KPhase, two_theta_max=5.5, Biso_overall=0):
+    """
+    Векторная версия calc_structural_factors: |F|² сразу для всех hkl.
+
+    Те же допущения, что и в calc_structural_factors (occ = 1, без тепловых
+    поправок, fₑₗ по IT 4.3.2.2 при stl = 1/(2d)), но сумма по позициям
+    считается одной матрицей (n_hkl, N_sites) вместо цикла по hkl и атомам.
+
+    Возвращает
+    -------
+    F2 : np.ndarray, shape (n_hkl,)
+    """
+    hkl_array = np.asarray(hkl_array, dtype=float).reshape(-1, 3)
+    d   = d_hkl_array(hkl_array, a, b, c, alpha, beta, gamma)
+    stl = np.where(d > 0, 1/(2*np.where(d > 0, d, 1.0)), 0.0)                 # (n,)
+
+    # --- позиции в ячейке и fₑₗ по сортам атомов ---
+    sites, fe_cols = [], []
+    for line in XYZ:
+        name = re.sub("[^A-Za-z]", "", line[-1])
+        positions = np.asarray(get_all_positions_in_cell_for_atom(*line[:3], Operations_symmetry), dtype=float)
+        el  = PARAM["elements"][name]
+        A   = np.array([el[f"a{i}"] for i in range(1, 6)])
+        B   = np.array([el[f"b{i}"] for i in range(1, 6)])
+        fe  = np.exp(-np.outer(stl*stl, B)) @ A                                # (n,)
+        sites.append(positions)
+        fe_cols.append(np.repeat(fe[:, None], len(positions), axis=1))
+    sites = np.concatenate(sites, axis=0)                                      # (N_sites, 3)
+    fe    = np.concatenate(fe_cols, axis=1)                                    # (n, N_sites)
+
+    F = np.sum(fe * np.exp(2j*np.pi*(hkl_array @ sites.T)), axis=1) * np.exp(-Biso_overall*stl**2)
+    return np.abs(F)**2
+
+
 #@title ✪ (v) Функция **get_vals_for_hkl**
-import math
-import numpy as np
 
 def get_vals_for_hkl(hkl_star, phase_object, verbose=True, unique_only=False):
     """
@@ -83,6 +125,8 @@ def get_vals_for_hkl(hkl_star, phase_object, verbose=True, unique_only=False):
                           'phase': complex,
                           'F2' - добавляется позже как результат функции calc_structural_factors}
     """
+    from .generate import get_unique_hkl, group_by_d, canonical_hkl, print_hkl_table   # generate импортирует factors
+
     wavelength = phase_object.wavelength
     cell_array = [v.value for k, v in phase_object.param_cell.items()]
     pars_for_F2 = extract_pars_for_F2(phase_object)                             ## Извлекаем XYZ, a, b, c, alpha, beta, gamma, wavelength, ops_sym, KPhase
@@ -1,8 +1,8 @@
-from .extinction import extinction_rules_by_number
-from phases.utils_cryst.lattice import d_hkl
+from .extinction import extinction_rules_by_number, extinction_mask
+from .factors import calc_structural_factors_array, extract_pars_for_F2
+from phases.utils_cryst.lattice import d_hkl, d_hkl_array
 import numpy as np
 import math
-from tqdm import tqdm
 from collections import defaultdict
 
 
@@ -196,47 +196,201 @@ def canonical_hkl(hkl_group):
 ## ========== Генерация hkl_data ==========
 def generate_hkl_array(hkl_max, a,b,c,alpha,beta,gamma, two_theta_max, λ,
                        spacegroup_number, forbidden=False, verbose=True, include_hkl000=False):
-    extinction_rule = extinction_rules_by_number.get(spacegroup_number, lambda h, k, l: True)
-    hkl_list = []
-    d_list = []
-    two_theta_list = []
-    stl_list = []
+    """
+    Сетка hkl ∈ [-hkl_max, hkl_max]³ с d, 2θ и sinθ/λ, отобранная по правилам
+    погасания и по 2θ ≤ two_theta_max. Считается массивами за один проход;
+    порядок строк — как у вложенных циклов h → k → l.
+    """
+    # --- 1. полная сетка без (0,0,0) ---
+    r   = np.arange(-hkl_max, hkl_max+1)
+    hkl = np.stack(np.meshgrid(r, r, r, indexing='ij'), axis=-1).reshape(-1, 3)
+    hkl = hkl[np.any(hkl != 0, axis=1)]
+
+    # --- 2. правила погасания (разрешённые или запрещённые) ---
+    allowed = extinction_mask(hkl, spacegroup_number)
+    hkl = hkl[allowed != forbidden]
+
+    # --- 3. d, 2θ, sinθ/λ ---
+    d   = d_hkl_array(hkl, a,b,c,alpha,beta,gamma)
+    arg = λ / (2 * d)
+    ok  = arg <= 1.0                                    ## asin определён
+    if two_theta_max is not None:
+        ok &= 2 * np.arcsin(np.minimum(arg, 1.0)) * 180 / math.pi <= two_theta_max
+    hkl, d  = hkl[ok], d[ok]
+    theta   = np.arcsin(λ / (2 * d))
+    result = {'hkl': hkl,                               # shape: (H, 3)
+              'd': d,                                   # shape: (H,)
+              '2theta': 2 * theta * 180 / math.pi,      # shape: (H,)
+              'stl': np.sin(theta) / λ}                 # shape: (H,)
+
     # Если include_hkl000=True, то добавляем (0,0,0) вручную в начало списка
     if include_hkl000:
-        hkl_list.append((0, 0, 0))
-        d_list.append(np.inf)          # или np.nan, тк d для (0,0,0) физически не определено
-        two_theta_list.append(0.0)
-        stl_list.append(0.0)
-
-    for h in range(-hkl_max, hkl_max+1):
-        for k in range(-hkl_max, hkl_max+1):
-            for l in range(-hkl_max, hkl_max+1):
-                if (h, k, l) == (0, 0, 0): continue
-                # Разрешённые или запрещённые в зависимости от параметра
-                allowed = extinction_rule(h, k, l)
-                if (allowed and not forbidden) or ((not allowed) and forbidden):
-                    d = d_hkl(h, k, l, a,b,c,alpha,beta,gamma)
-                    try:
-                        theta = math.asin(λ / (2 * d))
-                    except ValueError:
-                        continue
-                    two_theta = 2 * theta * 180 / math.pi
-                    if (two_theta_max is None) or (two_theta <= two_theta_max):
-                        sin_theta_over_lambda = math.sin(theta) / λ
-                        hkl_list.append((h, k, l))
-                        d_list.append(d)
-                        two_theta_list.append(two_theta)
-                        stl_list.append(sin_theta_over_lambda)
-    result = {'hkl': np.array(hkl_list),            # shape: (H, 3)
-              'd': np.array(d_list),                # shape: (H,)
-              '2theta': np.array(two_theta_list),   # shape: (H,)
-              'stl': np.array(stl_list)}            # shape: (H,)
+        result = {'hkl': np.vstack([np.zeros((1, 3), dtype=hkl.dtype), hkl]),
+                  'd': np.concatenate([[np.inf], result['d']]),     # d для (0,0,0) физически не определено
+                  '2theta': np.concatenate([[0.0], result['2theta']]),
+                  'stl': np.concatenate([[0.0], result['stl']])}
     if verbose and not forbidden: print(f"Количество отражений: {len(result['hkl'])}")
     if verbose and forbidden: print(f"Количество запрещенных отражений: {len(result['hkl'])}")
     return result
 
 
 
+## ====== Группировка эквивалентных hkl (массивами) ======
+def symmetry_matrices(operations_symmetry, add_inversion=True):
+    """
+    Матрицы R (O,3,3) и трансляции t (O,3) операций симметрии; при add_inversion
+    и отсутствии инверсии добавляются операции R·(−I), как в get_star_hkl.
+    """
+    R = np.array([np.asarray(Rm, dtype=float) for _, Rm in operations_symmetry]).reshape(-1, 3, 3)
+    t = np.array([np.asarray(tv, dtype=float) for tv, _ in operations_symmetry]).reshape(-1, 3)
+    if add_inversion and not any(np.array_equal(Rm, -np.eye(3)) for Rm in R):
+        R = np.concatenate([R, R @ -np.eye(3)])
+        t = np.concatenate([t, t])
+    return R, t
+
+
+def _hkl_codes(hkl, base):
+    """ Целочисленный код (h,k,l), сохраняющий лексикографический порядок """
+    off = base // 2
+    return ((hkl[..., 0] + off) * base + (hkl[..., 1] + off)) * base + (hkl[..., 2] + off)
+
+
+def _hkl_decode(codes, base):
+    """ Обратное к _hkl_codes: (n,) → (n, 3) """
+    off = base // 2
+    return np.stack([codes // base**2 - off, codes // base % base - off, codes % base - off], axis=-1)
+
+
+def group_hkl_array(hkl, cell, λ, operations_symmetry, spacegroup_number=None,
+                    forbidden=False, add_inversion=True, merge=True, tol=1e-5):
+    """
+    Разбиение hkl на группы эквивалентных отражений без цикла по hkl.
+
+    Повторяет build_hkl_groups (get_star_hkl + get_vals_for_hkl) для всех hkl сразу:
+    звёзды R·hkl строятся одним einsum, запрещённые члены звезды отбрасываются
+    маской, повторы внутри звезды убираются (первое вхождение по номеру операции),
+    звезда делится на группы по d (с точностью tol), метка группы —
+    canonical_hkl (минимум по нормированным знакам), при merge=True из групп
+    с одинаковой меткой остаётся первая.
+
+    Параметры
+    ----------
+    hkl : array (n, 3)                        Исходные отражения (например, generate_hkl_array(...)['hkl']).
+    cell : (a, b, c, alpha, beta, gamma)
+    λ : float
+    operations_symmetry : list of [t, R]
+    spacegroup_number : int or None           Правила погасания для членов звезды.
+    forbidden : bool                          Оставлять запрещённые члены звезды вместо разрешённых.
+    add_inversion : bool
+    merge : bool                              Объединять группы с одинаковой меткой.
+    tol : float                               Допуск группировки по d, как в group_by_d.
+
+    Возвращает
+    -------
+    dict
+        'hkl', 'd', 'two_theta', 'phase', 'op_index'  ← члены групп (K,...), по группам подряд;
+        'start'                                       ← (G+1,) границы групп в массивах членов;
+        'hkl_label' (G,3), 'multiplicity' (G,)
+    """
+    hkl = np.asarray(hkl, dtype=int).reshape(-1, 3)
+    R, t = symmetry_matrices(operations_symmetry, add_inversion)
+    n, O = len(hkl), len(R)
+
+    # --- 1. звёзды и правила погасания ---
+    star = np.rint(np.einsum('oij,nj->noi', R, hkl)).astype(int)       # (n, O, 3)
+    allowed = extinction_mask(star.reshape(-1, 3), spacegroup_number) != forbidden if spacegroup_number is not None \
+              else np.ones(n*O, dtype=bool)
+
+    # --- 2. уникальные члены звезды (первое вхождение по номеру операции) ---
+    base = 2 * int(np.abs(star).max(initial=0)) + 3
+    rows = np.repeat(np.arange(n), O)[allowed]
+    ops  = np.tile(np.arange(O), n)[allowed]
+    key  = rows * base**3 + _hkl_codes(star.reshape(-1, 3)[allowed], base)
+    _, first = np.unique(key, return_index=True)
+    first.sort()
+    rows, ops = rows[first], ops[first]
+    members   = star[rows, ops]                                         # (K, 3)
+
+    # --- 3. d, 2θ и группировка по d внутри звезды ---
+    d         = d_hkl_array(members, *cell)
+    two_theta = np.where(d > 0, 2*np.arcsin(np.minimum(λ/(2*np.where(d > 0, d, 1.0)), 1.0))*180/math.pi, 0.0)
+    d_key     = np.round(d / tol).astype(np.int64)
+    order     = np.lexsort((ops, two_theta, d_key, rows))               ## звезда → d → 2θ → операция
+    rows, ops, members, d, two_theta, d_key = (x[order] for x in (rows, ops, members, d, two_theta, d_key))
+    new_group = np.ones(len(rows), dtype=bool)
+    new_group[1:] = (rows[1:] != rows[:-1]) | (d_key[1:] != d_key[:-1])
+    start = np.flatnonzero(new_group)
+
+    # --- 4. метки групп (canonical_hkl) ---
+    flip   = (members[:, 0] < 0) | ((members[:, 0] == 0) & (members[:, 1] < 0)) | \
+             ((members[:, 0] == 0) & (members[:, 1] == 0) & (members[:, 2] < 0))
+    normed = np.where(flip[:, None], -members, members)
+    codes  = _hkl_codes(normed, base)
+    label_code = np.minimum.reduceat(codes, start) if len(start) else codes[:0]
+    multiplicity = np.diff(np.append(start, len(rows)))
+    group_id     = np.repeat(np.arange(len(start)), multiplicity)
+
+    # --- 5. объединение групп с одинаковой меткой (первая по порядку) ---
+    keep = np.ones(len(start), dtype=bool)
+    if merge:
+        _, first_group = np.unique(label_code, return_index=True)
+        keep = np.isin(np.arange(len(start)), first_group)
+    idx = np.flatnonzero(keep[group_id])
+
+    phase = np.exp(2j*np.pi*np.einsum('ki,ki->k', hkl[rows[idx]], t[ops[idx]]))
+    return {'hkl': members[idx], 'd': d[idx], 'two_theta': two_theta[idx],
+            'phase': phase, 'op_index': ops[idx],
+            'start': np.append(0, np.cumsum(multiplicity[keep])),
+            'hkl_label': _hkl_decode(label_code[keep], base), 'multiplicity': multiplicity[keep]}
+
+
+def _groups_F2(groups, phase_object):
+    """ |F|² для всех членов групп (как calc_structural_factors в get_vals_for_hkl) """
+    return calc_structural_factors_array(groups['hkl'], *extract_pars_for_F2(phase_object))
+
+
+def _resolve_mode(phase_object, mode):
+    if mode == 'allowed':   return phase_object.spacegroup_number, False
+    if mode == 'forbidden': return phase_object.spacegroup_number, True
+    if mode == 'all':       return None, False
+    raise ValueError(f"Неверный режим '{mode}'. Допустимо: 'allowed', 'forbidden', 'all'.")
+
+
+def build_hkl_group_arrays(phase_object, mode='allowed', individual=False,
+                           hkl_max=10, two_theta_max=None, include_hkl000=False, verbose=True):
+    """
+    Массивная часть build_hkl_groups: generate_hkl_array → group_hkl_array → |F|².
+    Параметры — как у build_hkl_groups; результат — словарь group_hkl_array
+    с дополнительным ключом 'F2' (K,).
+    """
+    a, b, c, alpha, beta, gamma = [v.value for k, v in phase_object.param_cell.items()]
+    λ = phase_object.wavelength
+    spacegroup_number, forbidden = _resolve_mode(phase_object, mode)
+
+    if verbose: 
+      print(f"Генерация hkl_data в режиме: {mode.upper()}")
+      print(f"  {'spacegroup_number':<18} = {spacegroup_number}")
+      print(f"  {'forbidden':<18} = {forbidden}")
+      print(f"  {'hklₘₐₓ':<18} = {hkl_max}")
+      print(f"  {'2θₘₐₓ':<18} = {two_theta_max}")
+      print(f"  {'individual':<18} = {individual}")
+    hkl_data = generate_hkl_array(hkl_max=hkl_max, a=a, b=b, c=c, alpha=alpha, beta=beta, gamma=gamma,
+                                  two_theta_max=two_theta_max, λ=λ, spacegroup_number=spacegroup_number,
+                                  forbidden=forbidden, verbose=verbose, include_hkl000=include_hkl000)
+
+    # --- individual=True → только тождественная операция, без инверсии и без объединения ---
+    if individual:
+        ops = [[np.zeros(3), np.eye(3)]]
+        groups = group_hkl_array(hkl_data['hkl'], (a, b, c, alpha, beta, gamma), λ, ops,
+                                 spacegroup_number=None, add_inversion=False, merge=False)
+    else:
+        groups = group_hkl_array(hkl_data['hkl'], (a, b, c, alpha, beta, gamma), λ,
+                                 phase_object.symmetry_operations, spacegroup_number, forbidden=forbidden)
+    groups['F2'] = _groups_F2(groups, phase_object)
+    return groups
+
+
+
 ## ====== Генерация hkl-групп ======
 def build_hkl_groups(phase_object, mode='allowed', individual=False,
                         hkl_max=10, two_theta_max=None, include_hkl000=False, verbose=True):
@@ -260,6 +414,11 @@ def build_hkl_groups(phase_object, mode='allowed', individual=False,
     Возвращает
     ----------
     list[list[dict]    ← Список групп, где каждая группа — это список словарей с параметрами рефлексов.
+
+    Примечания
+    ----------
+    Звёзды, группировка и |F|² считаются массивами (build_hkl_group_arrays);
+    здесь они только раскладываются в прежний формат списка словарей.
     
     Примеры
     ----------
@@ -272,61 +431,19 @@ def build_hkl_groups(phase_object, mode='allowed', individual=False,
     Режим d) индивидуальные — каждая группа = один hkl
              groups_individual = build_hkl_groups(pr.Phase1, mode='allowed', individual=True)
     """
-
-    # --- Извлекаем параметры ячейки ---
-    a, b, c, alpha, beta, gamma = [v.value for k, v in phase_object.param_cell.items()]
-    λ = phase_object.wavelength
-
-    # --- Настраиваем режим ---
-    if mode == 'allowed':
-      spacegroup_number = phase_object.spacegroup_number
-      forbidden = False
-    elif mode == 'forbidden':
-      spacegroup_number = phase_object.spacegroup_number
-      forbidden = True
-    elif mode == 'all':
-      spacegroup_number = None
-      forbidden = False
-    else:  raise ValueError(f"Неверный режим '{mode}'. Допустимо: 'allowed', 'forbidden', 'all'.")
-
-    if verbose: 
-      print(f"Генерация hkl_data в режиме: {mode.upper()}")
-      print(f"  {'spacegroup_number':<18} = {spacegroup_number}")
-      print(f"  {'forbidden':<18} = {forbidden}")
-      print(f"  {'hklₘₐₓ':<18} = {hkl_max}")
-      print(f"  {'2θₘₐₓ':<18} = {two_theta_max}")
-      print(f"  {'individual':<18} = {individual}")
-    # --- Генерация hkl_data ---
-    hkl_data = generate_hkl_array(hkl_max=hkl_max, a=a, b=b, c=c, alpha=alpha, beta=beta, gamma=gamma,
-                                  two_theta_max=two_theta_max, λ=λ, spacegroup_number=spacegroup_number,
-                                  forbidden=forbidden, verbose=verbose, include_hkl000=include_hkl000)
-
-    # --- Если individual=True → каждая группа состоит из одного hkl: генерируем звезду только по тождественной операции ---
-    if individual:
-        hkl_groups  = []
-        identity_op = [np.zeros(3), np.eye(3)]    ## тождественная операция: нулевая трансляция и единичная матрица 3x3
-        sym_ops_identity = [identity_op]
-        for hkl in tqdm(hkl_data['hkl'], desc="Generating individual groups"):
-          star_hkl = get_star_hkl(hkl, sym_ops_identity, spacegroup_number=None, add_inversion=False, verbose=False)  # Передаём в get_star_hkl только единичную операцию, чтобы не размножать hkl; убираем инверсию
-          groups = get_vals_for_hkl(star_hkl, phase_object, verbose=False, unique_only=True)       # Вызов get_vals_for_hkl заполнит все необходимые поля, включая 'F2'
-          # groups — список групп (обычно одна группа), каждый элемент grp — список словарей
-          # Разбиваем каждую возвращённую группу на одиночные группы, сохраняя формат dict'ов
-          for grp in groups:
-            for member in grp: hkl_groups.append([member.copy()])  # оборачиваем в список, как в обычном формате
-        if verbose:  print(f"\nСформировано {len(hkl_groups)} индивидуальных групп (по одному hkl в каждой).\n")
-        return hkl_groups
-
-    # --- Иначе: обычный режим с объединением эквивалентов ---
-    all_groups_dict = {}
-    for hkl in tqdm(hkl_data['hkl'], desc="Grouping hkl"):
-      star_hkl = get_star_hkl(hkl, phase_object.symmetry_operations, spacegroup_number, verbose=False)
-      groups = get_vals_for_hkl(star_hkl, phase_object, verbose=False, unique_only=True)
-      for grp in groups:
-        hkl_label = grp[0]['hkl_label']
-        key = (hkl_label,)
-        if key not in all_groups_dict: all_groups_dict[key] = grp
-    hkl_groups = list(all_groups_dict.values())
-    if verbose:  print(f"\nСформировано {len(hkl_groups)} групп после объединения по симметрии.\n")
+    g = build_hkl_group_arrays(phase_object, mode=mode, individual=individual, hkl_max=hkl_max,
+                               two_theta_max=two_theta_max, include_hkl000=include_hkl000, verbose=verbose)
+    hkl_groups = []
+    for i in range(len(g['multiplicity'])):
+      label = tuple(int(x) for x in g['hkl_label'][i])
+      mult  = int(g['multiplicity'][i])
+      hkl_groups.append([{'hkl': g['hkl'][j], 'd': float(g['d'][j]), 'two_theta': float(g['two_theta'][j]),
+                          'phase': complex(g['phase'][j]), 'op_index': int(g['op_index'][j]),
+                          'hkl_label': label, 'multiplicity': mult, 'F2': float(g['F2'][j])}
+                         for j in range(g['start'][i], g['start'][i+1])])
+    if verbose:
+      if individual: print(f"\nСформировано {len(hkl_groups)} индивидуальных групп (по одному hkl в каждой).\n")
+      else:          print(f"\nСформировано {len(hkl_groups)} групп после объединения по симметрии.\n")
     return hkl_groups
 
 
@@ -370,3 +487,28 @@ def build_bragg_positions_from_groups(groups, KPhase, two_theta_max=5.5):
     if two_theta_max!=None:
       Result = [r for r in Result if r[5]<=two_theta_max]  # Обрезка по максимальному углу
     return Result
+
+
+def build_bragg_positions_from_arrays(groups, KPhase, two_theta_max=5.5):
+    """
+    То же, что build_bragg_positions_from_groups, но по словарю массивов
+    build_hkl_group_arrays, без промежуточных словарей по рефлексам.
+    Средние берутся np.mean по срезам группы — как в build_bragg_positions_from_groups,
+    чтобы порядок групп с совпадающими 2θ был тем же.
+
+    Возвращает
+    -------
+    Result : list of list        ← [h, k, l, multiplicity, KPhase, two_theta, 'shift', 'FWHM', F2_mult, 0, 0, 0]
+    """
+    mult = np.asarray(groups['multiplicity'])
+    if len(mult) == 0:
+      return []
+    bounds = list(zip(groups['start'][:-1], groups['start'][1:]))
+    two_theta_mean = np.array([np.mean(groups['two_theta'][s:e]) for s, e in bounds])
+    F2_mean        = np.array([np.mean(groups['F2'][s:e]) for s, e in bounds])
+    F2_mult        = F2_mean * mult                                     # Учитываем multiplicity для интенсивности
+    order = np.argsort(two_theta_mean, kind='stable')                   # Сортировка по возрастанию two_theta
+    if two_theta_max != None:
+      order = order[two_theta_mean[order] <= two_theta_max]             # Обрезка по максимальному углу
+    return [[*(int(x) for x in groups['hkl_label'][i]), int(mult[i]), KPhase, float(two_theta_mean[i]),
+             'shift', 'FWHM', float(F2_mult[i]), 0, 0, 0] for i in order]
@@ -1,6 +1,24 @@
 import numpy as np
 import os
 
+
+"""
+Форматы Bragg-позиций.
+
+Текстовый (исторический): строка на рефлекс, через табуляцию
+    h  k  l  multiplicity  KPhase  2θ  'shift'  'FWHM'  F2  mode  0  0
+
+Бинарный (.npy): структурированный массив BRAGG_DTYPE — те же колонки,
+кроме строковых заглушек 'shift'/'FWHM'. Файл открывается через
+np.load(mmap_mode='r'), колонки читаются без разбора строк.
+"""
+
+BRAGG_DTYPE = np.dtype([("h", "<i4"), ("k", "<i4"), ("l", "<i4"),
+                        ("mult", "<i4"), ("KPhase", "<i4"),
+                        ("two_theta", "<f8"), ("F2", "<f8"),
+                        ("mode", "<i4"), ("aux1", "<f8"), ("aux2", "<f8")])
+BRAGG_TEXT_COLUMNS = (0, 1, 2, 3, 4, 5, 8, 9, 10, 11)    ## позиции полей BRAGG_DTYPE в текстовой строке
+
 ## ============= Сохранение ============= 
 def save_bragg_positions(array, filename=None, phase_object=None):
     """
@@ -40,7 +58,10 @@ def load_bragg_positions(filename):
     Возвращает
     -------
     list of list     ← Восстановленный массив с сохранением формата чисел и строк.
+                       Для .npy-файла строки собираются из бинарных колонок.
     """
+    if str(filename).endswith(".npy"):
+      return bragg_array_to_rows(load_bragg_table(filename, mmap=False))
     array = []
     with open(filename, 'r') as f:
       for line in f:
@@ -55,14 +76,97 @@ def load_bragg_positions(filename):
     return array
 
 
+## ============= Колонки ⇄ строки ============= 
+def bragg_rows_to_array(rows):
+    """
+    Список строк текстового формата → структурированный массив BRAGG_DTYPE.
+    Строки короче 12 колонок дополняются нулями.
+    """
+    table = np.zeros(len(rows), dtype=BRAGG_DTYPE)
+    if len(rows) == 0:
+      return table
+    cols = [[row[i] if i < len(row) else 0 for row in rows] for i in BRAGG_TEXT_COLUMNS]
+    for name, col in zip(BRAGG_DTYPE.names, cols):
+      table[name] = np.asarray(col, dtype=float)
+    return table
+
+
+def bragg_array_to_rows(table):
+    """ Структурированный массив → список строк текстового формата (с заглушками 'shift', 'FWHM') """
+    rows = []
+    for r in np.asarray(table).tolist():
+      h, k, l, mult, KPhase, two_theta, F2, mode, aux1, aux2 = r
+      aux = [int(x) if float(x).is_integer() else x for x in (aux1, aux2)]
+      rows.append([h, k, l, mult, KPhase, two_theta, 'shift', 'FWHM', F2, mode, *aux])
+    return rows
+
+
+def as_bragg_table(bragg_positions):
+    """
+    Приводит Bragg-позиции к структурированному массиву BRAGG_DTYPE.
+    Массив (в т.ч. memmap) возвращается как есть, список строк — конвертируется.
+    """
+    if isinstance(bragg_positions, np.ndarray) and bragg_positions.dtype == BRAGG_DTYPE:
+      return bragg_positions
+    return bragg_rows_to_array(bragg_positions)
+
+
+def bragg_hkl(table):
+    """ (M, 3) int-массив h, k, l из структурированного массива """
+    return np.stack([table["h"], table["k"], table["l"]], axis=-1)
+
+
+
+## ============= Бинарный формат ============= 
+def save_bragg_table(table, filename=None, phase_object=None):
+    """
+    Сохраняет Bragg-позиции (массив BRAGG_DTYPE или список строк) в .npy.
+    При phase_object имя файла — '<prefix>bragg_positions.npy'.
+    """
+    if phase_object is not None:
+      filename = f"{phase_object.prefix}bragg_positions.npy"
+    elif filename is None:
+      raise ValueError("Не указан ни filename, ни phase_object.")
+    np.save(filename, np.ascontiguousarray(as_bragg_table(table)), allow_pickle=False)
+    print(f"[INFO] Bragg positions saved as '{filename}'")
+
+
+def load_bragg_table(filename, mmap=True):
+    """
+    Загружает Bragg-позиции как структурированный массив BRAGG_DTYPE.
+
+    Параметры
+    ----------
+    filename : str      ← .npy (бинарный) или текстовый файл.
+    mmap : bool         ← Для .npy — отображать файл в память (mmap_mode='r') без чтения целиком.
+    """
+    if str(filename).endswith(".npy"):
+      table = np.load(filename, mmap_mode="r" if mmap else None, allow_pickle=False)
+      if table.dtype != BRAGG_DTYPE:
+        raise ValueError(f"Файл {filename}: неверный dtype {table.dtype}, ожидается {BRAGG_DTYPE}")
+      return table
+    return bragg_rows_to_array(load_bragg_positions(filename))
+
+
+def convert_bragg_positions(src, dst):
+    """
+    Конвертер текст ⇄ бинарный формат; направление определяется расширением dst
+    ('.npy' — бинарный, иначе текстовый).
+    """
+    table = load_bragg_table(src, mmap=False)
+    if str(dst).endswith(".npy"): save_bragg_table(table, filename=dst)
+    else:                         save_bragg_positions(bragg_array_to_rows(table), filename=dst)
+
+
+
 ## ============= Путь к файлу ============= 
-def get_bragg_file(project_name, phase_prefix, data_root="RED/examples"):
+def get_bragg_file(project_name, phase_prefix, data_root="RED/examples", ext=".txt"):
     """
     Возвращает путь к файлу bragg_positions для заданного проекта и фазы,
-    если файл существует.
+    если файл существует. ext='.npy' — бинарный вариант.
     """
     project_dir = os.path.join(data_root, project_name)
-    filename = f"{phase_prefix}bragg_positions.txt"
+    filename = f"{phase_prefix}bragg_positions{ext}"
     full_path = os.path.join(project_dir, filename)
     return full_path if os.path.exists(full_path) else None
 
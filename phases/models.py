@@ -52,6 +52,63 @@ def f_Voigt(axes,A,μ,σ,γ,uvar=False):
   f=A*w.real/(σ*(2*math.pi)**0.5)
   return f
 
+# ---- Функция Фаддеевой w(z) = exp(−z²)·erfc(−iz) для JAX ----
+"""
+Рациональное приближение Вейдемана (J.A.C. Weideman, SIAM J. Numer. Anal.
+31 (1994) 1497):
+
+    w(z) ≈ (2·p(Z)·u + 1/√π)·u,   u = 1/(L − iz),   Z = (L + iz)·u,
+
+p — многочлен степени N−1 с вещественными коэффициентами (из БПФ при
+импорте). p(Z) считается рекуррентностью Гёрцеля по x² − 2Re Z·x + |Z|²:
+два вещественных умножения на коэффициент вместо комплексной схемы
+Горнера. Только арифметика — трассируется jax.jit / vmap / grad.
+
+Точность Re w (максимум ошибки относительно max Re w, сравнение со
+scipy.special.wofz при |x| ≤ 50, 10⁻⁶ ≤ y ≤ 100):
+    N = 16 → 1e-7,   N = 24 → 1e-10 (по умолчанию),   N = 32 → 4e-14.
+Без jax_enable_x64 точность ограничена float32 (~1e-7).
+"""
+FADDEEVA_N = 24
+
+def _weideman_coefficients(N):
+  M = 2*N
+  k = np.arange(-M+1, M)
+  L = np.sqrt(N/np.sqrt(2))
+  t = L*np.tan(k*np.pi/(2*M))
+  f = np.r_[0.0, np.exp(-t**2)*(L**2+t**2)]
+  a = np.real(np.fft.fft(np.fft.fftshift(f)))/(2*M)
+  return L, np.flipud(a[1:N+1])                                 # старший коэффициент первым
+
+_WEIDEMAN_L, _WEIDEMAN_A = _weideman_coefficients(FADDEEVA_N)
+
+def faddeeva_jax(z):
+    """
+    w(z) = exp(−z²)·erfc(−iz), приближение Вейдемана (N = FADDEEVA_N).
+    Для Im z < 0 — через отражение w(z) = 2·exp(−z²) − conj(w(conj z)).
+    """
+    lower = jnp.imag(z) < 0
+    zu    = jnp.where(lower, jnp.conj(z), z)                   # верхняя полуплоскость
+    d     = _WEIDEMAN_L - 1j * zu
+    u     = jnp.conj(d) / (jnp.real(d)**2 + jnp.imag(d)**2)     # 1/(L − iz)
+    Z     = (_WEIDEMAN_L + 1j * zu) * u                        # |Z| ≤ 1
+
+    # --- p(Z): рекуррентность Гёрцеля, b_k = a_k + 2Re Z·b_{k+1} − |Z|²·b_{k+2} ---
+    s, t   = 2 * jnp.real(Z), jnp.real(Z)**2 + jnp.imag(Z)**2
+    b1, b2 = jnp.zeros_like(s), jnp.zeros_like(s)
+    for a in _WEIDEMAN_A[:-1]:
+        b1, b2 = a + s * b1 - t * b2, b1
+    p = _WEIDEMAN_A[-1] + Z * b1 - t * b2
+
+    w  = (2 * p * u + 1 / math.sqrt(math.pi)) * u
+    zl = jnp.where(lower, z, 0)                                 # exp(−z²) только там, где нужен (без inf в grad)
+    return jnp.where(lower, 2 * jnp.exp(-zl**2) - jnp.conj(w), w)
+
+def f_Voigt_jax(x, A, μ, σ, γ):
+    z = (x - μ + 1j * γ) / (σ * jnp.sqrt(2))
+    f = A * jnp.real(faddeeva_jax(z)) / (σ * jnp.sqrt(2 * jnp.pi))
+    return f
+
 """"" 5. PseudoVoigtModel """""                                                 # Работает
 def f_PseudoVoigt(axes,A,μ,σ,η, uvar=False):
   x=axes
@@ -211,6 +268,11 @@ def f_SkewedVoigt(axes,A,μ,σ,γ,skew,uvar=False):
   f=f_Voigt(x,A,μ,σ,γ)*A1
   return f
 
+def f_SkewedVoigt_jax(x, A, μ, σ, γ, skew):
+    A1 = 1 + jsp.erf(skew * (x - μ) / (σ * jnp.sqrt(2)))
+    f  = f_Voigt_jax(x, A, μ, σ, γ) * A1
+    return f
+
 
 
 
@@ -243,7 +305,7 @@ models_dict_jax = {
         'Gaussian':                 f_Gaussian_jax,
         'Lorentzian':               f_Lorentzian_jax,
         'SplitLorentzian':          f_SplitLorentzian_jax,
-        'Voigt':                    f_Voigt,                # 🚨
+        'Voigt':                    f_Voigt_jax,
         'PseudoVoigt':              f_PseudoVoigt_jax,
         'Moffat':                   f_Moffat_jax,
         'Pearson4':                 f_Pearson4_jax,
@@ -255,7 +317,7 @@ models_dict_jax = {
         'DampedHarmonicOscillator': f_DampedHarmonicOscillator_jax,
         'ExponentialGaussian':      f_ExponentialGaussian_jax,
         'SkewedGaussian':           f_SkewedGaussian_jax,
-        'SkewedVoigt':              f_SkewedVoigt}          # 🚨
+        'SkewedVoigt':              f_SkewedVoigt_jax}
 
 # list of model:
 model_list = [k for k,v in models_dict.items()]
@@ -341,11 +403,33 @@ par_form_dict = {
 
 
 
+"""
+Оценка полной ширины на полувысоте (FWHM) по shape-параметрам модели.
+Нужна для усечённого суммирования пиков (окно в единицах FWHM).
+Для моделей без локализованного пика (Lognormal, осцилляторы) оценки нет.
+"""
+_LN2 = math.log(2)
+fwhm_dict_jax = {
+        'Gaussian':            lambda σ: 2*jnp.sqrt(2*_LN2)*σ,
+        'Lorentzian':          lambda σ: 2*σ,
+        'SplitLorentzian':     lambda σ, σr: σ + σr,
+        'Voigt':               lambda σ, γ: 0.5346*2*jnp.abs(γ) + jnp.sqrt(0.2166*(2*γ)**2 + (2*jnp.sqrt(2*_LN2)*σ)**2),
+        'PseudoVoigt':         lambda σ, η: 2*σ,
+        'Moffat':              lambda σ, βm: 2*jnp.abs(σ)*jnp.sqrt(2**(1/βm) - 1),
+        'Pearson4':            lambda σ, m, v: 2*jnp.abs(σ)*jnp.sqrt(2**(1/m) - 1),
+        'Pearson7':            lambda σ, m: 2*jnp.abs(σ)*jnp.sqrt(2**(1/m) - 1),
+        'StudentsT':           lambda σ: 2*jnp.sqrt(σ*(2**(2/(σ + 1)) - 1)),
+        'BreitWigner':         lambda σ, q: jnp.abs(σ),
+        'ExponentialGaussian': lambda σ, γ: 2*jnp.sqrt(2*_LN2)*σ + 1/γ,
+        'SkewedGaussian':      lambda σ, γ: 2*jnp.sqrt(2*_LN2)*σ,
+        'SkewedVoigt':         lambda σ, γ, skew: 0.5346*2*jnp.abs(γ) + jnp.sqrt(0.2166*(2*γ)**2 + (2*jnp.sqrt(2*_LN2)*σ)**2)}
+
+
 __all__ = [
     'f_Gaussian',                 'f_Gaussian_jax',
     'f_Lorentzian',               'f_Lorentzian_jax',
     'f_SplitLorentzian',          'f_SplitLorentzian_jax',
-    'f_Voigt',
+    'f_Voigt',                    'f_Voigt_jax',
     'f_PseudoVoigt',              'f_PseudoVoigt_jax',
     'f_Moffat',                   'f_Moffat_jax',
     'f_Pearson4',                 'f_Pearson4_jax',
@@ -357,10 +441,12 @@ __all__ = [
     'f_DampedHarmonicOscillator', 'f_DampedHarmonicOscillator_jax',
     'f_ExponentialGaussian',      'f_ExponentialGaussian_jax',
     'f_SkewedGaussian',           'f_SkewedGaussian_jax',
-    'f_SkewedVoigt',
+    'f_SkewedVoigt',              'f_SkewedVoigt_jax',
+    'faddeeva_jax',               'FADDEEVA_N',
     'model_list',                 'model_list_jax',
     'models_dict',                'models_dict_jax',
-    'par_form_dict',    
+    'par_form_dict',
+    'fwhm_dict_jax',
 ]
 
 
@@ -370,7 +456,7 @@ __all__ = [
 # pr.Phase1.settings.form = 'PseudoVoigt'               # ✔
 # pr.Phase1.settings.form = 'SplitLorentzian'           # ✔ 
 # pr.Phase1.settings.form = 'Gaussian'                  # ✔
-# pr.Phase1.settings.form = 'Voigt'                     # 🚨боль
+# pr.Phase1.settings.form = 'Voigt'                     # ✔
 # pr.Phase1.settings.form = 'Lorentzian'                # ✔
 # pr.Phase1.settings.form = 'Moffat'                    # ✔
 # pr.Phase1.settings.form = 'Pearson4'                  # ✔
@@ -384,7 +470,7 @@ __all__ = [
 
 # pr.Phase1.settings.form = 'ExponentialGaussian'       # ✔
 # pr.Phase1.settings.form = 'SkewedGaussian'            # ✔
-# pr.Phase1.settings.form = 'SkewedVoigt'               # 🚨боль
+# pr.Phase1.settings.form = 'SkewedVoigt'               # ✔
 
 
 # compare_profile(pr, pr.Phase1.prefix, n_runs=1)
\ No newline at end of file
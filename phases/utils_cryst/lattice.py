@@ -104,6 +104,22 @@ def d_hkl(h,k,l, a,b,c,alpha,beta,gamma):
   d=1/D**0.5 if not h==k==l==0 else 0
   return d
 
+def d_hkl_array(hkl, a,b,c,alpha,beta,gamma):
+  """
+  Векторная версия d_hkl (numpy). hkl — shape (n, 3), возвращает d shape (n,).
+  Для (0,0,0) — 0, как в d_hkl.
+  """
+  hkl = np.asarray(hkl, dtype=float).reshape(-1, 3)
+  h, k, l = hkl[:, 0], hkl[:, 1], hkl[:, 2]
+  c_α, c_β, c_γ = math.cos(alpha/180*math.pi), math.cos(beta/180*math.pi), math.cos(gamma/180*math.pi)
+  s_α, s_β, s_γ = math.sin(alpha/180*math.pi), math.sin(beta/180*math.pi), math.sin(gamma/180*math.pi)
+  ω=(1-c_α**2-c_β**2-c_γ**2+2*c_α*c_β*c_γ)**0.5
+  C1=(h/(a/s_α))**2+(k/(b/s_β))**2+(l/(c/s_γ))**2
+  C2=2*h*k/(a*b)*(c_α*c_β-c_γ)+2*h*l/(a*c)*(c_γ*c_α-c_β)+2*k*l/(b*c)*(c_β*c_γ-c_α)
+  D=(1/ω**2)*(C1+C2)
+  nonzero = (h!=0) | (k!=0) | (l!=0)
+  return np.where(nonzero, 1/np.sqrt(np.where(nonzero, D, 1.0)), 0.0)
+
 ## ====== Объем элементарной ячейки ======
 def volume_cell(a, b, c, alpha_deg, beta_deg, gamma_deg):
   """
@@ -1,2 +1,4 @@
 from .params import create_par_bckg
-from .models import P_legendre, Background
\ No newline at end of file
+from .models import (P_legendre, Background, legendre_basis, legendre_basis_cached, clear_legendre_basis_cache,
+                     Spline, LegendreSpline, spline_band, spline_band_cached, clear_spline_band_cache,
+                     background_operator, apply_background_operator)
\ No newline at end of file
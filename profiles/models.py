@@ -1,6 +1,8 @@
+import hashlib
+import jax
 import jax.numpy as jnp  # type: ignore
 import numpy as np
-from lmfit.models import SplineModel
+from scipy.interpolate import splrep, splev
 from utils.format import get_value
 
 ## ======== Модель: полиномы Лежандра ========
@@ -81,26 +83,120 @@ def P_legendre(n,x):
     raise ValueError(f"Полином степени {n} не реализован")
   return poly_map[n](x)
 
+## --- Базис Лежандра: трёхчленная рекуррентность ---
+def legendre_basis(x, degrees):
+  """
+  Матрица базиса [P_n(x)] для заданных степеней, shape (N, len(degrees)).
+
+  Считается рекуррентностью Бонне (n+1)·P_{n+1} = (2n+1)·x·P_n − n·P_{n−1}
+  в float64 — без разложения по степеням x с большими целыми коэффициентами,
+  как в P_legendre, и без ограничения n ≤ 30.
+  """
+  x = np.asarray(x, dtype=float)
+  n_max = max(degrees)
+  P = np.empty((n_max + 1,) + x.shape)
+  P[0] = 1.0
+  if n_max >= 1:
+    P[1] = x
+  for n in range(1, n_max):
+    P[n+1] = ((2*n + 1) * x * P[n] - n * P[n-1]) / (n + 1)
+  return np.stack([P[n] for n in degrees], axis=-1)
+
+
+_LEGENDRE_BASIS_CACHE = {}
+_LEGENDRE_BASIS_CACHE_SIZE = 8
+
+def legendre_basis_cached(axes, degrees):
+  """
+  legendre_basis на оси профиля (jnp, кэш по содержимому оси и степеням).
+  Ось 2θ в ходе уточнения не меняется, поэтому базис строится один раз
+  на ось/сегмент, а фон считается одним матрично-векторным произведением.
+  """
+  axes = np.ascontiguousarray(axes, dtype=float)
+  key  = (hashlib.sha1(axes).digest(), axes.shape, tuple(degrees))
+  basis = _LEGENDRE_BASIS_CACHE.get(key)
+  if basis is None:
+    basis = jnp.asarray(legendre_basis(axes, degrees))
+    if len(_LEGENDRE_BASIS_CACHE) >= _LEGENDRE_BASIS_CACHE_SIZE:
+      _LEGENDRE_BASIS_CACHE.pop(next(iter(_LEGENDRE_BASIS_CACHE)))
+    _LEGENDRE_BASIS_CACHE[key] = basis
+  return basis
+
+def clear_legendre_basis_cache():
+  _LEGENDRE_BASIS_CACHE.clear()
+
+
 ## --- Сумма полиномов Лежандра ---
 def Background(axes, **pars):
-    x          = jnp.array(axes)
     bckg_items = [(int(k.replace('bckg','')), get_value(v))  # фильтруем параметры с 'bckg'
                   for k,v in pars.items() if 'bckg' in k]
     if not bckg_items:
-        return jnp.zeros_like(x)
+        return jnp.zeros_like(jnp.asarray(axes, dtype=float))
     degrees, coefs = zip(*bckg_items)
-    coefs          = jnp.array(coefs)
-    # --- Векторизованное суммирование: bckg_n * P_n(x) ---
-    B = jnp.sum(jnp.array([coef * P_legendre(n, x) for n, coef in zip(degrees, coefs)]), axis=0)
-    return np.array(B)
+    # --- bckg_n * P_n(x): базис (N, n_terms) из кэша, одно произведение в jax ---
+    return legendre_basis_cached(axes, degrees) @ jnp.asarray(np.asarray(coefs, dtype=float))
 
 
 
 
 ## ====== Сплайн =========
+## --- Ленточный базис кубического B-сплайна ---
+def spline_band(axes, xknots):
+  """
+  Базис сплайна фона (как в lmfit SplineModel) в ленточном виде.
+
+  S(x) = Σ_j s_j · B_j(x) — линейна по s_j, а в каждой точке оси отличны от
+  нуля не более k+1 = 4 функций B_j. Поэтому вместо матрицы (N, n_knots)
+  хранятся начало ленты и её значения.
+
+  Returns
+  -------
+  start : np.ndarray of int, shape (N,)   ← индекс первого s_j ленты в строке
+  vals  : np.ndarray, shape (N, w)        ← B_{start+i}(x), w ≤ 4
+  """
+  xknots = np.asarray(xknots, dtype=float)
+  n      = len(xknots)
+  knots, _, order = splrep(xknots, np.ones(n), k=3)                     # те же узлы, что в SplineModel
+  dense = np.stack([splev(np.asarray(axes, dtype=float), (knots, np.eye(len(knots))[j], order))
+                    for j in range(n)], axis=1)                          # (N, n) — один раз на набор узлов
+  nz    = dense != 0.0
+  first = np.where(nz.any(axis=1), nz.argmax(axis=1), 0)
+  last  = np.where(nz.any(axis=1), n - 1 - nz[:, ::-1].argmax(axis=1), 0)
+  w     = int(min(n, max(1, (last - first).max() + 1)))
+  start = np.clip(first, 0, n - w)
+  vals  = np.take_along_axis(dense, start[:, None] + np.arange(w)[None, :], axis=1)
+  return start, vals
+
+
+_SPLINE_BAND_CACHE = {}
+_SPLINE_BAND_CACHE_SIZE = 8
+
+def spline_band_cached(axes, xknots_str):
+  """ spline_band (jnp) с кэшем по строке узлов и содержимому оси """
+  axes = np.ascontiguousarray(axes, dtype=float)
+  key  = (xknots_str, hashlib.sha1(axes).digest(), axes.shape)
+  band = _SPLINE_BAND_CACHE.get(key)
+  if band is None:
+    start, vals = spline_band(axes, [float(x) for x in xknots_str.split('_')])
+    band = (jnp.asarray(start), jnp.asarray(vals))
+    if len(_SPLINE_BAND_CACHE) >= _SPLINE_BAND_CACHE_SIZE:
+      _SPLINE_BAND_CACHE.pop(next(iter(_SPLINE_BAND_CACHE)))
+    _SPLINE_BAND_CACHE[key] = band
+  return band
+
+def clear_spline_band_cache():
+  _SPLINE_BAND_CACHE.clear()
+
+
+@jax.jit
+def banded_matvec(start, vals, coefs):
+  """ Σ_i vals[:, i] · coefs[start + i] — произведение ленточной матрицы на вектор (jax) """
+  return jnp.sum(vals * coefs[start[:, None] + jnp.arange(vals.shape[1])[None, :]], axis=1)
+
+
 def Spline(axes, xknots_str=None, **pars):
   """
-  Вычисляет сплайн-функцию по заданным узлам и параметрам (обертка для спайна из lmfit).
+  Вычисляет сплайн-функцию по заданным узлам и параметрам (кубический B-сплайн, как lmfit SplineModel).
 
   Parameters
   ----------
@@ -110,12 +206,62 @@ def Spline(axes, xknots_str=None, **pars):
 
   Returns
   -------
-  ndarray                    ← Значения сплайн-функции S(x) на сетке `axes`.
+  jnp.ndarray                ← Значения сплайн-функции S(x) на сетке `axes`.
+
+  Примечания
+  ---------
+  Ленточный базис строится один раз на набор узлов и ось (spline_band_cached);
+  на каждом вызове остаётся одно ленточное произведение.
+  """
+  start, vals = spline_band_cached(axes, xknots_str)
+  n_knots = xknots_str.count('_') + 1
+  coefs   = np.array([get_value(pars[f's{j}']) for j in range(n_knots)], dtype=float)
+  return banded_matvec(start, vals, jnp.asarray(coefs))
+
+
+## ====== Лежандр + сплайн: один линейный оператор =========
+def background_operator(axes, degrees=None, xknots=None):
+  """
+  Линейный оператор фона на оси: y = P·bckg + B·s.
+
+  Parameters
+  ----------
+  axes : array-like
+  degrees : sequence of int, optional   ← степени bckg_n (None — без Лежандра)
+  xknots : sequence of float, optional  ← узлы сплайна (None — без сплайна)
+
+  Returns
+  -------
+  dict : legendre — (N, n_terms) jnp или None;
+         spline   — (start, vals) ленточный базис или None.
+  """
+  op = {"legendre": None, "spline": None}
+  if degrees:
+    op["legendre"] = legendre_basis_cached(axes, tuple(degrees))
+  if xknots is not None and len(xknots):
+    op["spline"] = spline_band_cached(axes, "_".join(str(x) for x in xknots))
+  return op
+
+def apply_background_operator(op, bckg=None, s=None):
+  """ Значения фона: одно плотное (Лежандр) и одно ленточное (сплайн) произведение """
+  y = 0.0
+  if op["legendre"] is not None:
+    y = y + op["legendre"] @ bckg
+  if op["spline"] is not None:
+    y = y + banded_matvec(*op["spline"], s)
+  return y
+
+
+def LegendreSpline(axes, xknots_str=None, **pars):
+  """
+  Фон "Legendre + Spline" (BackgroundSettings) одной функцией:
+  Σ bckg_n·P_n(x) + Σ s_j·B_j(x) через background_operator.
   """
-  knot_xvals = [float(x) for x in xknots_str.split('_')]
-  mod        = SplineModel(xknots=knot_xvals)
-  pars_for_spline = mod.make_params()
-  for k,v in pars_for_spline.items():
-     pars_for_spline[k].value = pars[k]
-  S = mod.eval(params=pars_for_spline, x=axes)
-  return S
\ No newline at end of file
+  bckg_items = sorted((int(k.replace('bckg','')), get_value(v)) for k,v in pars.items() if 'bckg' in k)
+  degrees    = [n for n, _ in bckg_items]
+  xknots     = [float(x) for x in xknots_str.split('_')]
+  op   = background_operator(axes, degrees, xknots)
+  bckg = jnp.asarray(np.array([v for _, v in bckg_items], dtype=float))
+  s    = jnp.asarray(np.array([get_value(pars[f's{j}']) for j in range(len(xknots))], dtype=float))
+  y    = apply_background_operator(op, bckg, s)
+  return y + jnp.zeros(len(axes))
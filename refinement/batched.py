@@ -0,0 +1,187 @@
+import numpy as np
+import jax
+import jax.numpy as jnp
+from diffraction.snapshot import project_to_snapshot
+from diffraction.compiled import compile_project
+from .fitting import expr_chain_matrix
+
+
+"""
+Мульти-старт: K подгонок одного шага из разных начальных точек за один
+векторизованный прогон.
+
+    starts (K словарей начальных значений)
+          │
+          ├── Θ₀ (K, n_params), P₀ (K, n_var)        # θ и уточняемые параметры каждого старта
+          ├── C = ∂θ/∂p                              # общий для всех стартов (expr_chain_matrix)
+          │
+          ▼
+    jax.vmap( Левенберг–Марквардт на lax.while_loop )
+          │     r(p) = (y − y_calc(θ₀ + C·(p − p₀)))·w   на сегменте
+          │     (JᵀJ + λ·diag JᵀJ) δ = −Jᵀr,  p ← clip(p + δ, min, max)
+          ▼
+    p*, χ², Rp, число итераций — для каждого старта
+
+Все старты используют одну скомпилированную модель (один набор параметров),
+поэтому различаться могут только значения и набор свободных параметров
+(free), но не сама раскладка: «другой порядок фона» задаётся фиксацией
+старших bckg_n в нуле.
+"""
+
+
+# ---- Один старт (под vmap) ----
+def _lm_single(forward, seg, y, w, C, lower, upper, max_iter, lam0, ftol):
+    """ Функция одного старта LM: (θ₀, p₀, free) → (p, cost, nit) """
+    y, w, C = jnp.asarray(y), jnp.asarray(w), jnp.asarray(C)
+    lower, upper = jnp.asarray(lower), jnp.asarray(upper)
+
+    def run(theta0, p0, free):
+        def resid(p):
+            return (y - forward(theta0 + C @ (p - p0))[seg]) * w
+
+        def cost_of(p):
+            r = resid(p)
+            return r @ r
+
+        def body(state):
+            p, lam, cost, it, _ = state
+            r = resid(p)
+            J = jax.jacfwd(resid)(p) * free[None, :]                      # (N, n_var), фиксированные — нули
+            A = J.T @ J
+            g = J.T @ r
+            d = jnp.diag(A)
+            A = A + lam * jnp.diag(jnp.where(d > 0, d, 1.0)) + jnp.diag(1.0 - free)
+            delta  = jnp.linalg.solve(A, -g) * free
+            p_new  = jnp.clip(p + delta, lower, upper)
+            cost_n = cost_of(p_new)
+            accept = cost_n < cost
+            conv   = accept & ((cost - cost_n) <= ftol * cost)
+            return (jnp.where(accept, p_new, p),
+                    jnp.where(accept, lam / 10.0, lam * 10.0),
+                    jnp.where(accept, cost_n, cost),
+                    it + 1,
+                    conv | (lam > 1e12))
+
+        def cond(state):
+            return (state[3] < max_iter) & ~state[4]
+
+        p0c  = jnp.clip(p0, lower, upper)
+        init = (p0c, jnp.asarray(lam0, dtype=p0.dtype), cost_of(p0c), 0, False)
+        p, _, cost, it, _ = jax.lax.while_loop(cond, body, init)
+        return p, cost, it
+    return run
+
+
+# ---- Мульти-старт ----
+def fit_multi_start(compiled, y, axes, params, starts, free=None, weights=None,
+                    max_iter=100, lam0=1e-3, ftol=1e-10, batch_size=None):
+    """
+    K подгонок одного шага из разных начальных значений, векторизованно.
+
+    Parameters
+    ----------
+    compiled : CompiledProject
+        Скомпилированная модель (diffraction.compiled).
+    y, axes : ndarray
+        Наблюдаемый профиль и ось 2θ сегмента (отрезок оси компиляции).
+    params : lmfit.Parameters
+        Шаблон: vary / границы / expr, значения по умолчанию.
+    starts : list of dict
+        Начальные значения для каждого старта {имя: значение}; не указанные
+        параметры берутся из params.
+    free : list of list of str, optional
+        Для каждого старта — подмножество уточняемых параметров; остальные
+        уточняемые параметры этого старта зафиксированы. None — все свободны.
+    weights : ndarray, optional
+        Веса невязки (как weights в lmfit.Model.fit).
+    max_iter : int
+        Максимум итераций LM на старт.
+    lam0 : float
+        Начальный параметр затухания λ.
+    ftol : float
+        Относительное уменьшение χ², при котором старт считается сошедшимся.
+    batch_size : int, optional
+        Сколько стартов считать в одном vmap (ограничивает память); None — все сразу.
+
+    Returns
+    -------
+    dict
+        params : list of lmfit.Parameters — результат каждого старта;
+        theta  : ndarray (K, n_params);
+        chisqr : ndarray (K,), Rp : ndarray (K,) — на сегменте;
+        nit    : ndarray (K,) — число итераций LM;
+        best   : int — индекс старта с минимальным Rp.
+
+    Примечания
+    ---------
+    - Параметры с expr пересчитываются линейно через C = ∂θ/∂p в начальной
+      точке params; для равенств и линейных связей это точно.
+    - Границы min/max учитываются проекцией шага на допустимый интервал;
+      без min = 0 у scale / ширин пика старт может сойтись к решению с
+      противоположным знаком (профиль от знака не зависит).
+    """
+    var_names = [n for n, p in params.items() if p.vary and not p.expr]
+    if not var_names:
+        raise ValueError("Нет уточняемых параметров (vary=True без expr)")
+    unknown = {n for s in starts for n in s} - set(params.keys())
+    if unknown:
+        raise KeyError(f"Параметры стартов отсутствуют в params: {sorted(unknown)}")
+
+    seg = compiled.axes_slice(axes)
+    y   = np.asarray(y, dtype=float)
+    w   = np.ones_like(y) if weights is None else np.asarray(weights, dtype=float)
+    C   = expr_chain_matrix(params, var_names, compiled.param_index, compiled.n_params)
+
+    # --- 1. начальные θ и p для каждого старта ---
+    thetas, ps, frees = [], [], []
+    for i, start in enumerate(starts):
+        pars = params.copy()
+        for name, val in start.items():
+            pars[name].value = val
+        pars.update_constraints()
+        thetas.append(compiled.theta_from_params(pars))
+        ps.append([pars[n].value for n in var_names])
+        allowed = var_names if free is None else free[i]
+        frees.append([float(n in allowed) for n in var_names])
+    lower = np.array([params[n].min for n in var_names], dtype=float)
+    upper = np.array([params[n].max for n in var_names], dtype=float)
+
+    # --- 2. LM, vmap по стартам ---
+    dtype = compiled._consts.dtype
+    run   = _lm_single(compiled._forward, seg, y.astype(dtype), w.astype(dtype), C.astype(dtype),
+                       lower.astype(dtype), upper.astype(dtype), max_iter, lam0, ftol)
+    run_batch = jax.jit(jax.vmap(run))
+
+    K = len(starts)
+    batch_size = batch_size or K
+    P, cost, nit = [], [], []
+    for b0 in range(0, K, batch_size):
+        sl = slice(b0, b0 + batch_size)
+        p_b, c_b, n_b = run_batch(jnp.asarray(np.array(thetas[sl]), dtype=dtype),
+                                  jnp.asarray(np.array(ps[sl]), dtype=dtype),
+                                  jnp.asarray(np.array(frees[sl]), dtype=dtype))
+        P.append(np.asarray(p_b)); cost.append(np.asarray(c_b)); nit.append(np.asarray(n_b))
+    P, cost, nit = np.concatenate(P), np.concatenate(cost), np.concatenate(nit)
+
+    # --- 3. итоговые θ, параметры и метрики ---
+    theta0 = np.array(thetas)
+    theta  = theta0 + (P - np.array(ps)) @ C.T
+    Y      = compiled.eval_batch(theta, axes=axes)                        # (K, N_seg)
+    Rp     = np.sum(np.abs(y[None, :] - Y), axis=1) / np.sum(y) * 100
+
+    results = []
+    for i in range(K):
+        pars = params.copy()
+        for name, val in zip(var_names, P[i]):
+            pars[name].value = float(val)
+        pars.update_constraints()
+        results.append(pars)
+
+    return {"params": results, "theta": theta, "chisqr": cost, "Rp": Rp,
+            "nit": nit, "best": int(np.argmin(Rp))}
+
+
+def multi_start_step(pr, y, axes, params, starts, **options):
+    """ fit_multi_start по проекту: компиляция (из кэша) + мульти-старт """
+    compiled = compile_project(project_to_snapshot(pr), params)
+    return fit_multi_start(compiled, y, axes, params, starts, **options)
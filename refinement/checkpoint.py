@@ -0,0 +1,181 @@
+import os
+import json
+import tempfile
+from datetime import datetime
+import numpy as np
+from lmfit import Parameters
+
+
+"""
+Контрольная точка уточнения: всё, что нужно, чтобы продолжить схему
+после падения процесса.
+
+    checkpoint.npz
+      ├── names, value, init_value, stderr, vary, min, max, expr   ← Parameters (out.params)
+      ├── init_names, init_values                                  ← out.init_params
+      ├── axes                                                     ← out.userkws["axes"] (сегмент)
+      └── meta (JSON)
+            ├── session      # RefinementSession.checkpoint_state: счётчики, history_len,
+            │                #   trace — решения исполнителя по порядку: [вид, step_path],
+            │                #   open_blocks — начало текущего цикла и время открытых блоков
+            └── phase_lists  # corrections / calibrate фаз (меняет resolve_refonly)
+
+    checkpoint.npz.history.jsonl   ← записи session.history, только дозапись
+
+Файл .npz пишется атомарно (временный файл + os.replace) после каждого
+шага, поэтому при падении остаётся последняя целая контрольная точка.
+Его размер не зависит от числа выполненных шагов: история дописывается
+в отдельный файл (append_history), а при возобновлении читаются первые
+history_len строк — записанные после контрольной точки отбрасываются.
+
+trace — последовательность решений, а не множество выполненных путей:
+step_path шага внутри block одинаков во всех циклах, а пропуски по cond
+и досрочная остановка блока зависят от метрик, которые при повторном
+проходе уже другие. Виды записей: "run" (шаг fit/parallel выполнен),
+"skip" (шаг или цикл block пропущен по cond), "stop" (block остановлен
+по converge).
+"""
+
+
+CHECKPOINT_VERSION = 2
+
+
+def _json_default(obj):
+    if isinstance(obj, datetime):
+        return {"__datetime__": obj.isoformat()}
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Объект типа {type(obj).__name__} не сериализуется в контрольную точку")
+
+
+def _json_object_hook(obj):
+    if "__datetime__" in obj:
+        return datetime.fromisoformat(obj["__datetime__"])
+    return obj
+
+
+# ---- Запись ----
+def save_checkpoint(path, out, session_state, phase_lists):
+    """
+    Атомарно записывает контрольную точку.
+
+    Parameters
+    ----------
+    path : str
+        Файл контрольной точки (.npz).
+    out : lmfit.ModelResult
+        Результат последнего шага (params, init_params, userkws["axes"]).
+    session_state : dict
+        RefinementSession.checkpoint_state() (включая trace).
+    phase_lists : dict
+        Списки corrections / calibrate фаз по префиксу.
+    """
+    params = out.params
+    names  = list(params.keys())
+    init_params = getattr(out, "init_params", None) or params
+    meta = {"version": CHECKPOINT_VERSION, "session": session_state, "phase_lists": phase_lists}
+    arrays = {
+        "names":       np.array(names, dtype=str),
+        "value":       np.array([params[n].value for n in names], dtype=float),
+        "init_value":  np.array([params[n].init_value if params[n].init_value is not None else np.nan
+                                 for n in names], dtype=float),
+        "stderr":      np.array([params[n].stderr if params[n].stderr is not None else np.nan
+                                 for n in names], dtype=float),
+        "vary":        np.array([params[n].vary for n in names], dtype=bool),
+        "min":         np.array([params[n].min for n in names], dtype=float),
+        "max":         np.array([params[n].max for n in names], dtype=float),
+        "expr":        np.array([params[n].expr or "" for n in names], dtype=str),
+        "init_names":  np.array(list(init_params.keys()), dtype=str),
+        "init_values": np.array([p.value for p in init_params.values()], dtype=float),
+        "axes":        np.asarray(out.userkws.get("axes", []), dtype=float),
+        "meta":        np.array(json.dumps(meta, default=_json_default)),
+    }
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+# ---- Чтение ----
+def load_checkpoint(path):
+    """
+    Читает контрольную точку.
+
+    Returns
+    -------
+    dict
+        params : lmfit.Parameters — значения, границы, vary, expr, stderr;
+        init_params : lmfit.Parameters;
+        axes : ndarray — ось последнего шага;
+        session, phase_lists — см. save_checkpoint.
+    """
+    with np.load(path, allow_pickle=False) as data:
+        arrays = {key: data[key] for key in data.files}
+    meta = json.loads(str(arrays["meta"]), object_hook=_json_object_hook)
+    if meta.get("version") != CHECKPOINT_VERSION:
+        raise ValueError(f"Версия контрольной точки {meta.get('version')} не поддерживается "
+                         f"(ожидается {CHECKPOINT_VERSION})")
+
+    # --- 1. параметры: сначала значения, затем expr (выражения ссылаются на любые параметры) ---
+    params = Parameters()
+    names  = [str(n) for n in arrays["names"]]
+    for i, name in enumerate(names):
+        params.add(name, value=float(arrays["value"][i]), vary=bool(arrays["vary"][i]),
+                   min=float(arrays["min"][i]), max=float(arrays["max"][i]))
+    for i, name in enumerate(names):
+        expr = str(arrays["expr"][i])
+        if expr:
+            params[name].expr = expr
+        par = params[name]
+        par.init_value = None if np.isnan(arrays["init_value"][i]) else float(arrays["init_value"][i])
+        par.stderr     = None if np.isnan(arrays["stderr"][i]) else float(arrays["stderr"][i])
+
+    # --- 2. начальные значения шага (out.init_params) ---
+    init_params = Parameters()
+    for name, value in zip(arrays["init_names"], arrays["init_values"]):
+        init_params.add(str(name), value=float(value), vary=False)
+
+    return {"params":      params,
+            "init_params": init_params,
+            "axes":        arrays["axes"],
+            "session":     meta["session"],
+            "phase_lists": meta["phase_lists"]}
+
+
+# ---- История сессии ----
+def history_path(path):
+    """ Файл истории рядом с контрольной точкой """
+    return path + ".history.jsonl"
+
+
+def append_history(path, entries, start):
+    """
+    Дописывает записи истории с номера start.
+
+    start = 0 — файл переписывается (новая схема или откат истории).
+    """
+    with open(history_path(path), "w" if start == 0 else "a") as f:
+        for entry in entries:
+            f.write(json.dumps(entry, default=_json_default, ensure_ascii=False) + "\n")
+
+
+def load_history(path, n_rows):
+    """
+    Первые n_rows записей истории; более поздние строки (записанные после
+    контрольной точки) удаляются из файла.
+    """
+    if not n_rows:
+        return []
+    with open(history_path(path), "rb") as f:
+        lines = f.read().split(b"\n")[:n_rows]
+    if len(lines) < n_rows or not lines[-1]:
+        raise ValueError(f"В {history_path(path)} меньше записей, чем в контрольной точке ({n_rows})")
+    os.truncate(history_path(path), sum(len(line) + 1 for line in lines))
+    return [json.loads(line, object_hook=_json_object_hook) for line in lines]
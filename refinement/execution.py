@@ -1,13 +1,28 @@
 
-from .metrics import profile_R_factor
+import os
+import copy
+import time
+import jax
+import numpy as np
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from lmfit.model import ModelResult
+from . import metrics
 from .session import RefinementSession
-from .param_utils import params_for_next, val_delta_percent
-from .schema.models import StepModel
+from .param_utils import params_for_next, val_delta_percent, deepcopy_params
+from .schema.models import StepModel, ALLOWED_MERGE_POLICIES, ALLOWED_COND_NAMES
+from .schema.cond import parse_cond, cond_names, eval_cond
 from .segment import resolve_segment
+from .fitting import fit_step, step_metrics
+from .checkpoint import save_checkpoint, load_checkpoint, append_history, load_history
+from diffraction.model import build_total_model_from_snapshot
+from diffraction.snapshot import project_to_snapshot
+from utils.format import get_value
 
 
 # ==== Исполнитель шага "fit" ====
-def execute_step(step: StepModel, pr, out_prev, session: RefinementSession, depth: int, step_path: str):
+def execute_step(step: StepModel, pr, out_prev, session: RefinementSession, depth: int, step_path: str,
+                 fit_mode=None):
     """
     Исполнитель отдельного шага типа 'fit'.
 
@@ -29,6 +44,8 @@ def execute_step(step: StepModel, pr, out_prev, session: RefinementSession, dept
         Глубина вложенности шага (для логирования и визуальной структуры).
     step_path : str
         Уникальный идентификатор текущего шага в иерархии схемы.
+    fit_mode : str, optional
+        Режим подгонки по умолчанию (если у шага не задан свой step.fit_mode).
 
     Возвращает
     -------
@@ -43,7 +60,12 @@ def execute_step(step: StepModel, pr, out_prev, session: RefinementSession, dept
     Примечания
     ---------
     - Для pre-хука 'fix_all_except' фиксируются все параметры, кроме указанных.
-    - Расчёт метрики Rp и отчёт о параметрах выполняется через session.
+    - Метрики (Rp, Rwp, χ², GoF по всему диапазону и по сегменту шага)
+      считаются step_metrics за один проход и передаются в session.
+    - fit_mode='jacobian' подгоняет скомпилированную модель с аналитическим
+      якобианом (refinement.fitting); fit_mode='varpro' решает линейные
+      параметры (scale, фон, I_hkl) точно внутри каждой итерации;
+      fit_mode='lebail' извлекает I_hkl итерациями разбиения Ле Бейля.
     - Функция не изменяет саму схему. Обновляет параметры объекта Project и сессию.
     """
     session.iter_exec_step += 1
@@ -74,17 +96,14 @@ def execute_step(step: StepModel, pr, out_prev, session: RefinementSession, dept
                        depth=depth,
                        step_path=step_path)
     # --- основной fit ---
-    out = pr.model.fit(y[s_idx:e_idx+1], axes=two_theta[s_idx:e_idx+1], params=my_pars)
-    
-    y_full = pr.Profile_points.I_obs_calibr
-    x_full = pr.Profile_points.two_theta
-    y_calc_full = pr.model.eval(out.params, axes=x_full)
-    Rp = profile_R_factor(y_obs=y_full, y_calc=y_calc_full)
-    #Rp = profile_R_factor_from_diff(diff=out.residual, y_obs=pr.Profile_points.I_obs_calibr)
-    #pr.params = out.params
-    #Rp = profile_R_factor(y_obs=pr.Profile_points.I_obs_calibr,
-    #                      y_calc=pr.Profile_points.I_calc)
-    session.report_Rp(Rp)
+    out = fit_step(pr, y[s_idx:e_idx+1], two_theta[s_idx:e_idx+1], my_pars,
+                   fit_mode=step.fit_mode or fit_mode)
+
+    # --- метрики: весь диапазон и сегмент шага за один проход ---
+    metric_vals, _ = step_metrics(pr, out.params, fit_mode=step.fit_mode or fit_mode,
+                                  nvarys=out.nvarys, segment=(s_idx, e_idx+1),
+                                  weights=metrics.METRIC_WEIGHTS)
+    session.report_Rp(metric_vals["Rp"], metrics=metric_vals)
 
     param_data = {}
     for p in step.params:
@@ -92,19 +111,157 @@ def execute_step(step: StepModel, pr, out_prev, session: RefinementSession, dept
         param_data[p] = (value, delta_percent)
     session.report_param_groups(param_data)
 
-    session.save_step(step.label, step_path=step_path, depth=depth, params=step.params)
+    session.save_step(step.label, step_path=step_path, depth=depth, params=step.params, result=out)
     return out
 
 
 
+# ==== Условие cond и сходимость блоков ====
+"""
+cond шага проверяется на метриках последнего выполненного шага
+(session.last_metrics): ложное условие — шаг пропускается, для 'block'
+условие проверяется перед каждым циклом (цикл «пока cond»).
+
+После каждого цикла 'block' с полем converge:
+
+    метрики / значения до цикла ─┐
+    метрики / значения после  ───┼── rel_Rp, rel_chisqr, shift_esd < порогов → стоп
+    время с начала блока      ───┘── max_time                         → стоп
+"""
+
+
+def cond_holds(cond, session):
+    """
+    Значение условия cond на метриках последнего шага.
+
+    Пока метрики, на которые ссылается условие, не посчитаны (шагов ещё
+    не было), условие считается истинным.
+    """
+    if cond is None:
+        return True
+    tree   = parse_cond(cond, frozenset(ALLOWED_COND_NAMES))
+    values = session.last_metrics()
+    if any(values.get(name) is None for name in cond_names(tree)):
+        return True
+    return bool(eval_cond(tree, values))
+
+
+def _relative_change(before, after):
+    if before is None or after is None or before == 0:
+        return np.inf
+    return abs(after - before) / abs(before)
+
+
+def max_shift_esd(values_before, params, names):
+    """ max |Δp| / σ(p) по параметрам names, для которых есть stderr; inf — если таких нет """
+    ratios = [abs(get_value(params[n]) - values_before[n]) / params[n].stderr
+              for n in names if n in params and n in values_before and params[n].stderr]
+    return max(ratios, default=np.inf)
+
+
+def block_converged(converge, metrics_before, metrics_after, values_before, params, names, elapsed):
+    """
+    Причина остановки циклов блока или None.
+
+    Parameters
+    ----------
+    converge : dict or None
+        Пороги StepModel.converge.
+    metrics_before, metrics_after : dict
+        Метрики до и после цикла (session.last_metrics).
+    values_before : dict
+        Значения параметров до цикла.
+    params : lmfit.Parameters
+        Параметры после цикла.
+    names : iterable of str
+        Параметры, уточнённые в цикле.
+    elapsed : float
+        Время с начала блока, с.
+    """
+    if not converge:
+        return None
+    if "max_time" in converge and elapsed >= converge["max_time"]:
+        return f"max_time {elapsed:.0f}s"
+    checks = {}
+    if "rel_Rp" in converge:
+        checks["rel_Rp"] = _relative_change(metrics_before.get("Rp"), metrics_after.get("Rp"))
+    if "rel_chisqr" in converge:
+        checks["rel_chisqr"] = _relative_change(metrics_before.get("chisqr"), metrics_after.get("chisqr"))
+    if "shift_esd" in converge:
+        checks["shift_esd"] = max_shift_esd(values_before, params, names)
+    if checks and all(value < converge[key] for key, value in checks.items()):
+        return ", ".join(f"{key} {value:.1e}" for key, value in checks.items())
+    return None
+
+
+# ==== Контрольные точки и возобновление ====
+def _record(session, pr, out, kind, step_path):
+    """ Добавляет решение в session.trace и пишет контрольную точку (если задан файл) """
+    session.trace.append([kind, step_path])
+    if session.checkpoint_path and out is not None:
+        # --- 1. история: только новые записи (всё заново — после отката истории) ---
+        start = session.history_saved if session.history_saved <= len(session.history) else 0
+        append_history(session.checkpoint_path, session.history[start:], start)
+        session.history_saved = len(session.history)
+        # --- 2. контрольная точка (после истории: лишние строки истории отбросит load_history) ---
+        save_checkpoint(session.checkpoint_path, out, session.checkpoint_state(), _phase_hkl_lists(pr))
+
+
+def _replay_peek(session):
+    """ Следующая запись trace при повторном проходе или None (повтор закончен) """
+    if session.replay_pos < session.replay_end:
+        return session.trace[session.replay_pos]
+    return None
+
+
+def _replay_take(session, step_path):
+    """ Забирает запись trace для step_path; несовпадение — схема изменилась после контрольной точки """
+    kind, path = session.trace[session.replay_pos]
+    if path != step_path:
+        raise ValueError(f"Схема не совпадает с контрольной точкой: ожидался шаг '{path}' ({kind}), "
+                         f"получен '{step_path}'")
+    session.replay_pos += 1
+    return kind
+
+
+def resume_state(path, pr, session):
+    """
+    Восстанавливает состояние из контрольной точки.
+
+    История и счётчики — в session (trace для повторного прохода),
+    corrections / calibrate — в настройки фаз pr.
+
+    Returns
+    -------
+    out : lmfit.ModelResult
+        Результат без подгонки с параметрами, init_params и осью
+        последнего выполненного шага (out_prev для следующего шага).
+    """
+    state = load_checkpoint(path)
+    session.load_state(state["session"])
+    session.history       = load_history(path, state["session"]["history_len"])
+    session.history_saved = len(session.history)
+    session.resume_t0     = time.perf_counter()
+    _apply_phase_hkl_lists(pr, state["phase_lists"])
+
+    out = ModelResult(pr.model, state["params"], data=pr.Profile_points.I_obs_calibr)
+    out.init_params = state["init_params"]
+    out.userkws     = {"axes": state["axes"]}
+    session.logger.info(f"Возобновление из {path}: выполнено решений {len(session.trace)}")
+    return out
+
+
 # Исполнитель всех шагов
-def execute_schema(schema_steps, pr, out_prev, session, depth=0, path=""):
+def execute_schema(schema_steps, pr, out_prev, session, depth=0, path="", fit_mode=None,
+                   checkpoint=None, resume_from=None):
     """
     Исполнитель схемы шагов refinement.
 
     Рекурсивно обходит список шагов:
       - fit → выполняет отдельный шаг;
-      - block → контейнер шагов с повторениями и рекурсией;
+      - block → контейнер шагов с повторениями и рекурсией; циклы
+        завершаются досрочно по converge / cond (block_converged, cond_holds);
+      - parallel → независимые ветви в пуле процессов + объединение;
       - noop → пропускает шаг.
 
     Аргументы
@@ -121,6 +278,15 @@ def execute_schema(schema_steps, pr, out_prev, session, depth=0, path=""):
         Глубина рекурсии (для логирования).
     path : str
         Идентификатор текущей ветки схемы.
+    fit_mode : str, optional
+        Режим подгонки по умолчанию для шагов без своего fit_mode.
+    checkpoint : str, optional
+        Файл контрольной точки (refinement.checkpoint), перезаписываемый
+        после каждого шага (только на верхнем уровне).
+    resume_from : str, optional
+        Контрольная точка, из которой продолжить схему: состояние
+        восстанавливается, а уже выполненные шаги пропускаются повторным
+        проходом session.trace (out_prev при этом не используется).
     
     Возвращает
     -------
@@ -137,23 +303,372 @@ def execute_schema(schema_steps, pr, out_prev, session, depth=0, path=""):
     start_block — только для логирования начала блока
     """
     if depth == 0:
-      session.iter_exec_schema += 1
+      if checkpoint is not None:
+        session.checkpoint_path = checkpoint
+      if resume_from is not None:
+        out_prev = resume_state(resume_from, pr, session)       # номер схемы — из контрольной точки
+      else:
+        session.iter_exec_schema += 1
+        session.trace, session.replay_pos, session.replay_end = [], 0, 0   # trace — решения только этой схемы
+        session.history_saved, session.open_blocks, session.resumed_blocks = 0, {}, {}
 
     for step in schema_steps:
       step_path = f"{path}.{step.step_id}" if path else step.step_id
+      if step.type in ("fit", "parallel"):
+        # --- повторный проход: шаг уже выполнен (или пропущен) до контрольной точки ---
+        if _replay_peek(session) is not None:
+          _replay_take(session, step_path)
+          continue
+        if not cond_holds(step.cond, session):
+          session.skip_step(step.label or step.step_id, step_path, depth, step.cond)
+          _record(session, pr, out_prev, "skip", step_path)
+          continue
+
       if step.type == "fit":
-        out_prev = execute_step(step, pr, out_prev, session, depth=depth, step_path=step_path)
+        out_prev = execute_step(step, pr, out_prev, session, depth=depth, step_path=step_path,
+                                fit_mode=fit_mode)
+        _record(session, pr, out_prev, "run", step_path)
     
       elif step.type == "block":
         repeat = step.repeat or 1
         session.start_block(step.label, step_path, repeat, depth)   
+        t_start = time.perf_counter()
         for i in range(repeat):
+          replayed = _replay_peek(session) is not None
+          if replayed:
+            if _replay_peek(session) == ["skip", step_path]:
+              _replay_take(session, step_path)
+              break
+          elif not cond_holds(step.cond, session):
+            session.skip_step(step.label or step.step_id, step_path, depth+1, step.cond)
+            _record(session, pr, out_prev, "skip", step_path)
+            break
+          # --- начало цикла; цикл, открытый в контрольной точке, — из неё (при повторе метрики уже конечные) ---
+          trace_pos = session.replay_pos if replayed else len(session.trace)
+          resumed   = session.resumed_blocks.get(step_path)
+          if replayed and resumed is not None and resumed["trace_pos"] == trace_pos:
+            del session.resumed_blocks[step_path]
+            metrics_before, values_before, n_history = (resumed["metrics_before"], resumed["values_before"],
+                                                        resumed["n_history"])
+            t_start = session.resume_t0 - resumed["elapsed"]          # бюджет max_time не начинается заново
+          else:
+            metrics_before = session.last_metrics()
+            values_before  = {n: get_value(p) for n, p in out_prev.params.items()} if out_prev is not None else {}
+            n_history      = len(session.history)
+          session.open_blocks[step_path] = {"t_start": t_start, "trace_pos": trace_pos, "metrics_before": metrics_before,
+                                            "values_before": values_before, "n_history": n_history}
           session.start_cycle(step.label, step_path, i+1, repeat, depth+1)
-          out_prev = execute_schema(step.steps, pr, out_prev, session, depth=depth+1, path=step_path)
+          out_prev = execute_schema(step.steps, pr, out_prev, session, depth=depth+1, path=step_path,
+                                    fit_mode=step.fit_mode or fit_mode)
+          # --- сходимость цикла: целиком повторённый цикл — решение из trace; цикл, в котором
+          #     повтор закончился, проверяется как обычный ---
+          if replayed and _replay_peek(session) is not None:
+            if _replay_peek(session) == ["stop", step_path]:
+              _replay_take(session, step_path)
+              break
+            continue
+          refined = {p for entry in session.history[n_history:] for p in (entry["params"] or [])}
+          reason  = block_converged(step.converge, metrics_before, session.last_metrics(), values_before,
+                                    out_prev.params, refined, time.perf_counter() - t_start)
+          if reason is not None:
+            if i+1 < repeat:
+              session.stop_block(step_path, i+1, repeat, depth+1, reason)
+              _record(session, pr, out_prev, "stop", step_path)
+            break
+        session.open_blocks.pop(step_path, None)
         session.current_cycle = None                 # сброс номера цикла после завершения всех циклов блока
+
+      elif step.type == "parallel":
+        out_prev = execute_parallel(step, pr, out_prev, session, depth=depth, step_path=step_path,
+                                    fit_mode=step.fit_mode or fit_mode)
+        _record(session, pr, out_prev, "run", step_path)
       else:
         raise ValueError(f"Неизвестный тип шага: {step.type}")
     # --- автосохранение ---
     if depth == 0:
         session.autosave()
-    return out_prev
\ No newline at end of file
+    return out_prev
+
+
+
+# ==== Исполнитель шага "parallel" ====
+"""
+Ветви шага 'parallel' не зависят друг от друга: каждая начинает с
+параметров out_prev (своя копия через params_for_next) и выполняется
+в отдельном процессе со своей сессией.
+
+    out_prev
+       │  Parameters, init_params, ось, метрики + Project без модели
+       ├── ветвь 1 ─┐
+       ├── ветвь 2 ─┼── ProcessPoolExecutor (spawn: модель собирается
+       └── ветвь K ─┘   заново из снимка проекта в каждом процессе)
+                    │  params, Rp, история, corrections/calibrate фаз
+                    ▼
+    объединение: best_Rp  — результат ветви с наименьшим Rp;
+                 disjoint — значения параметров, уточнённых в каждой ветви
+                    │
+                    ▼
+    out (ModelResult без подгонки: params, init_params, best_fit)
+
+fork после работы JAX (потоки XLA уже запущены) приводит к взаимной
+блокировке в дочерних процессах, поэтому процессы создаются через
+spawn / forkserver, а входные данные ветви передаются pickle.
+"""
+
+PARALLEL_START_METHOD = "spawn"
+
+
+def _portable_project(pr):
+    """ Копия pr для pickle: lmfit-модель (CompositeModel) не сериализуется и собирается в процессе заново """
+    portable = copy.copy(pr)
+    portable.model = None
+    return portable
+
+
+def _worker_inputs(pr, out):
+    """
+    Сериализуемые входные данные процесса пула: Project (копия без
+    модели), Parameters, init_params и ось out, режим x64 JAX.
+    """
+    axes = out.userkws["axes"] if getattr(out, "userkws", None) else pr.Profile_points.two_theta
+    return {"pr":          _portable_project(pr),
+            "params":      out.params,
+            "init_params": getattr(out, "init_params", None) or out.params,
+            "axes":        np.asarray(axes),
+            "x64":         bool(jax.config.jax_enable_x64)}
+
+
+def _restore_worker_inputs(inputs):
+    """
+    Project и ModelResult из _worker_inputs (в процессе пула).
+
+    Настройка x64 JAX не наследуется при spawn и задаётся до первых
+    вычислений; модель собирается из снимка проекта.
+    """
+    jax.config.update("jax_enable_x64", inputs["x64"])
+    pr = inputs["pr"]
+    if pr.model is None:
+        pr.model = build_total_model_from_snapshot(project_to_snapshot(pr))
+    out = ModelResult(pr.model, inputs["params"], data=pr.Profile_points.I_obs_calibr)
+    out.init_params = inputs["init_params"]
+    out.userkws     = {"axes": inputs["axes"]}
+    return pr, out
+
+
+def _branch_task(branch, inputs, session, depth, step_path, fit_mode):
+    """ Аргумент _run_branch: ветвь, входные данные (_worker_inputs или pr / out_prev) и контекст шага """
+    return {"branch":    branch,
+            "inputs":    inputs,
+            "metrics":   session.last_metrics(),
+            "depth":     depth,
+            "step_path": step_path,
+            "fit_mode":  fit_mode,
+            "pylogger":  session.pylogger}
+
+
+def _run_branch(task):
+    """ Выполняет одну ветвь шага 'parallel' (в процессе пула или в текущем) """
+    inputs = task["inputs"]
+    pr, out_prev = _restore_worker_inputs(inputs) if isinstance(inputs, dict) else inputs
+    session = RefinementSession(pylogger=task["pylogger"])
+    session.seed_metrics = task["metrics"]               # cond в ветви видит метрики шага до 'parallel'
+    out = execute_schema([task["branch"]], pr, out_prev, session, depth=task["depth"] + 1,
+                         path=task["step_path"], fit_mode=task["fit_mode"])
+    return {"params":      out.params,
+            "init_params": out.init_params,
+            "Rp":          session.history[-1]["Rp"] if session.history else None,
+            "history":     session.history,
+            "settings":    _phase_hkl_lists(pr)}
+
+
+def _phase_hkl_lists(pr):
+    """ Списки corrections / calibrate фаз (их меняет resolve_refonly в ветвях) """
+    lists = {}
+    for KPhase in range(1, pr.NPhases+1):
+        phase = pr.__dict__.get('Phase'+str(KPhase))
+        calibrate = phase.settings.calibrate
+        lists[phase.prefix] = {"corrections": [list(hkl) for hkl in phase.settings.corrections],
+                               "calibrate":   calibrate if calibrate == 'all' else [list(hkl) for hkl in calibrate]}
+    return lists
+
+
+def _apply_phase_hkl_lists(pr, lists):
+    """ Добавляет в настройки фаз рефлексы, появившиеся в ветви """
+    for KPhase in range(1, pr.NPhases+1):
+        phase = pr.__dict__.get('Phase'+str(KPhase))
+        branch = lists.get(phase.prefix)
+        if branch is None:
+            continue
+        for hkl in branch["corrections"]:
+            if hkl not in phase.settings.corrections:
+                phase.settings.corrections.append(hkl)
+        if branch["calibrate"] == 'all':
+            phase.settings.calibrate = 'all'
+        elif phase.settings.calibrate != 'all':
+            for hkl in branch["calibrate"]:
+                if hkl not in phase.settings.calibrate:
+                    phase.settings.calibrate.append(hkl)
+
+
+def _restore_phase_hkl_lists(pr, lists):
+    """ Возвращает настройкам фаз списки _phase_hkl_lists (рефлексы, добавленные после, удаляются) """
+    for KPhase in range(1, pr.NPhases+1):
+        phase = pr.__dict__.get('Phase'+str(KPhase))
+        saved = lists.get(phase.prefix)
+        if saved is None:
+            continue
+        phase.settings.corrections = [list(hkl) for hkl in saved["corrections"]]
+        phase.settings.calibrate   = saved["calibrate"] if saved["calibrate"] == 'all' else \
+                                     [list(hkl) for hkl in saved["calibrate"]]
+
+
+def run_branches(step: StepModel, pr, out_prev, session: RefinementSession, depth: int, step_path: str,
+                 fit_mode=None, start_method=PARALLEL_START_METHOD):
+    """
+    Выполняет ветви шага 'parallel' и возвращает их результаты (в порядке step.steps).
+
+    start_method — "spawn" или "forkserver" (fork после JAX блокирует
+    дочерние процессы). При step.workers == 1, одной ветви или
+    недоступном start_method ветви выполняются последовательно в
+    текущем процессе: перед каждой ветвью списки corrections /
+    calibrate фаз возвращаются к исходным, как у ветви в своём процессе.
+    """
+    branches = step.steps
+    workers  = step.workers or min(len(branches), os.cpu_count() or 1)
+
+    # --- 1. последовательно ---
+    if workers == 1 or len(branches) == 1 or start_method not in mp.get_all_start_methods():
+        base, results = _phase_hkl_lists(pr), []
+        for branch in branches:
+            results.append(_run_branch(_branch_task(branch, (pr, out_prev), session, depth, step_path, fit_mode)))
+            _restore_phase_hkl_lists(pr, base)
+        return results
+
+    # --- 2. пул процессов ---
+    if start_method == "fork":
+        raise ValueError("Шаг 'parallel': start_method='fork' недопустим (fork после JAX блокирует процессы)")
+    inputs = _worker_inputs(pr, out_prev)
+    tasks  = [_branch_task(branch, inputs, session, depth, step_path, fit_mode) for branch in branches]
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context(start_method)) as pool:
+        return list(pool.map(_run_branch, tasks))
+
+
+def merge_branches(results, base_params, policy="best_Rp"):
+    """
+    Объединяет результаты ветвей шага 'parallel'.
+
+    Parameters
+    ----------
+    results : list of dict
+        Результаты run_branches (params, init_params, Rp, history).
+    base_params : lmfit.Parameters
+        Параметры до шага 'parallel' (основа для 'disjoint').
+    policy : str
+        Один из ALLOWED_MERGE_POLICIES.
+
+    Returns
+    -------
+    params : lmfit.Parameters
+    init_params : lmfit.Parameters
+
+    Исключения
+    ----------
+    ValueError : неизвестная политика или пересекающиеся наборы параметров ветвей ('disjoint')
+    """
+    if policy == "best_Rp":
+        best = min(results, key=lambda r: float('inf') if r["Rp"] is None else r["Rp"])
+        return best["params"], best["init_params"]
+
+    elif policy == "disjoint":
+        merged = deepcopy_params(base_params)
+        owner  = {}
+        for i, res in enumerate(results):
+            refined = {p for entry in res["history"] for p in (entry["params"] or [])}
+            shared  = sorted(p for p in refined if p in owner)
+            if shared:
+                raise ValueError(f"Ветви {owner[shared[0]]+1} и {i+1} уточняют общие параметры: {shared}")
+            owner.update({p: i for p in refined})
+            branch_params = deepcopy_params(res["params"])
+            for name, par in branch_params.items():
+                if name not in merged:
+                    merged.add(par)                                         # параметры, добавленные в ветви (I_hkl, delta_hkl)
+                elif name in refined and not merged[name].expr:
+                    merged[name].value  = par.value
+                    merged[name].stderr = par.stderr
+        merged.update_constraints()
+        return merged, deepcopy_params(base_params)
+
+    raise ValueError(f"Неизвестная политика объединения: {policy}. Допустимые: {ALLOWED_MERGE_POLICIES}")
+
+
+def execute_parallel(step: StepModel, pr, out_prev, session: RefinementSession, depth: int, step_path: str,
+                     fit_mode=None):
+    """
+    Исполнитель шага типа 'parallel'.
+
+    Ветви (step.steps — шаги 'fit' или 'block') выполняются в пуле
+    процессов, каждая со своей копией параметров out_prev; затем
+    результаты объединяются по политике step.merge.
+
+    Аргументы
+    ---------
+    step : StepModel
+        Шаг 'parallel' с ветвями steps, политикой merge и числом процессов workers.
+    pr : Project
+    out_prev : ModelResult
+        Результат предыдущего шага — общая отправная точка ветвей.
+    session : RefinementSession
+    depth : int
+    step_path : str
+    fit_mode : str, optional
+        Режим подгонки по умолчанию для ветвей.
+
+    Возвращает
+    -------
+    out : lmfit.ModelResult
+        Результат без подгонки: объединённые params, init_params,
+        userkws (axes — полная ось) и best_fit на полной оси.
+
+    Примечания
+    ---------
+    - Процессы создаются через spawn: ветви передаются Project без
+      модели, Parameters, ось и метрики предыдущего шага, модель
+      собирается в процессе из снимка проекта; обратно передаются
+      только Parameters, Rp и история. При workers=1 ветви выполняются
+      последовательно в текущем процессе, каждая с исходными
+      corrections / calibrate фаз.
+    - Рефлексы, добавленные ветвями в corrections / calibrate фаз
+      (маркеры *_inside), переносятся в настройки фаз текущего процесса.
+    - История ветвей добавляется в session с полем "branch".
+    """
+    policy = step.merge or "best_Rp"
+    label  = step.label or step.step_id
+    session.start_parallel(label, step_path, len(step.steps), depth)
+
+    # --- 1. ветви ---
+    results = run_branches(step, pr, out_prev, session, depth, step_path, fit_mode=fit_mode)
+    for branch, res in zip(step.steps, results):
+        _apply_phase_hkl_lists(pr, res["settings"])
+        session.merge_history(res["history"], branch=branch.step_id)
+
+    # --- 2. объединение ---
+    params, init_params = merge_branches(results, out_prev.params, policy)
+
+    y_full = pr.Profile_points.I_obs_calibr
+    x_full = pr.Profile_points.two_theta
+    out = ModelResult(pr.model, params, data=y_full)
+    out.init_params = init_params
+    out.userkws     = {"axes": x_full}
+    metric_vals, out.best_fit = step_metrics(pr, params, fit_mode=fit_mode, weights=metrics.METRIC_WEIGHTS)
+
+    refined = [p for res in results for entry in res["history"] for p in (entry["params"] or [])]
+    refined = list(dict.fromkeys(refined))
+    session.iter_exec_step += 1
+    session.start_step(name=f"{label} [{policy}]",
+                       segment=(float(x_full[0]), float(x_full[-1])),
+                       n_params=len(refined),
+                       depth=depth,
+                       step_path=step_path)
+    session.report_Rp(metric_vals["Rp"], metrics=metric_vals)
+    session.save_step(f"{label} [{policy}]", step_path=step_path, depth=depth, params=refined, result=out)
+    return out
@@ -0,0 +1,649 @@
+import numpy as np
+from lmfit import Model
+from lmfit.model import ModelResult
+from scipy.optimize import lsq_linear
+from diffraction.snapshot import project_to_snapshot
+from diffraction.compiled import compile_project
+from diffraction.joint import compile_joint, joint_observed
+from diffraction.model import build_frozen_model
+from utils.format import get_value
+from .metrics import profile_metrics, fused_metrics
+from .schema.models import ALLOWED_FIT_MODES
+
+
+"""
+Режимы подгонки шага (fit_mode).
+
+    "lmfit"     — pr.model.fit(...), якобиан считается MINPACK конечными
+                  разностями: одно вычисление профиля на каждый уточняемый
+                  параметр на каждой итерации. Вклад рефлексов, не зависящих
+                  от уточняемых параметров, считается один раз в начале шага
+                  (fit_frozen, FREEZE_ENABLED);
+    "jacobian"  — скомпилированная модель (diffraction.compiled) и
+                  аналитический якобиан через jax.jvp, передаваемый в
+                  leastsq как Dfun;
+    "varpro"    — разделяемые МНК (variable projection): линейные параметры
+                  (scale / phvol, bckg_n, s_i, I_hkl le Bail) решаются точно
+                  ограниченным линейным МНК внутри каждого вычисления модели,
+                  leastsq уточняет только нелинейные (ячейка, форма, Δ, Biso, κ):
+
+                      y(p_nl, c) = y₀(p_nl) + A(p_nl)·c
+                      c*(p_nl) = argmin ‖y_obs − y₀ − A·c‖,  min ≤ c ≤ max
+                      r(p_nl)  = y_obs − y₀ − A·c*               ← невязка leastsq
+    "lebail"    — извлечение интенсивностей le Bail итерациями разбиения
+                  (le_bail_partition) вместо подгонки I_hkl; между проходами
+                  ячейка, форма и фон уточняются режимом "varpro":
+
+                      I_k ← I_k · Σᵢ φ_ki·(y_obs − y_rest)ᵢ / y_peaksᵢ  /  Σᵢ φ_ki
+
+fit_joint — совместная подгонка нескольких профилей (diffraction.joint)
+в режимах "jacobian" / "varpro" с общими структурными параметрами.
+
+Все режимы возвращают lmfit.ModelResult, поэтому params_for_next и отчёты
+сессии работают с ними одинаково. Метрики после шага (step_metrics) для
+скомпилированных режимов считаются вместе с профилем в одном вызове XLA.
+"""
+
+
+# ---- Матрица ∂θ/∂p для уточняемых параметров ----
+def expr_chain_matrix(params, var_names, param_index, n_theta, rel_step=1e-6):
+    """
+    Матрица C = ∂θ/∂p_var, shape (n_theta, n_var).
+
+    Для самих уточняемых параметров — единицы. Параметры с expr
+    (например, PhaseK_scale = Phase1_scale) получают производные
+    выражений по уточняемым параметрам; они считаются центральной
+    разностью только по тем параметрам, от которых зависят выражения —
+    модель при этом не вычисляется.
+    """
+    C = np.zeros((n_theta, len(var_names)))
+    for j, name in enumerate(var_names):
+        C[param_index[name], j] = 1.0
+
+    expr_names = [n for n, p in params.items() if p.expr and n in param_index]
+    if not expr_names:
+        return C
+
+    # --- зависимости выражений (транзитивно) ---
+    deps, stack = set(), list(expr_names)
+    while stack:
+        for d in getattr(params[stack.pop()], "_expr_deps", []):
+            if d not in deps:
+                deps.add(d)
+                if d in params and params[d].expr:
+                    stack.append(d)
+
+    for j, name in enumerate(var_names):
+        if name not in deps:
+            continue
+        par = params[name]
+        v0  = par.value
+        h   = rel_step * max(1.0, abs(v0))
+        vals = []
+        for v in (v0 + h, v0 - h):
+            par.value = v
+            params.update_constraints()
+            vals.append(np.array([params[n].value for n in expr_names]))
+        par.value = v0
+        params.update_constraints()
+        for n, dv in zip(expr_names, (vals[0] - vals[1]) / (2 * h)):
+            C[param_index[n], j] = dv
+    return C
+
+
+def make_jacobian_dfun(compiled, axes):
+    """
+    Dfun для lmfit (leastsq, col_deriv=0): якобиан невязки Model._residual,
+    (data − model)·weights, по уточняемым параметрам на отрезке axes оси компиляции.
+    """
+    seg = compiled.axes_slice(axes)
+
+    def dfun(params, data, weights, **kws):
+        var_names = [n for n, p in params.items() if p.vary and not p.expr]
+        theta = compiled.theta_from_params(params)
+        C     = expr_chain_matrix(params, var_names, compiled.param_index, compiled.n_params)
+        J     = -compiled.jacobian(theta, C)[seg]
+        if weights is not None:
+            J = J * np.asarray(weights)[:, None]
+        return J
+    return dfun
+
+
+# ---- Разделяемые МНК (variable projection) ----
+def _expr_deps(params, name):
+    """ Все параметры, от которых (транзитивно) зависит выражение параметра name """
+    deps, stack = set(), [name]
+    while stack:
+        for d in getattr(params[stack.pop()], "_expr_deps", []):
+            if d not in deps:
+                deps.add(d)
+                if d in params and params[d].expr:
+                    stack.append(d)
+    return deps
+
+
+def split_linear_params(compiled, params, var_names):
+    """
+    Делит уточняемые параметры на линейные и нелинейные.
+
+    Parameters
+    ----------
+    compiled : CompiledProject
+    params : lmfit.Parameters
+    var_names : list of str
+        Уточняемые параметры (vary=True без expr).
+
+    Returns
+    -------
+    (linear, nonlinear) : два списка имён в порядке var_names
+
+    Примечания
+    ---------
+    - Кандидаты — CompiledProject.linear_params(). Если уточняются и scale,
+      и phvol одной фазы, phvol остаётся нелинейным.
+    - Параметр перестаёт быть линейным, если от него зависит выражение
+      нелинейного параметра или выражение, смешивающее его с нелинейными
+      (например, PhaseK_scale = Phase1_scale·Phase1_phvol). Сами выражения
+      между линейными параметрами предполагаются линейными (равенства,
+      множители) — так они и учитываются через expr_chain_matrix.
+    """
+    groups = compiled.linear_params()
+    linear = {n for n in var_names if n in groups}
+    for n in list(linear):
+        if groups[n] == "phvol" and n[:-len("phvol")] + "scale" in linear:
+            linear.discard(n)
+
+    for name, par in params.items():
+        if not par.expr or name not in compiled.param_index:
+            continue
+        deps = _expr_deps(params, name) & set(var_names)
+        if deps & linear and (name not in groups or not deps <= linear):
+            linear -= deps
+    return ([n for n in var_names if n in linear],
+            [n for n in var_names if n not in linear])
+
+
+class LinearProjector:
+    """
+    Решение линейной подзадачи variable projection.
+
+    Для значений нелинейных параметров строит A = ∂y/∂c (столбцы якобиана
+    скомпилированной модели; y линейна по c, поэтому это точно),
+    y₀ = y − A·c и решает ограниченную задачу МНК для c.
+
+    Parameters
+    ----------
+    compiled : CompiledProject
+    y, axes : ndarray
+        Наблюдаемый профиль и ось 2θ сегмента.
+    params : lmfit.Parameters
+        Определяют границы и связи (expr) линейных параметров.
+    linear : list of str
+        Линейные параметры (split_linear_params).
+    """
+
+    _SIZE = 4
+
+    def __init__(self, compiled, y, axes, params, linear):
+        self.compiled = compiled
+        self.seg      = compiled.axes_slice(axes)
+        self.y        = np.asarray(y, dtype=float)
+        self.linear   = list(linear)
+        self.C        = expr_chain_matrix(params, self.linear, compiled.param_index, compiled.n_params)
+        self.lower    = np.array([params[n].min for n in self.linear], dtype=float)
+        self.upper    = np.array([params[n].max for n in self.linear], dtype=float)
+        self._solved  = {}
+
+    def solve(self, params):
+        """
+        Оптимальные линейные параметры при значениях params.
+
+        Returns
+        -------
+        dict
+            coefs (n_lin,) — решение; theta — θ с подставленным решением;
+            A (N, n_lin); y (N,) — профиль сегмента при решении;
+            free (n_lin,) bool — параметры не на границе.
+        """
+        theta = self.compiled.theta_from_params(params)
+        key   = theta.tobytes()
+        if key in self._solved:
+            return self._solved[key]
+
+        # --- 1. A и y₀ при текущих нелинейных параметрах ---
+        A  = self.compiled.jacobian(theta, self.C)[self.seg]
+        c0 = np.array([get_value(params[n]) for n in self.linear], dtype=float)
+        y0 = np.asarray(self.compiled.y_calc(theta))[self.seg] - A @ c0
+
+        # --- 2. ограниченный МНК в масштабированных столбцах (scale ~1e-3 рядом с фоном ~1e2) ---
+        norm = np.linalg.norm(A, axis=0)
+        norm = np.where(norm > 0, norm, 1.0)
+        sol  = lsq_linear(A / norm, self.y - y0, bounds=(self.lower * norm, self.upper * norm),
+                          method="bvls")
+        coefs = sol.x / norm
+
+        result = {"coefs": coefs,
+                  "theta": theta + self.C @ (coefs - c0),
+                  "A":     A,
+                  "y":     y0 + A @ coefs,
+                  "free":  sol.active_mask == 0}
+        if len(self._solved) >= self._SIZE:
+            self._solved.pop(next(iter(self._solved)))
+        self._solved[key] = result
+        return result
+
+
+def varpro_profile(axes, projector=None, **params):
+    """ Функция для lmfit.Model: профиль с линейными параметрами, решёнными проекцией """
+    return projector.solve(params)["y"]
+
+
+def make_varpro_dfun(projector):
+    """
+    Dfun для lmfit (leastsq, col_deriv=0) в режиме varpro: приближение
+    Кауфмана J = −(I − P_A)·∂y/∂p_nl, где P_A — проектор на столбцы A
+    линейных параметров, не упёршихся в границы.
+    """
+    compiled = projector.compiled
+
+    def dfun(params, data, weights, **kws):
+        var_names = [n for n, p in params.items() if p.vary and not p.expr]
+        sol = projector.solve(params)
+        C   = expr_chain_matrix(params, var_names, compiled.param_index, compiled.n_params)
+        D   = compiled.jacobian(sol["theta"], C)[projector.seg]
+        A_f = sol["A"][:, sol["free"]]
+        if A_f.shape[1]:
+            D = D - A_f @ np.linalg.lstsq(A_f, D, rcond=None)[0]
+        return -D
+    return dfun
+
+
+def _set_fit_statistics(out, y, best_fit, nvarys):
+    """ best_fit, residual и статистики χ² (ndata, nvarys, nfree, chisqr, redchi, aic, bic) в out """
+    out.best_fit = np.asarray(best_fit)
+    out.residual = np.asarray(y, dtype=float) - out.best_fit
+    out.ndata    = len(out.residual)
+    out.nvarys   = nvarys
+    out.nfree    = max(out.ndata - out.nvarys, 1)
+    out.chisqr   = float(out.residual @ out.residual)
+    out.redchi   = out.chisqr / out.nfree
+    neg2_log_likel = out.ndata * np.log(max(out.chisqr, np.finfo(float).tiny) / out.ndata)
+    out.aic = neg2_log_likel + 2 * out.nvarys
+    out.bic = neg2_log_likel + np.log(out.ndata) * out.nvarys
+
+
+def _finalize_varpro(out, projector, params, nonlinear):
+    """ Переносит решение линейной подзадачи в out: значения, stderr, статистики χ² """
+    sol = projector.solve(out.params)
+    for name, c in zip(projector.linear, sol["coefs"]):
+        out.params[name].value = float(c)
+        out.params[name].vary  = True
+    out.params.update_constraints()
+
+    _set_fit_statistics(out, projector.y, sol["y"], len(nonlinear) + len(projector.linear))
+
+    # --- stderr линейных параметров: (A_fᵀA_f)⁻¹·χ²_red при фиксированных нелинейных ---
+    A_f = sol["A"][:, sol["free"]]
+    cov = np.linalg.pinv(A_f.T @ A_f) * out.redchi if A_f.shape[1] else np.zeros((0, 0))
+    err = iter(np.sqrt(np.abs(np.diag(cov))))
+    for name, free in zip(projector.linear, sol["free"]):
+        out.params[name].stderr = float(next(err)) if free else None
+
+    out.init_params = params.copy()
+    out.model       = projector.compiled.to_lmfit_model()
+    return out
+
+
+def fit_varpro(pr, y, axes, params):
+    """
+    Подгонка шага разделяемыми МНК (variable projection).
+
+    Parameters
+    ----------
+    pr : Project
+    y, axes : ndarray
+        Наблюдаемый профиль и ось 2θ на сегменте шага.
+    params : lmfit.Parameters
+
+    Returns
+    -------
+    out : lmfit.ModelResult
+        params — все уточняемые параметры (нелинейные из leastsq, линейные
+        из проекции); nvarys, chisqr, redchi, aic, bic — по всем.
+
+    Примечания
+    ---------
+    - Линейные параметры решаются lsq_linear (BVLS) с границами min/max
+      параметров: min = 0 даёт неотрицательные scale / I_hkl.
+    - Если линейных параметров нет — это обычный режим "jacobian"; если нет
+      нелинейных — одно решение линейной задачи без leastsq.
+    - covar и var_names в out относятся только к нелинейным параметрам;
+      stderr линейных — из (AᵀA)⁻¹·χ²_red при найденных нелинейных.
+    """
+    return fit_varpro_compiled(compile_project(project_to_snapshot(pr), params), y, axes, params)
+
+
+def fit_varpro_compiled(compiled, y, axes, params):
+    """ fit_varpro для готовой скомпилированной модели (CompiledProject / CompiledJoint) """
+    var_names = [n for n, p in params.items() if p.vary and not p.expr]
+    linear, nonlinear = split_linear_params(compiled, params, var_names)
+    if not linear:
+        return fit_jacobian_compiled(compiled, y, axes, params)
+
+    projector = LinearProjector(compiled, y, axes, params, linear)
+    nl_params = params.copy()
+    for name in linear:
+        nl_params[name].vary = False
+    model = Model(varpro_profile, projector=projector)
+
+    if nonlinear:
+        out = model.fit(y, axes=axes, params=nl_params,
+                        fit_kws={"Dfun": make_varpro_dfun(projector), "col_deriv": 0})
+    else:
+        out = ModelResult(model, nl_params, data=y)
+        out.userkws = {"axes": axes}
+        out.success = True
+        out.nfev    = 1
+    return _finalize_varpro(out, projector, params, nonlinear)
+
+
+# ---- Le Bail: итерационное разбиение интенсивностей ----
+def le_bail_partition(compiled, y, axes, params, names, n_pass=50, tol=1e-4):
+    """
+    Итерации Ле Бейля для интенсивностей names при фиксированных остальных параметрах.
+
+    Наблюдаемая интенсивность за вычетом фона и вкладов Ритвельда (y_rest)
+    делится между перекрывающимися пиками пропорционально их текущим
+    вкладам:
+
+        I_k ← I_k · Σᵢ φ_ki·(y_obs − y_rest)ᵢ / y_peaksᵢ  /  Σᵢ φ_ki,   φ_ki = ∂yᵢ/∂I_k
+
+    φ = CompiledProject.le_bail_columns — профили пиков с единичной
+    интенсивностью (N, n_I); при фиксированных нелинейных параметрах они
+    не меняются, поэтому считаются один раз, а каждый проход — два
+    матрично-векторных произведения по всем рефлексам сразу.
+
+    Parameters
+    ----------
+    compiled : CompiledProject
+    y, axes : ndarray
+        Наблюдаемый профиль и ось 2θ сегмента.
+    params : lmfit.Parameters
+        Текущие значения всех параметров; границы min/max интенсивностей.
+    names : list of str
+        Интенсивности I_hkl рефлексов le Bail.
+    n_pass : int
+        Максимум проходов.
+    tol : float
+        Порог max|ΔI| / max|I| для остановки.
+
+    Returns
+    -------
+    values : ndarray (n_I,)
+        Извлечённые интенсивности.
+    n : int
+        Число выполненных проходов.
+
+    Примечания
+    ---------
+    - Обновление мультипликативное: неположительные начальные I заменяются
+      на 1, масштаб устанавливается первым же проходом.
+    - Рефлекс, на носителе которого нет точек сегмента (Σφ = 0), сохраняет
+      своё значение.
+    """
+    seg   = compiled.axes_slice(axes)
+    theta = compiled.theta_from_params(params)
+    lower = np.array([params[n].min for n in names], dtype=float)
+    upper = np.array([params[n].max for n in names], dtype=float)
+    I0    = np.array([get_value(params[n]) for n in names], dtype=float)
+    I     = np.where(I0 > 0, I0, 1.0)
+
+    # --- 1. φ = ∂y/∂I (через C — с учётом expr) и y_rest: фон + вклады Ритвельда ---
+    C          = expr_chain_matrix(params, names, compiled.param_index, compiled.n_params)
+    idx, A     = compiled.le_bail_columns(theta)
+    phi        = A[seg] @ C[idx]                                                  # (N, n_I)
+    y          = np.asarray(y, dtype=float)
+    y_rest     = np.asarray(compiled.y_calc(theta))[seg] - phi @ I0
+    y_net      = y - y_rest
+    phi_sum    = phi.sum(axis=0)
+    has_points = phi_sum > 0
+
+    # --- 2. проходы разбиения ---
+    for n in range(1, n_pass + 1):
+        y_peaks = phi @ I
+        covered = y_peaks > 1e-12 * np.max(np.abs(y_peaks))
+        ratio   = np.where(covered, y_net / np.where(covered, y_peaks, 1.0), 0.0)
+        I_new   = np.where(has_points, I * (ratio @ phi) / np.where(has_points, phi_sum, 1.0), I)
+        I_new   = np.clip(I_new, lower, upper)
+        change  = np.max(np.abs(I_new - I)) / max(np.max(np.abs(I_new)), np.finfo(float).tiny)
+        I = I_new
+        if change < tol:
+            break
+    return I, n
+
+
+def fit_lebail(pr, y, axes, params, max_cycles=10, n_pass=50, tol=1e-4):
+    """
+    Подгонка шага с извлечением интенсивностей le Bail разбиением.
+
+    Циклы: проходы le_bail_partition для I_hkl → подгонка остальных
+    уточняемых параметров (ячейка, форма, Δ, фон; режим "varpro") при
+    фиксированных I_hkl. Остановка — когда Rp сегмента меняется меньше
+    чем на tol (относительно).
+
+    Parameters
+    ----------
+    pr : Project
+    y, axes : ndarray
+        Наблюдаемый профиль и ось 2θ на сегменте шага.
+    params : lmfit.Parameters
+    max_cycles : int
+        Максимум циклов «разбиение → нелинейная подгонка».
+    n_pass : int
+        Максимум проходов разбиения в цикле.
+    tol : float
+        Порог сходимости разбиения и Rp.
+
+    Returns
+    -------
+    out : lmfit.ModelResult
+        params — все уточняемые параметры (I_hkl без stderr); nvarys,
+        chisqr, redchi — по всем; nfev — суммарно по подгонкам циклов.
+
+    Примечания
+    ---------
+    - Интенсивностями считаются уточняемые I_hkl рефлексов в режиме le Bail
+      (CompiledProject.linear_params, группа "intensities"). Если их нет —
+      это обычный режим "varpro".
+    """
+    compiled  = compile_project(project_to_snapshot(pr), params)
+    var_names = [n for n, p in params.items() if p.vary and not p.expr]
+    groups    = compiled.linear_params()
+    I_names   = [n for n in var_names if groups.get(n) == "intensities"]
+    if not I_names:
+        return fit_varpro(pr, y, axes, params)
+    others = [n for n in var_names if n not in I_names]
+
+    pars = params.copy()
+    for name in I_names:
+        pars[name].vary = False
+
+    out, nfev, Rp_prev = None, 0, np.inf
+    for cycle in range(max_cycles):
+        # --- 1. разбиение интенсивностей ---
+        I, _ = le_bail_partition(compiled, y, axes, pars, I_names, n_pass=n_pass, tol=tol)
+        for name, val in zip(I_names, I):
+            pars[name].value = float(val)
+        pars.update_constraints()
+
+        # --- 2. нелинейные параметры при фиксированных I_hkl ---
+        if others:
+            out  = fit_varpro(pr, y, axes, pars)
+            nfev += out.nfev
+            pars = out.params.copy()
+
+        Rp = np.sum(np.abs(y - compiled.eval(pars, axes=axes))) / np.sum(y)
+        if abs(Rp_prev - Rp) <= tol * Rp:
+            break
+        Rp_prev = Rp
+
+    # --- 3. результат ---
+    if out is None:
+        out = ModelResult(compiled.to_lmfit_model(), pars, data=y)
+        out.userkws = {"axes": axes}
+        out.success = True
+    out.params = pars
+    for name in I_names:
+        out.params[name].vary   = True
+        out.params[name].stderr = None
+    _set_fit_statistics(out, y, compiled.eval(out.params, axes=axes), len(var_names))
+    out.nfev        = nfev
+    out.init_params = params.copy()
+    out.model       = compiled.to_lmfit_model()
+    return out
+
+
+# ---- Подгонка шага ----
+FREEZE_ENABLED = True
+
+
+def fit_frozen(pr, y, axes, params):
+    """
+    Подгонка pr.model, в которой неуточняемые рефлексы заморожены.
+
+    Примечания
+    ---------
+    - Вклад рефлексов, не зависящих от параметров с vary=True, считается
+      один раз (diffraction.model.build_frozen_model); на каждом вызове
+      невязки — только фон и активные рефлексы.
+    - Замороженная модель годится только для оси шага, поэтому в
+      результате out.model заменяется на pr.model.
+    """
+    model = build_frozen_model(project_to_snapshot(pr), pr.model, params, axes) if FREEZE_ENABLED else None
+    if model is None:
+        return pr.model.fit(y, axes=axes, params=params)
+    out = model.fit(y, axes=axes, params=params)
+    out.model = pr.model
+    return out
+
+
+def fit_with_jacobian(pr, y, axes, params):
+    """ Подгонка скомпилированной моделью с аналитическим якобианом """
+    return fit_jacobian_compiled(compile_project(project_to_snapshot(pr), params), y, axes, params)
+
+
+def fit_jacobian_compiled(compiled, y, axes, params, weights=None):
+    """ fit_with_jacobian для готовой скомпилированной модели; weights — веса невязки lmfit """
+    model = compiled.to_lmfit_model()
+    dfun  = make_jacobian_dfun(compiled, axes)
+    return model.fit(y, axes=axes, params=params, weights=weights, fit_kws={"Dfun": dfun, "col_deriv": 0})
+
+
+def fit_step(pr, y, axes, params, fit_mode=None):
+    """
+    Запускает подгонку шага в выбранном режиме.
+
+    Parameters
+    ----------
+    pr : Project
+    y, axes : ndarray
+        Наблюдаемый профиль и ось 2θ на сегменте шага.
+    params : lmfit.Parameters
+    fit_mode : str or None
+        Один из ALLOWED_FIT_MODES; None — "lmfit".
+
+    Returns
+    -------
+    out : lmfit.ModelResult
+    """
+    fit_mode = fit_mode or "lmfit"
+    if fit_mode == "lmfit":
+        return fit_frozen(pr, y, axes, params)
+    elif fit_mode == "jacobian":
+        return fit_with_jacobian(pr, y, axes, params)
+    elif fit_mode == "varpro":
+        return fit_varpro(pr, y, axes, params)
+    elif fit_mode == "lebail":
+        return fit_lebail(pr, y, axes, params)
+    raise ValueError(f"Неизвестный режим подгонки: {fit_mode}. Допустимые: {ALLOWED_FIT_MODES}")
+
+
+# ---- Метрики шага ----
+COMPILED_FIT_MODES = ("jacobian", "varpro", "lebail")
+
+
+def step_metrics(pr, params, fit_mode=None, nvarys=0, segment=None, weights=None):
+    """
+    Метрики профиля на полной оси после шага.
+
+    Parameters
+    ----------
+    pr : Project
+    params : lmfit.Parameters
+    fit_mode : str or None
+        Для скомпилированных режимов — fused_metrics поверх той же
+        CompiledProject (из кэша compile_project), иначе pr.model.eval
+        и profile_metrics.
+    nvarys, segment, weights
+        См. refinement.metrics.profile_metrics.
+
+    Returns
+    -------
+    metrics : dict
+    y_calc : ndarray — профиль на полной оси
+    """
+    y_full = pr.Profile_points.I_obs_calibr
+    x_full = pr.Profile_points.two_theta
+    if (fit_mode or "lmfit") in COMPILED_FIT_MODES:
+        compiled = compile_project(project_to_snapshot(pr), params)
+        return fused_metrics(compiled, params, y_full, weights=weights, nvarys=nvarys, segment=segment)
+    y_calc = pr.model.eval(params, axes=x_full)
+    return profile_metrics(y_full, y_calc, weights=weights, nvarys=nvarys, segment=segment), y_calc
+
+
+# ---- Совместная подгонка нескольких профилей ----
+JOINT_FIT_MODES = ("jacobian", "varpro")
+
+
+def fit_joint(patterns, params, fit_mode="jacobian", weights=None, **options):
+    """
+    Совместная подгонка нескольких профилей с общими структурными параметрами.
+
+    Parameters
+    ----------
+    patterns : dict
+        {префикс профиля: snapshot} (diffraction.joint.joint_snapshots).
+    params : lmfit.Parameters
+        Раскладка совместной модели (diffraction.joint.joint_parameters):
+        префикс + name — параметр профиля, name — общий.
+    fit_mode : str
+        "jacobian" или "varpro" (см. fit_step).
+    weights : dict, optional
+        {префикс: вес невязки профиля (число или массив)} — уравнивает вклад
+        профилей с разной экспозицией. Только для "jacobian".
+    **options
+        Параметры сборки (peak_window, window_growth, F2_max_bytes).
+
+    Returns
+    -------
+    out : lmfit.ModelResult
+        Невязка и best_fit — конкатенация профилей; out.pattern_metrics —
+        {префикс: profile_metrics профиля} после подгонки.
+    """
+    if fit_mode not in JOINT_FIT_MODES:
+        raise ValueError(f"Неизвестный режим совместной подгонки: {fit_mode}. Допустимые: {JOINT_FIT_MODES}")
+    joint = compile_joint(patterns, params, **options)
+    y     = joint_observed(patterns)
+
+    if fit_mode == "jacobian":
+        w   = joint.pattern_weights(weights) if weights is not None else None
+        out = fit_jacobian_compiled(joint, y, joint.axes, params, weights=w)
+    else:
+        if weights is not None:
+            raise ValueError("Веса профилей поддерживаются только в режиме 'jacobian'")
+        out = fit_varpro_compiled(joint, y, joint.axes, params)
+
+    y_obs, y_calc = joint.split(y), joint.split(joint.eval(out.params))
+    out.pattern_metrics = {prefix: profile_metrics(y_obs[prefix], y_calc[prefix], nvarys=out.nvarys)
+                           for prefix in joint.prefixes}
+    return out
@@ -0,0 +1,223 @@
+import os
+import json
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from .metrics import METRIC_NAMES
+
+
+"""
+Колоночное хранилище истории уточнения (только дозапись).
+
+RefinementSession.history — список словарей, который autosave пишет
+целиком (pickle) в конце каждой схемы, а уточнённые значения в нём не
+сохраняются. HistoryStore пишет одну строку на шаг сразу на диск:
+
+    store/
+      ├── columns.json   # имена параметров в порядке первого появления
+      ├── index.i64      # на строку: смещение и ширина строки values/stderr
+      ├── values.f64     # значения параметров (ширина = число известных имён на момент записи)
+      ├── stderr.f64     # ESD тех же параметров (NaN — нет)
+      ├── scalars.f64    # фиксированная ширина: SCALAR_COLUMNS
+      └── meta.jsonl     # label, step_path, params, branch, pattern
+
+Запись шага — дозапись в конец файлов, O(1) по числу уже сохранённых
+шагов; columns.json переписывается только при появлении новых имён
+(I_hkl из corrections). Чтение — np.fromfile по каждому файлу целиком.
+Строки, записанные не полностью (падение процесса между файлами),
+отбрасываются при открытии.
+"""
+
+
+SCALAR_COLUMNS = (("iter_exec_schema", "iter_exec_step", "cycle", "depth", "nfev", "elapsed", "timestamp")
+                  + METRIC_NAMES + tuple(name + "_seg" for name in METRIC_NAMES))
+META_COLUMNS = ("label", "step_path", "params", "branch", "pattern")
+
+
+# ---- Хранилище ----
+class HistoryStore:
+    """
+    Дозаписываемая колоночная история шагов в каталоге path.
+
+    Parameters
+    ----------
+    path : str
+        Каталог хранилища (создаётся при необходимости). Существующее
+        хранилище открывается для дозаписи: в одном каталоге можно
+        копить историю многих запусков.
+
+    Примечания
+    ---------
+    - Ширина строки значений равна числу имён, известных на момент записи;
+      при чтении более короткие (ранние) строки дополняются NaN.
+    - timestamp хранится как POSIX-время (float).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        columns_file = self._file("columns.json")
+        self.columns = []
+        if os.path.exists(columns_file):
+            with open(columns_file) as f:
+                self.columns = json.load(f)
+        self._column_index = {name: i for i, name in enumerate(self.columns)}
+        self.n_rows = self._repair()
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def __len__(self):
+        return self.n_rows
+
+
+    # ---- Согласованность файлов ----
+    def _row_counts(self):
+        """ Число целых строк в каждом файле """
+        size = lambda name: os.path.getsize(self._file(name)) if os.path.exists(self._file(name)) else 0
+        index = np.fromfile(self._file("index.i64"), dtype=np.int64).reshape(-1, 2) \
+            if size("index.i64") else np.zeros((0, 2), dtype=np.int64)
+        ends = index[:, 0] + index[:, 1]
+        n_values = int(np.searchsorted(ends, size("values.f64") // 8, side="right"))
+        n_stderr = int(np.searchsorted(ends, size("stderr.f64") // 8, side="right"))
+        n_meta = 0
+        if size("meta.jsonl"):
+            with open(self._file("meta.jsonl"), "rb") as f:
+                n_meta = f.read().count(b"\n")
+        return {"index.i64": len(index), "values.f64": n_values, "stderr.f64": n_stderr,
+                "scalars.f64": size("scalars.f64") // (8 * len(SCALAR_COLUMNS)), "meta.jsonl": n_meta}, index
+
+    def _repair(self):
+        """ Отбрасывает неполные строки (после падения процесса во время записи) """
+        counts, index = self._row_counts()
+        n_rows = min(counts.values())
+        self.truncate(n_rows, index=index)
+        return n_rows
+
+    def truncate(self, n_rows, index=None):
+        """
+        Оставляет первые n_rows строк (возобновление из контрольной точки,
+        записанной раньше последних строк).
+        """
+        if index is None:
+            index = self._row_counts()[1]
+        n_values = int(index[n_rows - 1].sum()) if n_rows else 0
+        sizes = {"index.i64": n_rows * 16, "values.f64": n_values * 8, "stderr.f64": n_values * 8,
+                 "scalars.f64": n_rows * 8 * len(SCALAR_COLUMNS)}
+        for name, size in sizes.items():
+            if os.path.exists(self._file(name)) and os.path.getsize(self._file(name)) > size:
+                os.truncate(self._file(name), size)
+        if os.path.exists(self._file("meta.jsonl")):
+            with open(self._file("meta.jsonl"), "rb") as f:
+                lines = f.read().split(b"\n")[:n_rows]
+            if len(lines) == n_rows:
+                os.truncate(self._file("meta.jsonl"), sum(len(line) + 1 for line in lines))
+        self.n_rows = n_rows
+
+
+    # ---- Запись ----
+    def _register(self, names):
+        """ Новые имена параметров → хвост columns (columns.json переписывается атомарно) """
+        new = [name for name in names if name not in self._column_index]
+        if not new:
+            return
+        for name in new:
+            self._column_index[name] = len(self.columns)
+            self.columns.append(name)
+        tmp = self._file("columns.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(self.columns, f)
+        os.replace(tmp, self._file("columns.json"))
+
+    def append(self, entry, params=None, nfev=None, elapsed=None):
+        """
+        Дозаписывает строку шага.
+
+        Parameters
+        ----------
+        entry : dict
+            Запись истории (RefinementSession.save_step / merge_history).
+        params : lmfit.Parameters, optional
+            Параметры после шага; None — строка значений нулевой ширины.
+        nfev : int, optional
+        elapsed : float, optional
+            Время шага, с.
+        """
+        values = stderr = np.zeros(0)
+        if params is not None:
+            self._register(params.keys())
+            values = np.full(len(self.columns), np.nan)
+            stderr = np.full(len(self.columns), np.nan)
+            for name, par in params.items():
+                i = self._column_index[name]
+                values[i] = par.value
+                stderr[i] = np.nan if par.stderr is None else par.stderr
+
+        offset = int(self._values_end())
+        timestamp = entry.get("timestamp")
+        scalars = {**entry, "nfev": nfev, "elapsed": elapsed,
+                   "timestamp": timestamp.timestamp() if isinstance(timestamp, datetime) else timestamp}
+        row = np.array([np.nan if scalars.get(c) is None else float(scalars[c]) for c in SCALAR_COLUMNS])
+        meta = {c: entry.get(c) for c in META_COLUMNS}
+
+        with open(self._file("values.f64"), "ab") as f:
+            values.tofile(f)
+        with open(self._file("stderr.f64"), "ab") as f:
+            stderr.tofile(f)
+        with open(self._file("scalars.f64"), "ab") as f:
+            row.tofile(f)
+        with open(self._file("meta.jsonl"), "a") as f:
+            f.write(json.dumps(meta, ensure_ascii=False) + "\n")
+        with open(self._file("index.i64"), "ab") as f:          # последней: строка целая, только если есть индекс
+            np.array([offset, len(values)], dtype=np.int64).tofile(f)
+        self.n_rows += 1
+
+    def _values_end(self):
+        """ Конец потока values (смещение следующей строки) """
+        path = self._file("values.f64")
+        return os.path.getsize(path) // 8 if os.path.exists(path) else 0
+
+
+    # ---- Чтение ----
+    def to_frame(self):
+        """
+        Скалярные столбцы и метаданные шагов.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Столбцы SCALAR_COLUMNS (timestamp — datetime) и META_COLUMNS.
+        """
+        scalars = np.fromfile(self._file("scalars.f64"), dtype=float) \
+            if self.n_rows else np.zeros(0)
+        df = pd.DataFrame(scalars[:self.n_rows * len(SCALAR_COLUMNS)].reshape(-1, len(SCALAR_COLUMNS)),
+                          columns=SCALAR_COLUMNS)
+        for column in ("iter_exec_schema", "iter_exec_step", "cycle", "depth", "nfev"):
+            df[column] = df[column].astype("Int64")
+        df["timestamp"] = pd.to_datetime(df["timestamp"], unit="s")
+        meta = []
+        if self.n_rows:
+            with open(self._file("meta.jsonl")) as f:
+                meta = [json.loads(line) for line, _ in zip(f, range(self.n_rows))]
+        for column in META_COLUMNS:
+            df[column] = [m.get(column) for m in meta]
+        return df
+
+    def parameter_frame(self, kind="value"):
+        """
+        Значения (kind="value") или ESD (kind="stderr") параметров по шагам.
+
+        Returns
+        -------
+        pandas.DataFrame : (строки шагов) × columns; NaN — параметра ещё не было
+        """
+        if kind not in ("value", "stderr"):
+            raise ValueError(f"Неизвестный вид столбцов: {kind}. Допустимые: 'value', 'stderr'")
+        n_cols = len(self.columns)
+        matrix = np.full((self.n_rows, n_cols), np.nan)
+        if self.n_rows:
+            index = np.fromfile(self._file("index.i64"), dtype=np.int64).reshape(-1, 2)[:self.n_rows]
+            data  = np.fromfile(self._file("values.f64" if kind == "value" else "stderr.f64"), dtype=float)
+            for row, (offset, width) in enumerate(index):
+                matrix[row, :width] = data[offset:offset + width]
+        return pd.DataFrame(matrix, columns=self.columns)
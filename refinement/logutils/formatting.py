@@ -138,6 +138,9 @@ def format_cycle_header(step_path: str, depth: int, kind: str = "cycle", idx: in
     Поддерживаемые типы:
     - strategy  → "▶ CYCLE BLOCK ×5"
     - cycle     → "↻ Cycle 2/5"
+    - parallel  → "⇉ SEGMENTS ∥3"
+    - stop      → "■ Stop 3/10: rel_Rp 2.1e-05"
+    - skip      → "⤼ SCALE: cond"
 
     Parameters
     ----------
@@ -177,6 +180,19 @@ def format_cycle_header(step_path: str, depth: int, kind: str = "cycle", idx: in
         step_label = f"▶ {label}"  # блок стратегии, например "cycle_block ×5"
         padded_label = f"{step_label:<{width + len(make_indent(depth+1))}}"
         return f"{indent}{LIGHTGRAY_BG}{BOLD}{padded_label}{BOLD_OFF}{RESET_ALL}"
+
+    elif kind == "parallel":
+        step_label = f"⇉ {label}"  # параллельные ветви, например "segments ∥3"
+        padded_label = f"{step_label:<{width + len(make_indent(depth+1))}}"
+        return f"{indent}{LIGHTGRAY_BG}{BOLD}{padded_label}{BOLD_OFF}{RESET_ALL}"
+
+    elif kind == "stop":
+        step_label = f"■ Stop {idx}/{total}: {label}"  # досрочное завершение циклов блока
+        return f"{indent}{RED}{BOLD}{step_label:<{width}}{BOLD_OFF}{RESET_ALL}"
+
+    elif kind == "skip":
+        step_label = f"⤼ {label}"  # шаг пропущен по условию cond
+        return f"{indent}{step_label:<{width}}{RESET_ALL}"
     
     else:
         raise ValueError("Unknown kind for cycle line")
\ No newline at end of file
@@ -1,17 +1,170 @@
 import numpy as np
+import jax
+import jax.numpy as jnp
+
+
+"""
+Метрики качества профиля.
+
+Все метрики считаются за один векторный проход по невязке r = y_obs − y_calc
+(metric_sums): пять сумм по всему диапазону и столько же по сегменту шага
+(маска). Для скомпилированной модели проход слит с вычислением y_calc
+в одном jax.jit (fused_metrics), без отдельного вычисления профиля на хосте.
+
+    y_obs, y_calc, w, mask
+          │
+          ▼
+    metric_sums → Σ|r|, Σ|y|, Σw·r², Σw·y², n      (весь диапазон и сегмент)
+          │
+          ▼
+    metrics_from_sums → Rp, Rwp, Rexp, chisqr, redchi, GoF  (+ *_seg)
+
+    Rp     = Σ|r| / Σ|y| · 100
+    Rwp    = √(Σw·r² / Σw·y²) · 100
+    Rexp   = √((n − P) / Σw·y²) · 100
+    chisqr = Σw·r²,  redchi = chisqr / (n − P),  GoF = √redchi
+
+Веса: None — единичные (chisqr совпадает с out.chisqr lmfit),
+"counting" — счётная статистика w = 1/max(y_obs, 1), или массив w.
+"""
+
+
+METRIC_NAMES = ("Rp", "Rwp", "Rexp", "chisqr", "redchi", "GoF")
+METRIC_WEIGHTS = None          # веса метрик шага по умолчанию: None | "counting"
+
 
 # ==== Профильный R-фактор ====
 def profile_R_factor(y_obs, y_calc):
-  a1=float(sum(abs(y_obs-y_calc)))
-  a2=float(sum(y_obs))
-  Rp=a1/a2*100
-  return Rp
+    return float(np.sum(np.abs(np.asarray(y_obs) - np.asarray(y_calc))) / np.sum(y_obs) * 100)
 
 
 def profile_R_factor_from_diff(diff, y_obs):
-    """" 
+    """"
     Удобно вызвать:
     ------
-    >>> Rp = profile_R_factor_from_diff(diff=out.residual, y_obs=pr.Profile_points.I_obs_calibr) 
+    >>> Rp = profile_R_factor_from_diff(diff=out.residual, y_obs=pr.Profile_points.I_obs_calibr)
+    """
+    return float(np.sum(np.abs(diff)) / np.sum(np.abs(y_obs)) * 100)
+
+
+# ==== Векторный расчёт метрик ====
+def metric_weights(y_obs, weights=None):
+    """ Веса w = 1/σ²: None → 1, "counting" → 1/max(y_obs, 1), иначе массив """
+    y_obs = np.asarray(y_obs, dtype=float)
+    if weights is None:
+        return np.ones_like(y_obs)
+    if isinstance(weights, str):
+        if weights != "counting":
+            raise ValueError(f"Неизвестные веса метрик: {weights}. Допустимые: None, 'counting'")
+        return 1.0 / np.maximum(y_obs, 1.0)
+    return np.broadcast_to(np.asarray(weights, dtype=float), y_obs.shape)
+
+
+def segment_mask(n, segment=None):
+    """ Маска (n,) сегмента: slice, (start, stop) или None (весь диапазон) """
+    mask = np.zeros(n)
+    if segment is None:
+        mask[:] = 1.0
+    else:
+        mask[segment if isinstance(segment, slice) else slice(*segment)] = 1.0
+    return mask
+
+
+def metric_sums(y_obs, y_calc, w, mask, xp=np):
+    """
+    Суммы для метрик за один проход.
+
+    Returns
+    -------
+    sums : array (2, 5)
+        Строки — весь диапазон и сегмент (mask);
+        столбцы — Σ|r|, Σ|y|, Σw·r², Σw·y², n.
+    """
+    r = y_obs - y_calc
+    terms = xp.stack([xp.abs(r), xp.abs(y_obs), w * r * r, w * y_obs * y_obs, xp.ones_like(r)])
+    return xp.stack([terms.sum(axis=1), terms @ mask])
+
+
+def metrics_from_sums(sums, nvarys=0):
+    """ Метрики из сумм metric_sums; P = nvarys. Ключи сегмента — с суффиксом _seg """
+    metrics = {}
+    for (abs_r, abs_y, wr2, wy2, n), suffix in zip(np.asarray(sums, dtype=float), ("", "_seg")):
+        nfree = max(n - nvarys, 1.0)
+        metrics["Rp" + suffix]     = float(abs_r / abs_y * 100) if abs_y > 0 else float("nan")
+        metrics["Rwp" + suffix]    = float(np.sqrt(wr2 / wy2) * 100) if wy2 > 0 else float("nan")
+        metrics["Rexp" + suffix]   = float(np.sqrt(nfree / wy2) * 100) if wy2 > 0 else float("nan")
+        metrics["chisqr" + suffix] = float(wr2)
+        metrics["redchi" + suffix] = float(wr2 / nfree)
+        metrics["GoF" + suffix]    = float(np.sqrt(wr2 / nfree))
+    return metrics
+
+
+def profile_metrics(y_obs, y_calc, weights=None, nvarys=0, segment=None):
+    """
+    Rp, Rwp, Rexp, χ², χ²_red и GoF по всему диапазону и по сегменту.
+
+    Parameters
+    ----------
+    y_obs, y_calc : ndarray
+    weights : None, "counting" или ndarray
+    nvarys : int
+        Число уточняемых параметров (P в n − P).
+    segment : slice, (start, stop) или None
+        Сегмент шага; None — метрики *_seg совпадают с полными.
+
+    Returns
+    -------
+    dict : METRIC_NAMES и те же имена с суффиксом _seg
     """
-    return float(np.sum(np.abs(diff)) / np.sum(np.abs(y_obs)) * 100)
\ No newline at end of file
+    y_obs  = np.asarray(y_obs, dtype=float)
+    y_calc = np.asarray(y_calc, dtype=float)
+    sums = metric_sums(y_obs, y_calc, metric_weights(y_obs, weights), segment_mask(len(y_obs), segment))
+    return metrics_from_sums(sums, nvarys)
+
+
+# ==== Метрики, слитые со скомпилированной моделью ====
+_FUSED_CACHE = {}
+_FUSED_CACHE_SIZE = 8
+
+
+def _fused_function(compiled):
+    """ jax.jit: θ, y_obs, w, mask → (y_calc, суммы) для CompiledProject """
+    entry = _FUSED_CACHE.get(id(compiled))
+    if entry is None or entry[0] is not compiled:
+        def fused(theta, y_obs, w, mask):
+            y_calc = compiled._forward(theta)
+            return y_calc, metric_sums(y_obs, y_calc, w, mask, xp=jnp)
+        if len(_FUSED_CACHE) >= _FUSED_CACHE_SIZE:
+            _FUSED_CACHE.pop(next(iter(_FUSED_CACHE)))
+        entry = (compiled, jax.jit(fused))
+        _FUSED_CACHE[id(compiled)] = entry
+    return entry[1]
+
+
+def fused_metrics(compiled, params, y_obs, weights=None, nvarys=0, segment=None):
+    """
+    Метрики и y_calc на оси компиляции за один вызов XLA.
+
+    Parameters
+    ----------
+    compiled : diffraction.compiled.CompiledProject
+    params : lmfit.Parameters или dict
+    y_obs : ndarray
+        Наблюдаемый профиль на оси компиляции.
+    weights, nvarys, segment
+        См. profile_metrics.
+
+    Returns
+    -------
+    metrics : dict
+    y_calc : ndarray
+    """
+    y_obs = np.asarray(y_obs, dtype=float)
+    y_calc, sums = _fused_function(compiled)(compiled.theta_from_params(params), y_obs,
+                                             metric_weights(y_obs, weights),
+                                             segment_mask(len(y_obs), segment))
+    return metrics_from_sums(sums, nvarys), np.asarray(y_calc)
+
+
+def clear_fused_cache():
+    _FUSED_CACHE.clear()
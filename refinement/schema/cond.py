@@ -0,0 +1,107 @@
+import ast
+import operator
+from functools import lru_cache
+
+
+"""
+Условие cond шага: разбор и вычисление без eval.
+
+Выражение разбирается ast.parse один раз (кэш по строке) и проверяется
+по белому списку узлов; вычисляется обход дерева, поэтому атрибуты,
+вызовы, индексы и т.п. невозможны ни при проверке схемы, ни при
+выполнении:
+
+    "Rp < 5 and not GoF > 2"
+          │ parse_cond
+          ▼
+    BoolOp(and) ── Compare(Rp < 5)
+                └─ UnaryOp(not) ── Compare(GoF > 2)
+          │ eval_cond(tree, метрики)
+          ▼
+    True / False
+
+Допустимо: and / or / not, сравнения (<, <=, >, >=, ==, !=, цепочки),
++ − * /, унарные + и −, числовые константы и имена ALLOWED_COND_NAMES.
+"""
+
+
+_BOOL_OPS    = {ast.And: all, ast.Or: any}
+_UNARY_OPS   = {ast.Not: operator.not_, ast.USub: operator.neg, ast.UAdd: operator.pos}
+_BINARY_OPS  = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.Div: operator.truediv}
+_COMPARE_OPS = {ast.Lt: operator.lt, ast.LtE: operator.le, ast.Gt: operator.gt, ast.GtE: operator.ge,
+                ast.Eq: operator.eq, ast.NotEq: operator.ne}
+
+
+def _check(node, names):
+    """ Проверка узла по белому списку (рекурсивно) """
+    if isinstance(node, ast.BoolOp) and type(node.op) in _BOOL_OPS:
+        children = node.values
+    elif isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY_OPS:
+        children = [node.operand]
+    elif isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPS:
+        children = [node.left, node.right]
+    elif isinstance(node, ast.Compare) and all(type(op) in _COMPARE_OPS for op in node.ops):
+        children = [node.left, *node.comparators]
+    elif isinstance(node, ast.Name):
+        if node.id not in names:
+            raise ValueError(f"имя '{node.id}' не входит в список допустимых метрик: {', '.join(sorted(names))}")
+        return
+    elif isinstance(node, ast.Constant) and type(node.value) in (int, float):
+        return
+    else:
+        raise ValueError(f"недопустимая конструкция в выражении 'cond': {type(node).__name__}")
+    for child in children:
+        _check(child, names)
+
+
+@lru_cache(maxsize=256)
+def parse_cond(cond, names):
+    """
+    Разбирает и проверяет условие.
+
+    Parameters
+    ----------
+    cond : str
+    names : frozenset of str
+        Допустимые имена (ALLOWED_COND_NAMES).
+
+    Returns
+    -------
+    ast.expr : корень выражения
+
+    Raises
+    ------
+    ValueError : синтаксическая ошибка или узел вне белого списка
+    """
+    try:
+        tree = ast.parse(cond, mode="eval").body
+    except SyntaxError as e:
+        raise ValueError(f"синтаксическая ошибка в выражении 'cond': {e.msg}")
+    _check(tree, names)
+    return tree
+
+
+def cond_names(tree):
+    """ Имена метрик, на которые ссылается выражение """
+    return {node.id for node in ast.walk(tree) if isinstance(node, ast.Name)}
+
+
+def eval_cond(tree, values):
+    """ Значение проверенного выражения (parse_cond) на словаре метрик values """
+    if isinstance(tree, ast.BoolOp):
+        return _BOOL_OPS[type(tree.op)](eval_cond(v, values) for v in tree.values)
+    if isinstance(tree, ast.UnaryOp):
+        return _UNARY_OPS[type(tree.op)](eval_cond(tree.operand, values))
+    if isinstance(tree, ast.BinOp):
+        return _BINARY_OPS[type(tree.op)](eval_cond(tree.left, values), eval_cond(tree.right, values))
+    if isinstance(tree, ast.Compare):
+        left = eval_cond(tree.left, values)
+        for op, comparator in zip(tree.ops, tree.comparators):
+            right = eval_cond(comparator, values)
+            if not _COMPARE_OPS[type(op)](left, right):
+                return False
+            left = right
+        return True
+    if isinstance(tree, ast.Name):
+        return values[tree.id]
+    return tree.value
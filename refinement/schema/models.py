@@ -2,10 +2,11 @@
 
 from typing import List, Optional, Literal, Any, Dict
 from pydantic import BaseModel, Field, field_validator, model_validator
+from .cond import parse_cond, cond_names
 
 # ------------- конфиг: допустимые хук-имена и типы шага -------------
 # ------------- (константы, из которых валидаторы потом проверяют корректность)
-ALLOWED_STEP_TYPES = {"fit", "block", "noop"}
+ALLOWED_STEP_TYPES = {"fit", "block", "parallel", "noop"}
 ALLOWED_PRE_KEYS = {"cancel_lastref",
                     "undate_init_val",
                     "fix",
@@ -16,7 +17,11 @@ ALLOWED_HOOKS = {"free_params",
                  "save_plot", 
                  "report_delta", 
                  "noop"}
-ALLOWED_COND_NAMES = {"Rp", "chisqr"}
+ALLOWED_COND_NAMES = {"Rp", "Rwp", "Rexp", "chisqr", "redchi", "GoF",
+                      "Rp_seg", "Rwp_seg", "Rexp_seg", "chisqr_seg", "redchi_seg", "GoF_seg"}
+ALLOWED_FIT_MODES = {"lmfit", "jacobian", "varpro", "lebail"}
+ALLOWED_MERGE_POLICIES = {"best_Rp", "disjoint"}
+ALLOWED_CONVERGE_KEYS = {"rel_Rp", "rel_chisqr", "shift_esd", "max_time"}
 
 
 """
@@ -36,16 +41,18 @@ class StepModel(BaseModel):
       - правильность диапазона сегмента и индексов;
       - допустимость хуков pre/post;
       - корректность выражения условия cond;
-      - согласованность вложенной структуры для шага типа 'block'.
+      - согласованность вложенной структуры для шагов типа 'block' и 'parallel'.
 
     Attributes
     ----------
     step_id : str
         Уникальный идентификатор шага.
-    type : Literal['fit', 'block', 'noop']
+    type : Literal['fit', 'block', 'parallel', 'noop']
         Тип шага: 
           - 'fit' — один шаг уточнения параметров;
           - 'block' — контейнер шагов (вложенная структура);
+          - 'parallel' — независимые ветви, выполняемые параллельно
+            (каждая со своей копией параметров) и затем объединяемые;
           - 'noop' — пустой шаг.
     label : str, optional
         Описание шага.
@@ -62,12 +69,33 @@ class StepModel(BaseModel):
     repeat : int, default=1
         Количество повторов шага.
     cond : str, optional
-        Выражение условия выполнения шага.
+        Выражение условия выполнения шага над метриками последнего шага
+        (ALLOWED_COND_NAMES). Шаг выполняется, только если условие истинно;
+        для 'block' условие проверяется перед каждым циклом.
+    converge : dict, optional
+        Критерии сходимости циклов 'block' (ALLOWED_CONVERGE_KEYS):
+          - 'rel_Rp' / 'rel_chisqr' — порог относительного изменения Rp / χ² за цикл;
+          - 'shift_esd' — порог max |Δp| / σ(p) по параметрам, уточнённым в цикле;
+          - 'max_time' — бюджет времени блока, с.
+        Блок останавливается, когда выполнены все заданные пороги изменений
+        или исчерпан бюджет времени.
+    fit_mode : str, optional
+        Режим подгонки (см. refinement.fitting): 'lmfit', 'jacobian', 'varpro'
+        или 'lebail'.
+        Для 'block' и 'parallel' наследуется вложенными шагами без своего fit_mode.
+    merge : str, optional
+        Политика объединения ветвей 'parallel' (ALLOWED_MERGE_POLICIES):
+          - 'best_Rp' (по умолчанию) — результат ветви с наименьшим Rp;
+          - 'disjoint' — объединение параметров, уточнённых в разных ветвях
+            (наборы не должны пересекаться).
+    workers : int, optional
+        Число процессов для 'parallel' (None — по числу ветвей и ядер;
+        1 — ветви выполняются последовательно в текущем процессе).
     steps : list of StepModel, optional
-        Список вложенных шагов для шага типа 'block'.
+        Список вложенных шагов для шага типа 'block' или ветвей шага 'parallel'.
     """
     step_id:     str = Field(..., min_length=1)          # обязательно, минимум 1 символ.
-    type:        Literal['fit', 'block', 'noop']         # fit   → один шаг, block → контейнер шагов, noop  → пустой шаг 
+    type:        Literal['fit', 'block', 'parallel', 'noop']  # fit → один шаг, block → контейнер шагов, parallel → ветви в процессах, noop → пустой шаг
     label:       Optional[str] = None                    # описание
     params:      Optional[List[str]] = None              # список параметров (только для fit)
     segment:     Optional[List[Optional[float]]] = None  # диапазон углов [startθ, endθ]
@@ -76,6 +104,10 @@ class StepModel(BaseModel):
     post:        Optional[List[str]] = None              # хуки до и после шага
     repeat:      int = Field(1, ge=1)                    # сколько раз повторять (по умолчанию 1)
     cond:        Optional[str] = None                    # условие
+    converge:    Optional[Dict[str, float]] = None       # критерии сходимости block
+    fit_mode:    Optional[str] = None                    # режим подгонки (None → 'lmfit')
+    merge:       Optional[str] = None                    # объединение ветвей parallel (None → 'best_Rp')
+    workers:     Optional[int] = Field(None, ge=1)       # число процессов для parallel
     steps:       Optional[List["StepModel"]] = None      # класс ссылается сам на себя (рекурсивная структура)
 
     # -------- params ----------------------------------------------------
@@ -192,21 +224,52 @@ class StepModel(BaseModel):
         """
         Проверка выражения условия выполнения шага.
 
-        Условие может содержать только допустимые символы и должно ссылаться
-        хотя бы на одну разрешённую метрику (например, `Rp` или `chisqr`).
+        Выражение разбирается ast (schema.cond.parse_cond): допустимы только
+        and / or / not, сравнения, арифметика, числа и разрешённые метрики
+        (ALLOWED_COND_NAMES: `Rp`, `Rwp`, `chisqr`, `GoF`, ...; суффикс
+        `_seg` — метрика по сегменту шага); хотя бы одна метрика обязательна.
 
         Пример допустимого выражения:
             cond: "Rp < 0.05 and chisqr < 1.5"
         """
         if v is None:
             return v
-        allowed_chars = set("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_ <>!=().+-*/")
-        if any(ch not in allowed_chars for ch in v):
-            raise ValueError("выражение 'cond' содержит недопустимые символы")
-        if not any(name in v for name in ALLOWED_COND_NAMES):
+        tree = parse_cond(v, frozenset(ALLOWED_COND_NAMES))
+        if not cond_names(tree):
             raise ValueError("выражение 'cond' должно содержать хотя бы одну допустимую метрику: " + ", ".join(ALLOWED_COND_NAMES))
         return v
 
+    # -------- convergence -----------------------------------------------
+    @field_validator('converge')
+    def validate_converge(cls, v, info):
+        """ Критерии сходимости: только для 'block', ключи из ALLOWED_CONVERGE_KEYS, значения > 0 """
+        if v is None:
+            return v
+        if info.data.get('type') != 'block':
+            raise ValueError("поле 'converge' допустимо только для шага type='block'")
+        for key, val in v.items():
+            if key not in ALLOWED_CONVERGE_KEYS:
+                raise ValueError(f"критерий '{key}' не входит в список допустимых: {ALLOWED_CONVERGE_KEYS}")
+            if not val > 0:
+                raise ValueError(f"порог критерия '{key}' должен быть положительным")
+        return v
+
+    # -------- fit mode -------------------------------------------------
+    @field_validator('fit_mode')
+    def validate_fit_mode(cls, v):
+        """ Режим подгонки должен входить в ALLOWED_FIT_MODES """
+        if v is not None and v not in ALLOWED_FIT_MODES:
+            raise ValueError(f"режим подгонки '{v}' не входит в список допустимых: {ALLOWED_FIT_MODES}")
+        return v
+
+    # -------- merge policy ---------------------------------------------
+    @field_validator('merge')
+    def validate_merge(cls, v):
+        """ Политика объединения ветвей должна входить в ALLOWED_MERGE_POLICIES """
+        if v is not None and v not in ALLOWED_MERGE_POLICIES:
+            raise ValueError(f"политика объединения '{v}' не входит в список допустимых: {ALLOWED_MERGE_POLICIES}")
+        return v
+
     # -------- block logic --------------------------------------------
     @model_validator(mode='after')
     def validate_block_structure(self):
@@ -214,14 +277,24 @@ class StepModel(BaseModel):
         Проверка согласованности структуры шага.
 
         Правила:
-        - шаг типа `block` должен содержать поле `steps` со списком вложенных шагов;
-        - для шагов других типов поле `steps` не допускается.
+        - шаги типа `block` и `parallel` должны содержать поле `steps` со списком вложенных шагов;
+        - для шагов других типов поле `steps` не допускается;
+        - поля `merge` и `workers` допускаются только для шага типа `parallel`;
+        - ветви `parallel` должны иметь уникальные step_id.
         """
-        if self.type == "block" and self.steps is None:
-            raise ValueError("для шага type='block' необходимо указать поле 'steps' со списком вложенных шагов")
+        if self.type in ("block", "parallel") and self.steps is None:
+            raise ValueError(f"для шага type='{self.type}' необходимо указать поле 'steps' со списком вложенных шагов")
+
+        if self.type not in ("block", "parallel") and self.steps is not None:
+            raise ValueError("поле 'steps' допускается только для шагов type='block' и type='parallel'")
+
+        if self.type != "parallel" and (self.merge is not None or self.workers is not None):
+            raise ValueError("поля 'merge' и 'workers' допускаются только для шага type='parallel'")
 
-        if self.type != "block" and self.steps is not None:
-            raise ValueError("поле 'steps' допускается только для шага type='block'")
+        if self.type == "parallel":
+            ids = [s.step_id for s in self.steps]
+            if len(ids) != len(set(ids)):
+                raise ValueError("идентификаторы ветвей шага type='parallel' должны быть уникальными")
         return self
 
 
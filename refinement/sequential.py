@@ -0,0 +1,206 @@
+import os
+import re
+import glob
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from .session import RefinementSession
+from .history_store import HistoryStore
+from .execution import execute_schema, PARALLEL_START_METHOD, _worker_inputs, _restore_worker_inputs
+
+
+"""
+Последовательное уточнение серии профилей (температурная / дозовая серия).
+
+Все профили серии уточняются одной схемой; начальные параметры каждого
+профиля — результат предыдущего. Меняется только y_obs проекта, поэтому
+скомпилированная модель (кэш compile_project: ключ — раскладка θ, фазы,
+фон и ось, но не y_obs), стадии snapshot-пути и модель pr.model
+переиспользуются без пересборки.
+
+    профили (каталог)          цепочка 0: p₀ → профиль 1 → профиль 2 → ...
+          │                    цепочка 1: p₀ → профиль k+1 → ...     ← ProcessPoolExecutor (spawn)
+          ├── set_observed(pr, 2θ, I)      # подмена Profile_points.I_obs_calibr
+          ├── execute_schema(копия схемы)  # маркеры refonly раскрываются заново для каждого профиля
+          └── HistoryStore(store/chain_XXX)   # строки шагов с полем pattern
+          │
+          ▼
+    [{pattern, chain, params, metrics}]   +   sequential_frame(store) → pandas
+
+Цепочки независимы: каждая начинается с одних и тех же параметров out0
+и уточняет свой непрерывный отрезок серии. У каждой цепочки своё
+хранилище истории (дозапись в один каталог из разных процессов
+перемешала бы строки). Процессы цепочек создаются через spawn (fork
+после JAX блокирует дочерние процессы): цепочке передаются Project без
+модели и Parameters out0, модель собирается в процессе заново.
+"""
+
+
+# ---- Профили ----
+def _natural_key(path):
+    """ Ключ сортировки «как у человека»: profile2 < profile10 """
+    return [int(t) if t.isdigit() else t for t in re.split(r"(\d+)", os.path.basename(path))]
+
+
+def list_profiles(directory, pattern="*.txt"):
+    """ Файлы профилей серии в естественном порядке имён """
+    files = sorted(glob.glob(os.path.join(directory, pattern)), key=_natural_key)
+    if not files:
+        raise ValueError(f"В каталоге {directory} нет профилей по шаблону {pattern}")
+    return files
+
+
+def load_profile(path):
+    """ Профиль из текстового файла: столбцы 2θ и I (как examples/*/Profile1.txt) """
+    data = np.loadtxt(path)
+    return data[:, 0], data[:, 1]
+
+
+def set_observed(pr, two_theta, I_obs):
+    """
+    Подставляет наблюдаемый профиль в проект.
+
+    Ось, совпадающая с текущей, не меняется (скомпилированная модель из
+    кэша); другая ось заменяется, и модель будет собрана заново.
+    """
+    points = pr.Profile_points
+    two_theta = np.asarray(two_theta, dtype=float)
+    if not np.array_equal(np.asarray(points.two_theta, dtype=float), two_theta):
+        if len(two_theta) != len(I_obs):
+            raise ValueError("Длины оси 2θ и профиля I_obs не совпадают")
+        points.two_theta = two_theta
+    points.I_obs_calibr = np.asarray(I_obs, dtype=float)
+
+
+# ---- Одна цепочка ----
+def run_chain(schema_steps, pr, out0, files, store=None, fit_mode=None, chain=0, pylogger="RefinementStep"):
+    """
+    Уточняет профили files по порядку, передавая параметры дальше.
+
+    Parameters
+    ----------
+    schema_steps : list[StepModel]
+    pr : Project
+    out0 : lmfit.ModelResult
+        Начальная точка первого профиля цепочки.
+    files : list of str
+    store : str, optional
+        Каталог HistoryStore цепочки.
+    fit_mode : str, optional
+    chain : int
+        Номер цепочки (поле результата).
+
+    Returns
+    -------
+    list of dict : pattern, chain, params, metrics (session.last_metrics)
+    """
+    history = HistoryStore(store) if store is not None else None
+    out_prev, results = out0, []
+    for path in files:
+        set_observed(pr, *load_profile(path))
+        pattern = os.path.basename(path)
+        session = RefinementSession(pylogger=pylogger)
+        session.history_store = history
+        session.tags = {"pattern": pattern}
+        steps = [step.model_copy(deep=True) for step in schema_steps]
+        out_prev = execute_schema(steps, pr, out_prev, session, fit_mode=fit_mode)
+        results.append({"pattern": pattern, "chain": chain,
+                        "params": out_prev.params, "metrics": session.last_metrics()})
+    return results
+
+
+# ---- Серия ----
+def _run_chain(task):
+    """ Выполняет одну цепочку (в процессе пула — из _worker_inputs, иначе из pr / out0) """
+    inputs = task["inputs"]
+    pr, out0 = _restore_worker_inputs(inputs) if isinstance(inputs, dict) else inputs
+    return run_chain(task["schema_steps"], pr, out0, task["files"], store=task["store"],
+                     fit_mode=task["fit_mode"], chain=task["chain"], pylogger=task["pylogger"])
+
+
+def run_sequential(schema_steps, pr, out0, profiles, store=None, fit_mode=None, chains=1, workers=None,
+                   pattern="*.txt", start_method=PARALLEL_START_METHOD, pylogger="RefinementStep"):
+    """
+    Последовательное уточнение серии профилей одной схемой.
+
+    Parameters
+    ----------
+    schema_steps : list[StepModel]
+    pr : Project
+        Проект с моделью; его Profile_points подменяются профилями серии.
+    out0 : lmfit.ModelResult
+        Начальные параметры (результат уточнения первого профиля или
+        исходная модель).
+    profiles : str or list of str
+        Каталог серии (файлы по шаблону pattern) или список файлов.
+    store : str, optional
+        Каталог истории: store/chain_XXX — HistoryStore каждой цепочки.
+    fit_mode : str, optional
+    chains : int
+        Число независимых цепочек: серия делится на chains непрерывных
+        отрезков, каждый начинается с out0.
+    workers : int, optional
+        Число процессов для цепочек (None — min(chains, число ядер);
+        1 — цепочки выполняются последовательно в текущем процессе).
+    start_method : str
+        "spawn" или "forkserver"; "fork" недопустим (после JAX дочерние
+        процессы блокируются).
+
+    Returns
+    -------
+    list of dict
+        pattern, chain, params, metrics — по одному на профиль, в порядке серии.
+
+    Примечания
+    ---------
+    - Схема копируется для каждого профиля: execute_step заменяет маркеры
+      refonly реальными параметрами в самом StepModel.
+    - Параметры, добавленные в corrections / calibrate на одном профиле,
+      остаются в настройках фаз для следующих профилей цепочки.
+    """
+    files  = list_profiles(profiles, pattern) if isinstance(profiles, str) else list(profiles)
+    chunks = [list(chunk) for chunk in np.array_split(np.array(files, dtype=object), max(1, min(chains, len(files))))]
+    workers = workers or min(len(chunks), os.cpu_count() or 1)
+    pooled  = workers > 1 and len(chunks) > 1 and start_method in mp.get_all_start_methods()
+    if pooled and start_method == "fork":
+        raise ValueError("run_sequential: start_method='fork' недопустим (fork после JAX блокирует процессы)")
+
+    inputs = _worker_inputs(pr, out0) if pooled else (pr, out0)
+    tasks  = [{"schema_steps": schema_steps, "inputs": inputs, "files": files_k, "chain": k,
+               "store": None if store is None else os.path.join(store, f"chain_{k:03d}"),
+               "fit_mode": fit_mode, "pylogger": pylogger}
+              for k, files_k in enumerate(chunks)]
+    if pooled:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context(start_method)) as pool:
+            results = list(pool.map(_run_chain, tasks))
+    else:
+        results = [_run_chain(task) for task in tasks]
+    return [res for chain in results for res in chain]
+
+
+def sequential_frame(store, kind=None):
+    """
+    История серии из всех цепочек store/chain_XXX.
+
+    Parameters
+    ----------
+    kind : None, "value" или "stderr"
+        None — метрики и метаданные шагов (HistoryStore.to_frame),
+        иначе — значения / ESD параметров (HistoryStore.parameter_frame).
+
+    Returns
+    -------
+    pandas.DataFrame с дополнительным столбцом chain
+    """
+    frames = []
+    for chain, path in enumerate(sorted(glob.glob(os.path.join(store, "chain_*")))):
+        history = HistoryStore(path)
+        frame = history.to_frame()
+        if kind is not None:
+            patterns = frame["pattern"]
+            frame = history.parameter_frame(kind)
+            frame.insert(0, "pattern", patterns)
+        frame.insert(0, "chain", chain)
+        frames.append(frame)
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
@@ -5,6 +5,7 @@ import pandas as pd
 import matplotlib.pyplot as plt
 from datetime import datetime
 import pickle
+import time
 import os
 
 from utils.logging_setup import logger, BASE_FORMAT
@@ -17,6 +18,8 @@ from refinement.logutils.formatting import (
     SEPARATOR
 )
 from .param_utils import parse_background_param, format_value, format_dperc, split_param_groups
+from .schema.models import ALLOWED_COND_NAMES
+from .history_store import HistoryStore
 
 
 """
@@ -71,6 +74,9 @@ class RefinementSession:
     save_step(...)
         Сохранить информацию о шаге в историю.
 
+    attach_store(...)
+        Подключить колоночную историю на диске (history_store).
+
     summary()
         Вывести итоговую сводку refinement.
 
@@ -111,11 +117,25 @@ class RefinementSession:
         self.logger = logger.bind(pylogger=pylogger)
         self.history = []
         self.prev_Rp = None
+        self.current_metrics = {}
         self.current_cycle = None
         self.live = None
         self.log_indent = None
         self.iter_exec_step = 0      # нумератор шагов execute_step
         self.iter_exec_schema = 0    # нумератор вызовов execute_schema
+        self.trace = []              # решения исполнителя схемы: [вид, step_path] (refinement.checkpoint)
+        self.replay_pos = 0          # позиция повторного прохода trace при возобновлении
+        self.replay_end = 0          # число решений trace из контрольной точки
+        self.checkpoint_path = None  # файл контрольной точки (None — не писать)
+        self.history_saved = 0       # записей history, уже дописанных в файл истории контрольной точки
+        self.open_blocks = {}        # step_path → начало текущего цикла открытого блока (checkpoint_state)
+        self.resumed_blocks = {}     # open_blocks из контрольной точки (для цикла, где кончается повтор)
+        self.resume_t0 = None        # время возобновления (perf_counter)
+        self.history_store = None    # колоночная история на диске (attach_store)
+        self.history_store_rows = 0  # строк history_store, дописанных этой сессией (последние строки store)
+        self.tags = {}               # поля, добавляемые в каждую запись истории (например, pattern серии)
+        self.seed_metrics = {}       # метрики до первого шага (ветвь 'parallel' — метрики шага перед ней)
+        self._step_t0 = None
         
     def _get_log_indent(self):
         prefix = self.live._build_prefix()
@@ -147,6 +167,7 @@ class RefinementSession:
         step_path : str
             Идентификатор шага в дереве refinement (напр., 007.001).
         """
+        self._step_t0 = time.perf_counter()
         header_text = format_step_header(step_path, name, n_params, segment, depth)
         # --- создаём live ---
         self.live = LiveHeader(pylogger=self.pylogger, logger=self.logger, base_format=BASE_FORMAT)
@@ -161,6 +182,11 @@ class RefinementSession:
         line = format_cycle_header(step_path=step_path, depth=depth, kind="block", label=f"{label} ×{repeat}")
         self.logger.info(line)
 
+    # ---------- PARALLEL START ----------
+    def start_parallel(self, label, step_path, n_branches, depth):
+        line = format_cycle_header(step_path=step_path, depth=depth, kind="parallel", label=f"{label} ∥{n_branches}")
+        self.logger.info(line)
+
     # ---------- CYCLE START ----------
     def start_cycle(self, label, step_path, idx, total, depth):
         self.current_cycle = idx
@@ -168,6 +194,26 @@ class RefinementSession:
         self.logger.info(line)
 
 
+    # ---------- BLOCK STOP ----------
+    def stop_block(self, step_path, idx, total, depth, reason):
+        """ Блок завершён досрочно после цикла idx (сходимость или бюджет времени) """
+        line = format_cycle_header(step_path=step_path, depth=depth, kind="stop", idx=idx, total=total, label=reason)
+        self.logger.info(line)
+
+    # ---------- STEP SKIP ----------
+    def skip_step(self, label, step_path, depth, cond):
+        """ Шаг не выполнен: условие cond ложно """
+        line = format_cycle_header(step_path=step_path, depth=depth, kind="skip", label=f"{label}: not ({cond})")
+        self.logger.info(line)
+
+    # ---------- METRICS ----------
+    def last_metrics(self):
+        """ Метрики последнего шага истории (Rp, Rwp, chisqr, ...); seed_metrics — шагов ещё не было """
+        if not self.history:
+            return dict(self.seed_metrics)
+        return {name: self.history[-1].get(name) for name in ALLOWED_COND_NAMES}
+
+
     def rollback_to_schema(self, schema_no: int):
         """
         Откатить историю и состояние сессии к концу указанной схемы (iter_exec_schema).
@@ -176,9 +222,15 @@ class RefinementSession:
         ----------
         schema_no : int
             Номер схемы (iter_exec_schema), до которой откатываемся.
-            Все шаги после этой схемы будут удалены из history.
+            Все шаги после этой схемы будут удалены из history
+            и из history_store (если подключено).
         """
+        n_before = len(self.history)
         self.history = [h for h in self.history if h["iter_exec_schema"] <= schema_no]  # оставляем только шаги с iter_exec_schema <= schema_no
+        if self.history_store is not None:                              # те же шаги — из конца history_store
+            n_drop = min(n_before - len(self.history), self.history_store_rows)
+            self.history_store.truncate(len(self.history_store) - n_drop)
+            self.history_store_rows -= n_drop
         remaining_steps = [h["iter_exec_step"] for h in self.history]    # сброс счетчика шагов на последний шаг оставшейся схемы
         self.iter_exec_step = max(remaining_steps, default=0)
         self.iter_exec_schema = schema_no                                # сброс счетчика схем на откатанную
@@ -189,7 +241,7 @@ class RefinementSession:
 
 
     # ---------- REPORT METRICS ----------
-    def report_Rp(self, Rp):
+    def report_Rp(self, Rp, metrics=None):
         """
         Завершить текущий шаг и вывести значение Rp.
 
@@ -202,6 +254,9 @@ class RefinementSession:
         ----------
         Rp : float
             Значение R-фактора после завершения шага refinement.
+        metrics : dict, optional
+            Остальные метрики шага (refinement.metrics.profile_metrics:
+            Rwp, Rexp, chisqr, redchi, GoF и *_seg); сохраняются в history.
         """
         if self.prev_Rp is None:
             text = f"Rp {Rp:.3f}%"
@@ -226,6 +281,7 @@ class RefinementSession:
             self.logger.info(final_suffix)
         self.prev_Rp = Rp
         self.current_Rp = Rp
+        self.current_metrics = {k: v for k, v in (metrics or {}).items() if k != "Rp"}
 
 
 
@@ -370,7 +426,7 @@ class RefinementSession:
 
 
     # ---------- SAVE STEP ----------
-    def save_step(self, label, step_path=None, depth=None, params=None):
+    def save_step(self, label, step_path=None, depth=None, params=None, result=None):
         """
         Сохранить информацию о выполненном шаге в историю refinement.
 
@@ -384,16 +440,68 @@ class RefinementSession:
             Уровень вложенности шага.
         params : list[str], optional
             Список параметров, уточняемых на шаге.
+        result : lmfit.ModelResult, optional
+            Результат шага: значения / ESD параметров и nfev пишутся
+            в history_store (если подключено).
         """
-        self.history.append({"iter_exec_schema": self.iter_exec_schema,
-                             "iter_exec_step": self.iter_exec_step,
-                             "label": label,
-                             "step_path": step_path,
-                             "cycle": self.current_cycle,
-                             "depth": depth,
-                             "params": params,
-                             "timestamp": datetime.now(),
-                             "Rp": self.current_Rp})
+        entry = {"iter_exec_schema": self.iter_exec_schema,
+                 "iter_exec_step": self.iter_exec_step,
+                 "label": label,
+                 "step_path": step_path,
+                 "cycle": self.current_cycle,
+                 "depth": depth,
+                 "params": params,
+                 "timestamp": datetime.now(),
+                 "Rp": self.current_Rp,
+                 **self.current_metrics,
+                 **self.tags}
+        self.history.append(entry)
+        if self.history_store is not None:
+            elapsed = None if self._step_t0 is None else time.perf_counter() - self._step_t0
+            self.history_store.append(entry,
+                                      params=getattr(result, "params", None),
+                                      nfev=getattr(result, "nfev", None),
+                                      elapsed=elapsed)
+            self.history_store_rows += 1
+
+    # ---------- HISTORY STORE ----------
+    def attach_store(self, path):
+        """
+        Подключить колоночную историю на диске (refinement.history_store).
+
+        Каждый save_step дозаписывает строку (значения и ESD параметров,
+        метрики, nfev, время шага); autosave при этом историю не пишет.
+        """
+        self.history_store = HistoryStore(path)
+        return self.history_store
+
+    # ---------- MERGE BRANCH HISTORY ----------
+    def merge_history(self, entries, branch=None):
+        """
+        Добавить в историю шаги, выполненные в отдельной сессии
+        (ветвь шага 'parallel', выполненная в другом процессе).
+
+        Нумерация iter_exec_schema / iter_exec_step и номер цикла
+        заменяются текущими значениями этой сессии.
+
+        Parameters
+        ----------
+        entries : list[dict]
+            История дочерней сессии (RefinementSession.history).
+        branch : str, optional
+            Идентификатор ветви; сохраняется в поле "branch".
+        """
+        for entry in entries:
+            self.iter_exec_step += 1
+            entry = {**entry,
+                     "iter_exec_schema": self.iter_exec_schema,
+                     "iter_exec_step": self.iter_exec_step,
+                     "cycle": self.current_cycle,
+                     "branch": branch}
+            self.history.append(entry)
+            if self.history_store is not None:
+                self.history_store.append(entry)
+                self.history_store_rows += 1
 
     # ---------- SUMMARY ----------
     def summary(self):
@@ -410,7 +518,11 @@ class RefinementSession:
         print("FINAL SUMMARY")
         print("═" * 40)
 
-        df = pd.DataFrame(self.history)
+        if self.history_store is not None and self.history_store_rows:
+            # в store могут быть строки других запусков в том же каталоге — только строки этой сессии
+            df = self.history_store.to_frame().iloc[-self.history_store_rows:].reset_index(drop=True)
+        else:
+            df = pd.DataFrame(self.history)
         df["params"] = df["params"].apply(lambda x: ", ".join(x) if x else "")
         df = df.set_index("iter_exec_step")
         df.index.name = "step"
@@ -440,6 +552,31 @@ class RefinementSession:
             "current_cycle": self.current_cycle,
             "iter_exec_step": self.iter_exec_step,
             "iter_exec_schema": self.iter_exec_schema,
+            "trace": self.trace,
+            "history_rows": len(self.history_store) if self.history_store is not None else None,
+            "history_store_rows": self.history_store_rows,
+        }
+    
+
+    def checkpoint_state(self):
+        """
+        Состояние для контрольной точки: без истории (она дописывается
+        в отдельный файл), размер не растёт с числом шагов.
+        """
+        now = time.perf_counter()
+        return {
+            "pylogger": self.pylogger,
+            "prev_Rp": self.prev_Rp,
+            "current_cycle": self.current_cycle,
+            "iter_exec_step": self.iter_exec_step,
+            "iter_exec_schema": self.iter_exec_schema,
+            "trace": self.trace,
+            "history_len": len(self.history),
+            "history_rows": len(self.history_store) if self.history_store is not None else None,
+            "history_store_rows": self.history_store_rows,
+            "open_blocks": {path: {**{k: v for k, v in block.items() if k != "t_start"},
+                                   "elapsed": now - block["t_start"]}
+                            for path, block in self.open_blocks.items()},
         }
     
 
@@ -450,14 +587,28 @@ class RefinementSession:
         Создать объект RefinementSession из словаря.
         """
         obj = cls(pylogger=data.get("pylogger", "RefinementStep"))
-
-        obj.history = data.get("history", [])
-        obj.prev_Rp = data.get("prev_Rp")
-        obj.current_cycle = data.get("current_cycle")
-        obj.iter_exec_step = data.get("iter_exec_step", 0)
-        obj.iter_exec_schema = data.get("iter_exec_schema", 0)
+        obj.load_state(data)
         return obj
 
+    def load_state(self, data):
+        """
+        Восстановить состояние этой сессии из словаря to_dict()
+        (возобновление схемы из контрольной точки).
+        """
+        self.history = data.get("history", [])
+        self.prev_Rp = data.get("prev_Rp")
+        self.current_cycle = data.get("current_cycle")
+        self.iter_exec_step = data.get("iter_exec_step", 0)
+        self.iter_exec_schema = data.get("iter_exec_schema", 0)
+        self.trace = [list(entry) for entry in data.get("trace", [])]
+        self.replay_pos = 0
+        self.replay_end = len(self.trace)
+        self.resumed_blocks = dict(data.get("open_blocks", {}))
+        # строки history_store, записанные после сохранения состояния, отбрасываются
+        if self.history_store is not None and data.get("history_rows") is not None:
+            self.history_store.truncate(data["history_rows"])
+        self.history_store_rows = data.get("history_store_rows", 0)
+
 
     # ---- Сохранение в файл -------
  #   def save(self, path):
@@ -505,6 +656,8 @@ class RefinementSession:
 
     # ---- Автосохранение -------
     def autosave(self):
+        if self.history_store is not None:     # история уже на диске построчно
+            return
         self.save(f"session_autosave_{self.iter_exec_schema}.pkl")
 
 
@@ -0,0 +1,125 @@
+import os
+import jax
+jax.config.update("jax_enable_x64", True)                    # модели рассчитаны на float64 (как в ноутбуках)
+import numpy as np
+import pytest
+from lmfit import Parameters
+from lmfit.model import ModelResult
+from atoms.scattering_factors.it4322_params import PARAM
+from phases.bragg_pos.io import load_bragg_positions
+from phases.models import par_form_dict
+from diffraction.model import build_total_model_from_snapshot
+from diffraction.snapshot import project_to_snapshot
+
+
+"""
+Проект без фаз (project) и снимок CaF₂ (caf2: Fm-3m, Ca на 4a, F на 8c,
+рефлексы и профиль examples/0015_CaF2).
+
+Проект без фаз — только фон Лежандра (bckg0..bckg3): его снимок и модель
+собираются без данных о кристаллических структурах, а сам объект
+сериализуется pickle (процессы пула spawn).
+"""
+
+
+class _BackgroundSettings:
+    def to_legacy_dict(self):
+        return {"background": {"type": "Legendre"}}
+
+
+class _ProfilePoints:
+    def __init__(self, two_theta, I_obs_calibr):
+        self.two_theta    = two_theta
+        self.I_obs_calibr = I_obs_calibr
+        self.settings     = _BackgroundSettings()
+        self.knots        = {}
+        self.params       = {}
+
+
+class _Project:
+    NPhases = 0
+    phases  = []
+
+    def __init__(self, two_theta, I_obs_calibr):
+        self.Profile_points = _ProfilePoints(two_theta, I_obs_calibr)
+        self.model = build_total_model_from_snapshot(project_to_snapshot(self))
+
+
+def background_params(*values):
+    params = Parameters()
+    for n, value in enumerate(values):
+        params.add(f"bckg{n}", value=value)
+    return params
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    """ (pr, out0): профиль — фон с bckg = 5, −1, 0.5, 0.2; out0 — начальные значения рядом """
+    monkeypatch.chdir(tmp_path)                             # session.autosave пишет в текущий каталог
+    two_theta = np.linspace(0.5, 4.0, 400)
+    pr = _Project(two_theta, np.zeros_like(two_theta))
+    true = background_params(5.0, -1.0, 0.5, 0.2)
+    pr.Profile_points.I_obs_calibr = np.asarray(pr.model.eval(true, axes=two_theta))
+
+    params = background_params(4.0, -0.5, 0.3, 0.1)
+    out0 = ModelResult(pr.model, params, data=pr.Profile_points.I_obs_calibr)
+    out0.init_params = params
+    out0.userkws     = {"axes": two_theta}
+    pr.model.eval(params, axes=two_theta)                   # JAX уже работал в текущем процессе
+    return pr, out0
+
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "examples")
+
+
+def fm3m_operations():
+    """ Операции Fm-3m: 48 поворотов m-3m × 4 трансляции центрировки F """
+    generators = [np.array([[0, -1, 0], [1, 0, 0], [0, 0, 1]]), np.array([[0, 0, 1], [1, 0, 0], [0, 1, 0]]),
+                  -np.eye(3, dtype=int)]
+    rotations, frontier = {tuple(np.eye(3, dtype=int).ravel())}, [np.eye(3, dtype=int)]
+    while frontier:
+        products = [g @ r for r in frontier for g in generators]
+        frontier = [p for p in products if tuple(p.ravel()) not in rotations]
+        rotations.update(tuple(p.ravel()) for p in frontier)
+    centering = [np.zeros(3), np.array([0, .5, .5]), np.array([.5, 0, .5]), np.array([.5, .5, 0])]
+    return [[c, np.array(r, dtype=float).reshape(3, 3)] for c in centering for r in sorted(rotations)]
+
+
+def _it4322(element):
+    coefs = PARAM['elements'][element]
+    return {"A": np.array([coefs[f'a{i}'] for i in range(1, 6)]),
+            "B": np.array([coefs[f'b{i}'] for i in range(1, 6)])}
+
+
+@pytest.fixture
+def caf2():
+    """ (snapshot, params, two_theta): CaF₂, форма PseudoVoigt, фон Лежандра """
+    bragg   = load_bragg_positions(os.path.join(EXAMPLES, "0015_CaF2", "Phase1_bragg_positions.txt"))
+    profile = np.loadtxt(os.path.join(EXAMPLES, "0015_CaF2", "Profile1.txt"))
+    atoms = [{"name": name, "Z": Z, "fe_from": "it4322", "it4322": _it4322(name), "curves": None, "KPhase": 1}
+             for name, Z in (("Ca", 20), ("F", 9))]
+    snapshot = {"phases": {"Phase1": {"prefix": "Phase1_", "bragg_positions": bragg, "atoms": atoms,
+                                      "symmetry_operations": fm3m_operations(), "wavelength": 0.0251,
+                                      "settings": {"typeref": "Rietveld", "form": "PseudoVoigt",
+                                                   "internal_scale": 1.0, "calibration_mode": False,
+                                                   "calibrate": [], "corrections": []}}},
+                "profile": {"data": {"two_theta": profile[:, 0], "I_obs_calibr": profile[:, 1]},
+                            "background_type": "Legendre", "knots": {"x": []}}}
+
+    params = Parameters()
+    for name, value in zip(["a", "b", "c", "alpha", "beta", "gamma"], [5.46107] * 3 + [90.0] * 3):
+        params.add("Phase1_" + name, value, vary=False)
+    params.add("Phase1_scale", 1e-3)
+    params.add("Phase1_Biso_overall", 0.3)
+    for name, xyz in (("Ca", (0.0, 0.0, 0.0)), ("F", (0.25, 0.25, 0.25))):
+        for c, value in zip("xyz", xyz):
+            params.add(f"Phase1_{name}_{c}", value, vary=False)
+        params.add(f"Phase1_{name}_occ", 1.0, vary=False)
+        params.add(f"Phase1_{name}_Biso", 0.5)
+    shape = {"σ": 0.01, "η": 0.5}
+    for par in par_form_dict["PseudoVoigt"]:
+        if par["name"] not in ("A", "μ"):
+            params.add(f"Phase1_PseudoVoigt_{par['name']}", shape.get(par["name"], par["value"]))
+    for n, value in enumerate([50.0, -5.0, 2.0, 0.5]):
+        params.add(f"bckg{n}", value)
+    return snapshot, params, profile[:, 0]
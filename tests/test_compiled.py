@@ -0,0 +1,40 @@
+import copy
+import numpy as np
+from diffraction.compiled import compile_project, clear_compiled_cache
+
+
+"""
+Кэш compile_project: модель, собранная для F на 8c (¼, ¼, ¼), не
+переиспользуется для F на общей позиции (x, x, x), а смена данных fₑₗ
+(it4322) даёт новую модель.
+"""
+
+
+def _moved(params, name, value):
+    moved = params.copy()
+    for c in "xyz":
+        moved[f"Phase1_{name}_{c}"].value = value
+    return moved
+
+
+def test_compiled_cache_follows_wyckoff_position(caf2):
+    snapshot, params, two_theta = caf2
+    clear_compiled_cache()
+    special = compile_project(snapshot, params)
+    general_params = _moved(params, "F", 0.3)
+    general = compile_project(snapshot, general_params)
+    assert general is not special
+    assert compile_project(snapshot, _moved(params, "F", 0.31)) is general
+
+    clear_compiled_cache()
+    fresh = compile_project(snapshot, general_params)
+    np.testing.assert_allclose(general.eval(general_params, axes=two_theta),
+                               fresh.eval(general_params, axes=two_theta), rtol=1e-12)
+
+
+def test_compiled_cache_keys_on_scattering_factor_data(caf2):
+    snapshot, params, _ = caf2
+    clear_compiled_cache()
+    other = copy.deepcopy(snapshot)
+    other["phases"]["Phase1"]["atoms"][1]["it4322"]["A"] = other["phases"]["Phase1"]["atoms"][1]["it4322"]["A"] * 1.01
+    assert compile_project(other, params) is not compile_project(snapshot, params)
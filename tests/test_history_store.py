@@ -0,0 +1,44 @@
+import matplotlib
+matplotlib.use("Agg")
+
+import refinement.session as session_module
+from refinement.session import RefinementSession
+
+
+"""
+Откат сессии с подключённым HistoryStore: строки отменённой схемы
+удаляются и из store, summary() показывает только строки этой сессии
+(каталог store уже содержит строки предыдущего запуска).
+"""
+
+
+def _run(session, Rps):
+    session.iter_exec_schema += 1
+    for Rp in Rps:
+        session.iter_exec_step += 1
+        session.current_Rp = Rp
+        session.save_step("STEP", params=["bckg0"])
+
+
+def test_rollback_truncates_store_and_summary_uses_session_rows(tmp_path, monkeypatch):
+    earlier = RefinementSession()
+    earlier.attach_store(tmp_path)
+    _run(earlier, [50.0, 40.0])
+
+    session = RefinementSession()
+    store = session.attach_store(tmp_path)
+    _run(session, [30.0, 20.0])
+    _run(session, [10.0])
+    session.rollback_to_schema(1)
+    assert len(store) == 4
+    _run(session, [15.0])
+
+    shown = []
+    monkeypatch.setattr(session_module, "display", shown.append)
+    monkeypatch.setattr(session_module.plt, "show", lambda: None)
+    session.summary()
+    df = shown[0]
+    assert list(df.index) == [1, 2, 3]
+    assert list(df["Rp"]) == [30.0, 20.0, 15.0]
+    assert df["Rp"].iloc[-1] == session.history[-1]["Rp"]
+    assert len(store.to_frame()) == 5
@@ -0,0 +1,41 @@
+import pytest
+from refinement.execution import execute_schema
+from refinement.session import RefinementSession
+from refinement.schema.models import StepModel
+
+
+"""
+Шаг 'parallel' с двумя ветвями: пул процессов (workers=2, spawn) после
+того, как текущий процесс уже выполнял JAX, и последовательный режим
+(workers=1) дают одинаковый результат.
+"""
+
+
+def _parallel(workers, merge="disjoint"):
+    return StepModel(step_id="P", type="parallel", merge=merge, workers=workers, steps=[
+        {"step_id": "A", "type": "fit", "label": "BCKG_LOW",  "params": ["bckg0", "bckg1"]},
+        {"step_id": "B", "type": "fit", "label": "BCKG_HIGH", "params": ["bckg2", "bckg3"]}])
+
+
+def test_parallel_workers_match_serial(project):
+    pr, out0 = project
+    results = {}
+    for workers in (2, 1):
+        session = RefinementSession()
+        out = execute_schema([_parallel(workers)], pr, out0, session)
+        results[workers] = {name: par.value for name, par in out.params.items()}
+        assert sorted(entry["branch"] for entry in session.history if "branch" in entry) == ["A", "B"]
+    assert results[2] == pytest.approx(results[1], rel=1e-10)
+    assert results[2]["bckg0"] != pytest.approx(4.0)
+    assert results[2]["bckg3"] != pytest.approx(0.1)
+
+
+def test_parallel_branch_cond_sees_parent_metrics(project):
+    pr, out0 = project
+    schema = [StepModel(step_id="S", type="fit", label="BCKG0", params=["bckg0"]),
+              StepModel(step_id="P", type="parallel", merge="best_Rp", workers=1, steps=[
+                  {"step_id": "A", "type": "fit", "label": "NEVER", "params": ["bckg1"], "cond": "Rp < 0"},
+                  {"step_id": "B", "type": "fit", "label": "ALWAYS", "params": ["bckg2"], "cond": "Rp >= 0"}])]
+    session = RefinementSession()
+    execute_schema(schema, pr, out0, session)
+    assert [entry.get("branch") for entry in session.history if "branch" in entry] == ["B"]
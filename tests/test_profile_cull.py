@@ -0,0 +1,44 @@
+import numpy as np
+import diffraction.profile as profile
+from diffraction.registry import get_registry
+from phases.bragg_pos.io import as_bragg_table, bragg_hkl
+from phases.params import hkl_to_str
+
+
+"""
+Отсечение рефлексов вне сегмента (segment_phase_snapshot) в режиме
+Ле Бейля: I_hkl отсечённого рефлекса, выросший после построения маски,
+возвращает рефлекс в профиль (как без отсечения).
+"""
+
+
+def test_le_bail_cull_mask_follows_intensities(caf2, monkeypatch):
+    snapshot, params, two_theta = caf2
+    phase = snapshot["phases"]["Phase1"]
+    table = as_bragg_table(phase["bragg_positions"]).copy()
+    table["mode"] = 1
+    phase = {**phase, "bragg_positions": table}
+    snapshot = {**snapshot, "phases": {"Phase1": phase}}
+
+    names  = [f"Phase1_I_{hkl_to_str([int(v) for v in hkl])}" for hkl in bragg_hkl(table)]
+    values = {name: par.value for name, par in params.items()}
+    values.update({name: 0.0 for name in names})
+    registry = get_registry(values)
+    registry.stage_groups(phase)
+    mus = np.asarray(profile._phase_positions(phase, registry, registry.theta_ext(values)))
+
+    axes = two_theta[(two_theta > 2.0) & (two_theta < 2.6)]
+    for name, mu in zip(names, mus):
+        if axes[0] < mu < axes[-1]:
+            values[name] = 100.0
+    outside = np.flatnonzero(mus > axes[-1] + 0.06)[0]          # дальше запаса CULL_MARGIN · FWHM
+
+    calc = lambda v: np.asarray(profile.phase_profile_jax_snap(axes, project_snap=snapshot, phase_name="Phase1", **v))
+    profile.clear_cull_cache()
+    calc(values)                                                 # маска: рефлекс outside отсечён (I = 0)
+    values[names[outside]] = 100.0
+    culled = calc(values)
+
+    monkeypatch.setattr(profile, "CULL_ENABLED", False)
+    full = calc(values)
+    np.testing.assert_allclose(culled, full, atol=1e-9 * np.abs(full).max())
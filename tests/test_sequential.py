@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+from refinement.sequential import run_sequential
+from refinement.schema.models import StepModel
+from conftest import background_params
+
+
+"""
+Серия профилей в двух цепочках: процессы пула (workers=2, spawn) и
+последовательное выполнение (workers=1) дают одинаковые результаты.
+"""
+
+
+@pytest.fixture
+def series(project, tmp_path):
+    pr, out0 = project
+    axes = pr.Profile_points.two_theta
+    for k, factor in enumerate([1.0, 1.1, 1.2, 1.3]):
+        y = np.asarray(pr.model.eval(background_params(5.0 * factor, -1.0, 0.5, 0.2), axes=axes))
+        np.savetxt(tmp_path / f"pat{k+1}.txt", np.c_[axes, y])
+    return str(tmp_path)
+
+
+def test_sequential_chains_workers_match_serial(project, series):
+    pr, out0 = project
+    schema = [StepModel(step_id="1", type="fit", label="BCKG", params=["bckg0", "bckg1", "bckg2", "bckg3"])]
+    results = {}
+    for workers in (2, 1):
+        res = run_sequential(schema, pr, out0, series, chains=2, workers=workers)
+        assert [(r["pattern"], r["chain"]) for r in res] == [("pat1.txt", 0), ("pat2.txt", 0),
+                                                            ("pat3.txt", 1), ("pat4.txt", 1)]
+        results[workers] = [r["params"]["bckg0"].value for r in res]
+    assert results[2] == pytest.approx(results[1], rel=1e-8)
+    assert results[2] == pytest.approx([5.0, 5.5, 6.0, 6.5], rel=1e-4)
+
+
+def test_sequential_rejects_fork(project, series):
+    pr, out0 = project
+    schema = [StepModel(step_id="1", type="fit", label="BCKG", params=["bckg0"])]
+    with pytest.raises(ValueError):
+        run_sequential(schema, pr, out0, series, chains=2, workers=2, start_method="fork")
@@ -0,0 +1,22 @@
+import numpy as np
+from atoms.generate import get_site_table, clear_site_table_cache
+from conftest import fm3m_operations
+
+
+"""
+Таблица позиций (get_site_table) следует за позицией Уайкова атома:
+F на 8c (¼, ¼, ¼) в Fm-3m — 8 позиций, на (x, x, x) с x = 0.3 — 32.
+"""
+
+
+def test_site_table_follows_wyckoff_position():
+    clear_site_table_cache()
+    ops = fm3m_operations()
+    special = get_site_table("Phase1_", [[0, 0, 0], [.25, .25, .25]], ops)
+    general = get_site_table("Phase1_", [[0, 0, 0], [.3, .3, .3]], ops)
+    assert np.bincount(special["atom_map"]).tolist() == [4, 8]
+    assert special["fixed"].tolist() == [True, True]
+    assert np.bincount(general["atom_map"]).tolist() == [4, 32]
+    assert general["fixed"].tolist() == [True, False]
+    assert get_site_table("Phase1_", [[0, 0, 0], [.31, .31, .31]], ops) is general
+    assert np.bincount(get_site_table("Phase1_", [[0, 0, 0], [.25, .25, .25]], ops)["atom_map"]).tolist() == [4, 8]
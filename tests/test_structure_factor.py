@@ -0,0 +1,46 @@
+import numpy as np
+import diffraction.stage_cache as stage_cache
+from diffraction.model import build_total_model_from_snapshot
+from diffraction.compiled import compile_project, clear_compiled_cache
+from diffraction.structure_factor import clear_orbit_table_cache
+from atoms.generate import clear_site_table_cache
+
+
+"""
+Постоянные геометрические факторы Gₐ атомов на частных позициях:
+snapshot-путь пересчитывает их, когда атом уходит с позиции, а
+скомпилированная модель не замораживает Gₐ атома с уточняемыми x, y, z.
+"""
+
+
+def _moved(params, name, value):
+    moved = params.copy()
+    for c in "xyz":
+        moved[f"Phase1_{name}_{c}"].value = value
+    return moved
+
+
+def test_snapshot_model_follows_atom_off_special_position(caf2, monkeypatch):
+    monkeypatch.setattr(stage_cache, "STAGE_CACHE_ENABLED", False)   # F² при каждом вызове — через кэши орбит
+    snapshot, params, two_theta = caf2
+    model   = build_total_model_from_snapshot(snapshot)
+    general = _moved(params, "F", 0.3)
+    model.eval(params, axes=two_theta)                            # таблицы для F на 8c
+    warm = np.asarray(model.eval(general, axes=two_theta))
+
+    clear_site_table_cache()
+    clear_orbit_table_cache()
+    cold = np.asarray(build_total_model_from_snapshot(snapshot).eval(general, axes=two_theta))
+    np.testing.assert_allclose(warm, cold, rtol=1e-10)
+
+
+def test_compiled_varied_special_position_is_not_constant(caf2):
+    snapshot, params, two_theta = caf2
+    params["Phase1_F_x"].vary = True
+    clear_compiled_cache()
+    compiled = compile_project(snapshot, params)
+    shifted  = params.copy()
+    shifted["Phase1_F_x"].value += 1e-3
+    y0 = np.asarray(compiled.eval(params, axes=two_theta))
+    y1 = np.asarray(compiled.eval(shifted, axes=two_theta))
+    assert np.abs(y1 - y0).max() > 1e-6 * np.abs(y0).max()
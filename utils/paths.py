@@ -21,8 +21,8 @@ def get_scattering_path(atom_name):
     return path if path.exists() else None
 
 
-def get_bragg_path(project_name, phase_name):
-    path = _base() / "examples" / project_name / f"{phase_name}_bragg_positions.txt"
+def get_bragg_path(project_name, phase_name, ext=".txt"):
+    path = _base() / "examples" / project_name / f"{phase_name}_bragg_positions{ext}"
     return path if path.exists() else None
 
 